@@ -0,0 +1,133 @@
+"""
+In-memory postings of the pages indexed since the last partial flush.
+
+Terms are interned to small integer IDs, and each term's postings are three
+parallel arrays instead of a dict of Python int lists:
+
+    doc_ids     the documents holding the term, in the order they were added (u32)
+    counts      how often the term occurs in each of them (u32)
+    positions   their positions, one document after the other (u32)
+
+so a posting costs 8 bytes plus 4 per position instead of a dict entry,
+a list and an int object per position. Field masks are kept the same way.
+nbytes tracks an estimate of the memory held, which build_index compares
+with its budget to decide when to flush, however large or small the pages
+are.
+
+Partial files hold one pickled (term, (doc_ids, counts, positions)) record
+per term, in term order, which pickle stores as the arrays' raw bytes.
+"""
+
+from array import array
+from itertools import accumulate
+
+# Estimated cost of a term seen for the first time: its string, the dict entry
+# and list slots of its ID, and the array objects of its postings.
+TERM_BYTES = 400
+FIELD_TERM_BYTES = 250
+POSTING_BYTES = 8  # One doc ID and one count
+POSITION_BYTES = 4
+FIELD_POSTING_BYTES = 5  # One doc ID and one mask byte
+
+
+class PostingsAccumulator:
+    """Body postings and field masks of a batch of pages, packed into per-term arrays."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.term_ids = {}  # term -> index into the lists below
+        self.terms = []
+        self.doc_ids = []
+        self.counts = []
+        self.positions = []
+        self.field_docs = {}  # term ID -> array of doc IDs
+        self.field_masks = {}  # term ID -> array of field masks
+        self.documents = 0
+        self.nbytes = 0
+
+    def __bool__(self):
+        return self.documents > 0
+
+    def _term_id(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+            self.doc_ids.append(array("I"))
+            self.counts.append(array("I"))
+            self.positions.append(array("I"))
+            self.nbytes += TERM_BYTES
+        return term_id
+
+    def add(self, doc_id, tokens, field_terms):
+        """Add a page's body tokens, in order, and its {term: field mask}."""
+        by_term = {}
+        for i, token in enumerate(tokens):
+            positions = by_term.get(token)
+            if positions is None:
+                by_term[token] = [i]
+            else:
+                positions.append(i)
+        for term, positions in by_term.items():
+            term_id = self._term_id(term)
+            self.doc_ids[term_id].append(doc_id)
+            self.counts[term_id].append(len(positions))
+            self.positions[term_id].extend(positions)
+        self.nbytes += POSTING_BYTES * len(by_term) + POSITION_BYTES * len(tokens)
+
+        for term, mask in field_terms.items():
+            term_id = self._term_id(term)
+            if term_id not in self.field_docs:
+                self.field_docs[term_id] = array("I")
+                self.field_masks[term_id] = array("B")
+                self.nbytes += FIELD_TERM_BYTES
+            self.field_docs[term_id].append(doc_id)
+            self.field_masks[term_id].append(mask)
+        self.nbytes += FIELD_POSTING_BYTES * len(field_terms)
+        self.documents += 1
+
+    def records(self):
+        """Term-sorted (term, (doc_ids, counts, positions)) of every term with body postings."""
+        for term in sorted(self.term_ids):
+            term_id = self.term_ids[term]
+            if self.doc_ids[term_id]:
+                yield term, (self.doc_ids[term_id], self.counts[term_id], self.positions[term_id])
+
+    def field_records(self):
+        """Term-sorted (term, (doc_ids, masks)) of every term with field postings."""
+        for term in sorted(self.term_ids):
+            term_id = self.term_ids[term]
+            if term_id in self.field_docs:
+                yield term, (self.field_docs[term_id], self.field_masks[term_id])
+
+    def postings(self):
+        """Term-sorted (term, {doc_id: {"positions": [...]}}), as write_index_to_sqlite takes them."""
+        for term, record in self.records():
+            yield term, record_postings(record)
+
+    def field_postings(self):
+        """Term-sorted (term, {doc_id: field mask})."""
+        for term, record in self.field_records():
+            yield term, record_field_postings(record)
+
+
+def record_postings(record, postings=None):
+    """Add the postings of one (doc_ids, counts, positions) record to the dict postings and return it."""
+    if postings is None:
+        postings = {}
+    doc_ids, counts, positions = record
+    positions = positions.tolist()
+    for doc_id, start, end in zip(doc_ids, accumulate(counts, initial=0), accumulate(counts)):
+        postings.setdefault(doc_id, {"positions": []})["positions"].extend(positions[start:end])
+    return postings
+
+
+def record_field_postings(record, field_postings=None):
+    """Add the masks of one (doc_ids, masks) record to the dict field_postings and return it."""
+    if field_postings is None:
+        field_postings = {}
+    for doc_id, mask in zip(*record):
+        field_postings[doc_id] = field_postings.get(doc_id, 0) | mask
+    return field_postings
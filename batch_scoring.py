@@ -0,0 +1,185 @@
+"""
+Vectorized scoring of every candidate document for a query.
+
+Computes the same scores as score_candidate/score_document, but for all
+candidates at once with NumPy arrays instead of one Python call per document.
+"""
+
+from itertools import chain
+
+import numpy as np
+
+from postings import LazyPostings
+from scoring import proximity_score, MASK_BOOSTS, PHRASE_BOOST, PROXIMITY_BOOST
+
+MASK_BOOSTS_ARRAY = np.array(MASK_BOOSTS, dtype=np.float64)
+
+
+class DocFeatures:
+    """Per-document URL slash counts as an array aligned with the sorted doc IDs of the index."""
+
+    def __init__(self, doc_map):
+        ids = sorted(int(d) for d in doc_map)
+        self.doc_ids = np.array(ids, dtype=np.int64)
+        # One extra zero at the end stands in for candidates missing from doc_map
+        self.slashes = np.array([doc_map.get(str(d), "").count("/") for d in ids] + [0], dtype=np.float64)
+
+    def rows(self, doc_ids):
+        """Row of each doc ID in the feature arrays, or the extra row if it is unknown."""
+        return _sorted_rows(self.doc_ids, doc_ids)
+
+    def slash_counts(self, doc_ids):
+        return self.slashes[self.rows(doc_ids)]
+
+    def static_priors(self, doc_ids):
+        # A plain doc_map carries no PageRank, the same as scoring.static_prior
+        return np.zeros(len(doc_ids))
+
+    def doc_lengths(self, doc_ids, default):
+        # Nor document lengths, so BM25 treats every document as being of the average length
+        return np.full(len(doc_ids), float(default))
+
+
+_features = {"doc_map": None, "size": None, "value": None}
+
+
+def get_doc_features(doc_map):
+    """Per-document features for doc_map, built once for a plain dict; a DocStore already has them.
+
+    The dict itself is kept, not its id(), which a new dict can reuse once the
+    old one is freed; a change in its size means documents were added or removed.
+    """
+    if not isinstance(doc_map, dict):
+        return doc_map
+    if _features["doc_map"] is not doc_map or _features["size"] != len(doc_map):
+        _features["value"] = DocFeatures(doc_map)
+        _features["doc_map"] = doc_map
+        _features["size"] = len(doc_map)
+    return _features["value"]
+
+
+def _sorted_rows(sorted_values, queries):
+    """Index of each query in sorted_values, or len(sorted_values) when it is absent."""
+    missing = len(sorted_values)
+    if missing == 0:
+        return np.full(len(queries), missing, dtype=np.int64)
+    idx = np.minimum(np.searchsorted(sorted_values, queries), missing - 1)
+    return np.where(sorted_values[idx] == queries, idx, missing)
+
+
+def _field_boosts(field_postings, doc_ids):
+    """Field boost of one term for every doc in doc_ids (0 where the term is in no field)."""
+    if not field_postings:
+        return np.zeros(len(doc_ids))
+    field_ids = np.fromiter((int(d) for d in field_postings), dtype=np.int64, count=len(field_postings))
+    boosts = MASK_BOOSTS_ARRAY[np.fromiter(field_postings.values(), dtype=np.int64, count=len(field_postings))]
+    order = np.argsort(field_ids, kind="stable")
+    rows = _sorted_rows(field_ids[order], doc_ids)
+    return np.append(boosts[order], 0.0)[rows]
+
+
+def _position_keys(postings, doc_ids):
+    """(doc index << 32) | position for every position of the given documents, as one sorted int array."""
+    if isinstance(postings, LazyPostings):
+        lists = postings.positions(doc_ids)
+    else:
+        lists = [postings[str(d)]["positions"] for d in doc_ids]
+    lengths = np.fromiter((len(p) for p in lists), dtype=np.int64, count=len(lists))
+    positions = np.fromiter(chain.from_iterable(lists), dtype=np.int64, count=int(lengths.sum()))
+    owners = np.repeat(np.arange(len(lists), dtype=np.int64), lengths)
+    return (owners << 32) | positions
+
+
+def _sorted_contains(sorted_values, queries):
+    return _sorted_rows(sorted_values, queries) < len(sorted_values)
+
+
+def phrase_matches(terms, doc_ids, postings_dict):
+    """Boolean mask over doc_ids: full_phrase_in_doc for every document at once.
+
+    A document matches when some position p of the first term has, for every
+    later term i, a position within 1 of p + i.
+    """
+    if len(doc_ids) == 0:
+        return np.zeros(len(doc_ids), dtype=bool)
+    keys = {term: _position_keys(postings_dict[term], doc_ids) for term in dict.fromkeys(terms)}
+    starts = keys[terms[0]]
+    ok = np.ones(len(starts), dtype=bool)
+    for i, term in enumerate(terms[1:], start=1):
+        targets = keys[term]
+        ok &= (
+            _sorted_contains(targets, starts + (i - 1))
+            | _sorted_contains(targets, starts + i)
+            | _sorted_contains(targets, starts + (i + 1))
+        )
+    mask = np.zeros(len(doc_ids), dtype=bool)
+    mask[starts[ok] >> 32] = True
+    return mask
+
+
+def score_documents_batch(terms, postings_dict, idf_values, field_postings, doc_map,
+                          proximity_weight=PROXIMITY_BOOST):
+    """Score every document in the union of the query terms' postings.
+
+    Returns (doc_ids, scores, phrase_match_count) where doc_ids is a sorted
+    int array and scores[i] equals score_candidate for doc_ids[i].
+    """
+    features = get_doc_features(doc_map)
+    present = [t for t in dict.fromkeys(terms) if t in postings_dict]
+    if not present:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), 0
+
+    id_arrays = {}
+    freq_arrays = {}
+    for term in present:
+        postings = postings_dict[term]
+        if isinstance(postings, LazyPostings):
+            # Read straight from the arrays, so no position list is decoded
+            id_arrays[term], freq_arrays[term] = postings.doc_ids, postings.tfs
+            continue
+        id_arrays[term] = np.fromiter((int(d) for d in postings), dtype=np.int64, count=len(postings))
+        freq_arrays[term] = np.fromiter(
+            (len(p["positions"]) for p in postings.values()), dtype=np.float64, count=len(postings)
+        )
+    doc_ids = np.unique(np.concatenate(list(id_arrays.values())))
+    n_docs = len(doc_ids)
+
+    doc_len = np.zeros(n_docs)
+    weighted_idf = np.zeros(n_docs)
+    matched = np.zeros(n_docs)
+    for term in present:
+        weight = terms.count(term)
+        freqs = np.zeros(n_docs)
+        freqs[np.searchsorted(doc_ids, id_arrays[term])] = freq_arrays[term]
+        doc_len += weight * freqs
+        weighted_idf += weight * freqs * idf_values.get(term, 0)
+        matched += weight * (freqs > 0)
+    tfidf = np.divide(weighted_idf, doc_len, out=np.zeros(n_docs), where=doc_len > 0)
+
+    boost = features.static_priors(doc_ids) - features.slash_counts(doc_ids)
+    for term in dict.fromkeys(terms):
+        boost += terms.count(term) * _field_boosts(field_postings.get(term, {}), doc_ids)
+
+    phrase = np.zeros(n_docs)
+    full = np.flatnonzero(matched == len(terms))
+    phrase[full[phrase_matches(terms, doc_ids[full], postings_dict)]] = PHRASE_BOOST
+
+    # Minimum-span proximity is a per-document sliding window, only run for full matches
+    proximity = np.zeros(n_docs)
+    if proximity_weight and len(present) > 1:
+        for i in full:
+            proximity[i] = proximity_score(terms, str(doc_ids[i]), postings_dict, proximity_weight)
+
+    coverage = matched / len(terms)
+    scores = (tfidf + boost + phrase + proximity) * coverage
+    return doc_ids, scores, int(np.count_nonzero(phrase))
+
+
+def top_k_scores(doc_ids, scores, k=5):
+    """The k best (doc_id, score) pairs, best first, using argpartition instead of a full sort."""
+    if len(scores) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(str(doc_ids[i]), float(scores[i])) for i in top]
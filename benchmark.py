@@ -0,0 +1,397 @@
+"""
+Benchmarks for indexing and search.
+
+    python benchmark.py suite --docs 5000 --json bench/results.json
+    python benchmark.py corpus --docs 5000 --out bench/data
+    python benchmark.py index --workdir bench --workers 4
+    python benchmark.py queries --workdir bench --log 1000 --mode topk
+    python benchmark.py compare --workdir bench --modes topk bm25
+    python benchmark.py scoring --docs 50000
+
+corpus writes synthetic pages in the JSON layout build_index reads from
+DATA_DIR. Words are drawn from a Zipfian vocabulary that also contains the
+words of the m2/m3 queries. index builds that corpus in a child process,
+using cached liveness only so the network is never touched, and reports
+docs/sec, peak RSS and the size of the index on disk. queries reports
+end-to-end latency percentiles of execute_query, including postings
+loading, over the m2/m3 sets and a generated Zipfian query log. Results
+are JSON tagged with the git commit, so runs can be compared between
+commits. compare runs the same queries in several ranking modes and
+reports each mode's latency and how many of its top results the first
+mode also returns.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from math import log
+
+import numpy as np
+
+from constants import (
+    DATA_DIR, INDEX_DB, BINARY_INDEX_FILE, DOC_FEATURES_FILE, TERM_DICTIONARY_FILE, INDEX_SHARDS, QUERY_MODE, STOPWORDS,
+    TOP_K
+)
+from scoring import score_candidate, MASK_BOOSTS
+from batch_scoring import score_documents_batch, top_k_scores
+from index_builder import build_index
+from index_store import DocStore, postings_cache
+from postings import index_files
+from search import execute_query, M2_QUERIES, M3_QUERIES
+
+VOCAB = ["machine", "learning", "software", "engineering", "informatics", "irvine", "data", "science"]
+HOSTS = ["www.ics.uci.edu", "www.informatics.uci.edu", "www.cs.uci.edu", "www.stat.uci.edu"]
+SYLLABLES = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+ZIPF_EXPONENT = 1.0
+VOCAB_SIZE = 20000
+QUERY_LENGTH_WEIGHTS = [0.3, 0.4, 0.2, 0.1]  # Share of generated queries with 1, 2, 3 and 4 words
+
+
+def synthetic_postings(n_docs, terms, seed=0):
+    """Random body and field postings for terms over n_docs documents, plus a matching doc_map."""
+    rng = random.Random(seed)
+    doc_ids = rng.sample(range(1, 2 ** 32), n_docs)
+    postings_dict = {term: {} for term in terms}
+    field_postings = {term: {} for term in terms}
+    doc_map = {}
+    for doc_id in doc_ids:
+        key = str(doc_id)
+        length = rng.randint(50, 500)
+        for rank, term in enumerate(terms):
+            # Earlier terms are more common, like head terms in the query log
+            if rng.random() < 0.9 / (rank + 1):
+                count = rng.randint(1, 20)
+                postings_dict[term][key] = {"positions": sorted(rng.sample(range(length), count))}
+            if rng.random() < 0.2:
+                field_postings[term][key] = rng.randint(1, len(MASK_BOOSTS) - 1)
+        doc_map[key] = f"https://www.ics.uci.edu/{rng.choice(VOCAB)}/{rng.randint(0, 999)}"
+    idf_values = {term: log(n_docs / max(len(p), 1)) for term, p in postings_dict.items()}
+    return postings_dict, idf_values, field_postings, doc_map
+
+
+def bench_scoring(n_docs, terms, k=5):
+    postings_dict, idf_values, field_postings, doc_map = synthetic_postings(n_docs, terms)
+    candidates = set().union(*(set(p) for p in postings_dict.values()))
+
+    start = time.perf_counter()
+    loop_scores = {
+        doc_id: score_candidate(doc_id, terms, postings_dict, idf_values, field_postings, doc_map)[0]
+        for doc_id in candidates
+    }
+    loop_top = sorted(loop_scores.items(), key=lambda x: x[1], reverse=True)[:k]
+    loop_ms = (time.perf_counter() - start) * 1000
+
+    # First call also builds the per-document feature array, which search does once per doc_map
+    score_documents_batch(terms, postings_dict, idf_values, field_postings, doc_map)
+    start = time.perf_counter()
+    doc_ids, batch_scores, _ = score_documents_batch(terms, postings_dict, idf_values, field_postings, doc_map)
+    batch_top = top_k_scores(doc_ids, batch_scores, k)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    max_diff = max(abs(loop_scores[str(d)] - s) for d, s in zip(doc_ids, batch_scores))
+    return {
+        "candidates": len(candidates),
+        "loop_ms": loop_ms,
+        "batch_ms": batch_ms,
+        "speedup": loop_ms / batch_ms if batch_ms else float("inf"),
+        "max_score_diff": max_diff,
+        "same_top_k": [d for d, _ in loop_top] == [d for d, _ in batch_top],
+    }
+
+
+def query_words():
+    words = {w for q in M2_QUERIES + M3_QUERIES for w in q.lower().split()}
+    return sorted(w for w in words if w.isalpha() and len(w) > 1 and w not in STOPWORDS)
+
+
+def make_vocabulary(size, rng):
+    """size distinct words in Zipf rank order, with the m2/m3 query words spread among them."""
+    vocab = query_words()
+    words = set(vocab)
+    while len(vocab) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in words:
+            words.add(word)
+            vocab.append(word)
+    rng.shuffle(vocab)
+    return vocab
+
+
+def zipf_weights(n, exponent=ZIPF_EXPONENT):
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def generate_corpus(out_dir, n_docs, vocab_size=VOCAB_SIZE, seed=0):
+    """Write n_docs synthetic pages as out_dir/<host>/<hash>.json, like the crawled dataset."""
+    rng = random.Random(seed)
+    vocab = make_vocabulary(vocab_size, rng)
+    cum_weights = zipf_weights(len(vocab))
+
+    def words(n):
+        return " ".join(rng.choices(vocab, cum_weights=cum_weights, k=n))
+
+    urls = []
+    for i in range(n_docs):
+        host = rng.choice(HOSTS)
+        url = f"https://{host}/{rng.choice(vocab)}/page{i}.html"
+        paragraphs = "".join(f"<p>{words(rng.randint(20, 80))}</p>" for _ in range(rng.randint(2, 10)))
+        # Links to earlier pages, skewed towards the first ones so the link graph has hubs
+        links = "".join(f'<a href="{urls[int(len(urls) * rng.random() ** 2)]}">{words(1)}</a>'
+                        for _ in range(rng.randint(0, 8) if urls else 0))
+        urls.append(url)
+        content = (
+            f"<html><head><title>{words(rng.randint(2, 6))}</title></head><body>"
+            f"<nav>{words(5)}{links}</nav><h1>{words(rng.randint(1, 4))}</h1><h2>{words(rng.randint(1, 5))}</h2>"
+            f"<main>{paragraphs}</main><footer>{words(5)}</footer></body></html>"
+        )
+        host_dir = os.path.join(out_dir, host.replace(".", "_"))
+        os.makedirs(host_dir, exist_ok=True)
+        name = hashlib.md5(url.encode()).hexdigest()
+        with open(os.path.join(host_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump({"url": url, "content": content, "encoding": "utf-8"}, f)
+    return vocab
+
+
+def generate_query_log(vocab, n_queries, seed=1):
+    """Queries whose words follow the same Zipf distribution as the corpus."""
+    rng = random.Random(seed)
+    cum_weights = zipf_weights(len(vocab))
+    lengths = rng.choices(range(1, len(QUERY_LENGTH_WEIGHTS) + 1), weights=QUERY_LENGTH_WEIGHTS, k=n_queries)
+    return [" ".join(rng.choices(vocab, cum_weights=cum_weights, k=n)) for n in lengths]
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process and its finished children, in KB."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _build_in(workdir, workers, shards):
+    os.chdir(workdir)
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        build_index(workers=workers, offline=True, shards=shards)
+    elapsed = time.perf_counter() - start
+    conn = sqlite3.connect(INDEX_DB)
+    docs = conn.execute("SELECT COUNT(*) FROM doc_metadata").fetchone()[0]
+    terms = conn.execute("SELECT COUNT(*) FROM idf").fetchone()[0]
+    conn.close()
+    files = [
+        path for path in (INDEX_DB, *index_files(BINARY_INDEX_FILE, positions=True), DOC_FEATURES_FILE, TERM_DICTIONARY_FILE)
+        if os.path.exists(path)
+    ]
+    return {
+        "docs": docs,
+        "terms": terms,
+        "workers": workers,
+        "shards": shards,
+        "seconds": elapsed,
+        "docs_per_sec": docs / elapsed if elapsed else 0.0,
+        "peak_rss_kb": peak_rss_kb(),
+        "index_bytes": {path: os.path.getsize(path) for path in files},
+        "index_total_bytes": sum(os.path.getsize(path) for path in files),
+    }
+
+
+def bench_index(workdir, workers=1, shards=INDEX_SHARDS):
+    """Build the index for workdir/DATA_DIR in a fresh process, so peak RSS covers only the build."""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(_build_in, os.path.abspath(workdir), workers, shards).result()
+
+
+def latency_summary(latencies_ms):
+    values = np.array(latencies_ms)
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def bench_queries(workdir, query_sets, mode=QUERY_MODE, repeat=3):
+    """Latency percentiles per query set: the first (cold cache) pass and the warm passes after it."""
+    os.chdir(workdir)
+    postings_cache.clear()
+    doc_store = DocStore()
+    results = {}
+    for name, queries in query_sets.items():
+        passes = []
+        for _ in range(1 + repeat):
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                # The result cache would turn warm passes into lookups; this measures query evaluation
+                execute_query(query, doc_store, mode=mode, k=TOP_K, skip_missing=True, use_cache=False)
+                latencies.append((time.perf_counter() - start) * 1000)
+            passes.append(latencies)
+        results[name] = {
+            "cold": latency_summary(passes[0]),
+            "warm": latency_summary([ms for latencies in passes[1:] for ms in latencies]),
+        }
+    results["postings_cache"] = postings_cache.stats()
+    return results
+
+
+def compare_modes(workdir, queries, modes=("topk", "bm25"), repeat=3, k=TOP_K):
+    """Warm latency of each mode over queries, and the mean share of its top k found by modes[0] too."""
+    os.chdir(workdir)
+    postings_cache.clear()
+    doc_store = DocStore()
+    rankings = {}
+    report = {}
+    for mode in modes:
+        latencies = []
+        for i in range(1 + repeat):
+            ranked = []
+            for query in queries:
+                start = time.perf_counter()
+                result = execute_query(query, doc_store, mode=mode, k=k, skip_missing=True, use_cache=False)
+                latencies.append((time.perf_counter() - start) * 1000)
+                ranked.append({doc_id for doc_id, _ in result["results"]})
+            if i == 0:
+                # The first pass fills the postings cache for this mode
+                latencies.clear()
+        rankings[mode] = ranked
+        report[mode] = {"warm": latency_summary(latencies)}
+    baseline = rankings[modes[0]]
+    for mode in modes[1:]:
+        overlaps = [len(base & other) / len(base) for base, other in zip(baseline, rankings[mode]) if base]
+        report[mode][f"overlap_at_{k}_with_{modes[0]}"] = float(np.mean(overlaps)) if overlaps else 0.0
+    return report
+
+
+def default_query_sets(vocab, log_size):
+    return {"m2": M2_QUERIES, "m3": M3_QUERIES, "zipf_log": generate_query_log(vocab, log_size)}
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_suite(n_docs, workers, log_size, mode, repeat, workdir=None, seed=0, shards=INDEX_SHARDS):
+    """Generate a corpus, index it and time queries against it; returns one JSON-ready report."""
+    workdir = workdir or tempfile.mkdtemp(prefix="search-bench-")
+    vocab = generate_corpus(os.path.join(workdir, DATA_DIR), n_docs, seed=seed)
+    report = {"environment": environment(), "params": {
+        "docs": n_docs, "workers": workers, "shards": shards, "query_log": log_size, "mode": mode,
+        "repeat": repeat, "seed": seed
+    }}
+    report["index"] = bench_index(workdir, workers, shards)
+    report["queries"] = bench_queries(workdir, default_query_sets(vocab, log_size), mode, repeat)
+    return report
+
+
+def emit(result, json_path):
+    text = json.dumps(result, indent=2)
+    if json_path:
+        os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+        with open(json_path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Wrote {json_path}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indexing and search.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    suite_parser = sub.add_parser("suite", help="generate a corpus, index it and time queries")
+    suite_parser.add_argument("--docs", type=int, default=2000)
+    suite_parser.add_argument("--workers", type=int, default=1)
+    suite_parser.add_argument("--shards", type=int, default=INDEX_SHARDS, help="term shards of the binary index")
+    suite_parser.add_argument("--log", type=int, default=500, help="queries in the Zipfian query log")
+    suite_parser.add_argument("--mode", default=QUERY_MODE)
+    suite_parser.add_argument("--repeat", type=int, default=3, help="warm passes over each query set")
+    suite_parser.add_argument("--workdir", help="directory for the corpus and index (default: a temp dir)")
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("--json", help="write the report to this file")
+
+    corpus_parser = sub.add_parser("corpus", help="write a synthetic corpus in the DATA_DIR layout")
+    corpus_parser.add_argument("--docs", type=int, default=2000)
+    corpus_parser.add_argument("--out", default=DATA_DIR)
+    corpus_parser.add_argument("--seed", type=int, default=0)
+
+    index_parser = sub.add_parser("index", help="time build_index on WORKDIR/" + DATA_DIR)
+    index_parser.add_argument("--workdir", default=".")
+    index_parser.add_argument("--workers", type=int, default=1)
+    index_parser.add_argument("--shards", type=int, default=INDEX_SHARDS)
+    index_parser.add_argument("--json")
+
+    queries_parser = sub.add_parser("queries", help="query latency percentiles against the index in WORKDIR")
+    queries_parser.add_argument("--workdir", default=".")
+    queries_parser.add_argument("--log", type=int, default=500)
+    queries_parser.add_argument("--mode", default=QUERY_MODE)
+    queries_parser.add_argument("--repeat", type=int, default=3)
+    queries_parser.add_argument("--seed", type=int, default=0, help="seed the corpus was generated with")
+    queries_parser.add_argument("--json")
+
+    compare_parser = sub.add_parser("compare", help="latency and top-k overlap of ranking modes in WORKDIR")
+    compare_parser.add_argument("--workdir", default=".")
+    compare_parser.add_argument("--log", type=int, default=500)
+    compare_parser.add_argument("--modes", nargs="+", default=["topk", "bm25"], help="the first is the baseline")
+    compare_parser.add_argument("--repeat", type=int, default=3)
+    compare_parser.add_argument("--seed", type=int, default=0, help="seed the corpus was generated with")
+    compare_parser.add_argument("--json")
+
+    scoring_parser = sub.add_parser("scoring", help="per-document vs vectorized candidate scoring")
+    scoring_parser.add_argument("--docs", type=int, default=50000)
+    scoring_parser.add_argument("--terms", nargs="+", default=["machine", "learning"])
+    args = parser.parse_args()
+
+    if args.command == "suite":
+        emit(run_suite(args.docs, args.workers, args.log, args.mode, args.repeat, args.workdir, args.seed, args.shards),
+             args.json)
+    elif args.command == "corpus":
+        generate_corpus(args.out, args.docs, seed=args.seed)
+        print(f"Wrote {args.docs} pages to {args.out}")
+    elif args.command == "index":
+        emit({"environment": environment(), "index": bench_index(args.workdir, args.workers, args.shards)}, args.json)
+    elif args.command == "queries":
+        # Same vocabulary as generate_corpus(seed), so the query log matches the corpus
+        vocab = make_vocabulary(VOCAB_SIZE, random.Random(args.seed))
+        report = {"environment": environment(), "params": {"mode": args.mode, "repeat": args.repeat}}
+        report["queries"] = bench_queries(args.workdir, default_query_sets(vocab, args.log), args.mode, args.repeat)
+        emit(report, args.json)
+    elif args.command == "compare":
+        vocab = make_vocabulary(VOCAB_SIZE, random.Random(args.seed))
+        queries = [query for queries in default_query_sets(vocab, args.log).values() for query in queries]
+        report = {"environment": environment(), "params": {"modes": args.modes, "repeat": args.repeat}}
+        report["modes"] = compare_modes(args.workdir, queries, args.modes, args.repeat)
+        emit(report, args.json)
+    elif args.command == "scoring":
+        result = bench_scoring(args.docs, args.terms)
+        for key, value in result.items():
+            print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
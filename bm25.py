@@ -0,0 +1,51 @@
+"""
+BM25 ranking from precomputed statistics only.
+
+Each query term contributes
+
+    idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+
+where tf comes from the term's stored frequencies, length from the
+document's stored token count and avg_length from the index. No position
+list is decoded, so phrase and proximity boosts are not part of this mode.
+The field boosts, PageRank prior and URL slash penalty are added the same
+way as in the tf-idf modes, so comparing the two isolates the body text
+score.
+"""
+
+import numpy as np
+
+from batch_scoring import get_doc_features, _field_boosts
+from constants import BM25_K1, BM25_B
+
+
+def bm25_term_scores(tfs, lengths, avg_length, idf, k1=BM25_K1, b=BM25_B):
+    """BM25 contribution of one term for documents with term frequencies tfs and the given lengths."""
+    norm = k1 * (1 - b + b * lengths / avg_length)
+    return idf * tfs * (k1 + 1) / (tfs + norm)
+
+
+def score_documents_bm25(terms, frequencies, idf_values, field_postings, doc_map, avg_length,
+                         k1=BM25_K1, b=BM25_B):
+    """BM25 scores of every document containing a query term; returns (doc_ids, scores).
+
+    frequencies maps each term to its (sorted doc IDs, term frequencies)
+    arrays. A term repeated in the query counts once per occurrence, as in
+    the tf-idf modes.
+    """
+    features = get_doc_features(doc_map)
+    present = [term for term in dict.fromkeys(terms) if term in frequencies]
+    if not present:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    doc_ids = np.unique(np.concatenate([frequencies[term][0] for term in present]))
+    lengths = features.doc_lengths(doc_ids, avg_length)
+
+    scores = features.static_priors(doc_ids) - features.slash_counts(doc_ids)
+    for term in present:
+        term_ids, tfs = frequencies[term]
+        rows = np.searchsorted(doc_ids, term_ids)
+        weights = bm25_term_scores(tfs, lengths[rows], avg_length, idf_values.get(term, 0.0), k1, b)
+        scores[rows] += terms.count(term) * weights
+    for term in dict.fromkeys(terms):
+        scores += terms.count(term) * _field_boosts(field_postings.get(term, {}), doc_ids)
+    return doc_ids, scores
@@ -0,0 +1,91 @@
+"""
+AND-first query evaluation: rank only the documents that hold every query term.
+
+index_store.SegmentedIndex.load_intersection intersects the postings
+rarest term first. On the binary index each longer list is probed through
+its skip table, so only the runs of SKIP_INTERVAL documents that can hold a
+candidate are decoded. What comes back are the matching doc IDs and their
+term frequencies; positions stay encoded.
+
+The score of a full match is its tf-idf, field, PageRank and URL part,
+computed here for every match from the frequencies, plus a phrase and a
+proximity boost that need positions. Matches are visited best base score
+first, in batches, and the visit stops once even the largest possible
+boosts cannot lift the next base score above the current k-th best, so
+positions are only decoded for the few documents that can still make the
+top k. The scores are the ones score_candidate gives the same documents,
+times the 0.85 rescale the exhaustive and vectorized modes apply when
+10-90% of the ranked documents are phrase matches. Here that ratio is taken
+over the matches that were visited, since finding the phrase matches of the
+rest would mean decoding their positions; a rescale never changes the order.
+"""
+
+import heapq
+
+import numpy as np
+
+from batch_scoring import get_doc_features, phrase_matches, _field_boosts
+from scoring import proximity_score, PHRASE_BOOST, PROXIMITY_BOOST
+
+VISIT_BATCH = 32  # Matches whose positions are decoded together
+
+
+def base_scores(terms, intersection, idf_values, field_postings, doc_map):
+    """Score of every match without its phrase and proximity boosts, before coverage."""
+    doc_ids = intersection.doc_ids
+    features = get_doc_features(doc_map)
+    doc_len = np.zeros(len(doc_ids))
+    weighted_idf = np.zeros(len(doc_ids))
+    for term, tfs in intersection.frequencies.items():
+        weight = terms.count(term)
+        doc_len += weight * tfs
+        weighted_idf += weight * tfs * idf_values.get(term, 0)
+    scores = np.divide(weighted_idf, doc_len, out=np.zeros(len(doc_ids)), where=doc_len > 0)
+    scores += features.static_priors(doc_ids) - features.slash_counts(doc_ids)
+    for term in dict.fromkeys(terms):
+        scores += terms.count(term) * _field_boosts(field_postings.get(term, {}), doc_ids)
+    return scores
+
+
+def top_k_conjunctive(terms, intersection, idf_values, field_postings, doc_map, k=5,
+                      proximity_weight=PROXIMITY_BOOST):
+    """Return ([(doc_id, score), ...] best first, number of matches whose positions were decoded).
+
+    Terms missing from the index lower every score through coverage, and
+    then no match can earn a phrase or proximity boost.
+    """
+    doc_ids = intersection.doc_ids
+    if not len(doc_ids):
+        return [], 0
+    coverage = sum(terms.count(term) for term in intersection.frequencies) / len(terms)
+    base = base_scores(terms, intersection, idf_values, field_postings, doc_map)
+    order = np.argsort(-base, kind="stable")
+    if coverage < 1:
+        return [(str(doc_ids[i]), float(base[i] * coverage)) for i in order[:k]], 0
+
+    distinct = list(dict.fromkeys(terms))
+    headroom = PHRASE_BOOST + (proximity_weight if len(distinct) > 1 else 0)
+    heap = []  # (score, -visit order, doc_id) of the k best so far
+    visited = 0
+    phrase_count = 0
+    for start in range(0, len(order), VISIT_BATCH):
+        batch = order[start:start + VISIT_BATCH]
+        if len(heap) == k and base[batch[0]] + headroom <= heap[0][0]:
+            break
+        postings_dict = intersection.postings(batch)
+        keys = [str(doc_id) for doc_id in doc_ids[batch].tolist()]
+        phrase = phrase_matches(terms, doc_ids[batch], postings_dict)
+        for j, i in enumerate(batch.tolist()):
+            if len(heap) == k and base[i] + headroom <= heap[0][0]:
+                break
+            score = base[i] + (PHRASE_BOOST if phrase[j] else 0)
+            score += proximity_score(terms, keys[j], postings_dict, proximity_weight)
+            entry = (score, -visited, keys[j])
+            visited += 1
+            phrase_count += bool(phrase[j])
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+    scale = 0.85 if 0.1 < phrase_count / visited < 0.9 else 1.0
+    return [(doc_id, float(score * scale)) for score, _, doc_id in sorted(heap, reverse=True)], visited
@@ -5,13 +5,92 @@ import string
 # Directory paths
 DATA_DIR = "data"
 PARTIAL_INDEX_DIR = "partial_indices"
+SEGMENT_DIR = "segments"
 
 # File names
 ANALYTICS_FILE = "analytics.txt"
+INDEX_DB = "final_index.db"
+BINARY_INDEX_FILE = "final_index.bin"
+DOC_FEATURES_FILE = "doc_features.bin"
+TERM_DICTIONARY_FILE = "term_dict.bin"
+LIVENESS_DB = "liveness.db"
+DEDUP_STATE_FILE = "dedup_state.pkl"
+BUILD_CHECKPOINT_FILE = "checkpoint.pkl"  # Kept in PARTIAL_INDEX_DIR so an interrupted build can resume
+BUILD_PAGES_FILE = "pages.pkl"  # The list of pages the checkpoint cursor points into, next to it
+SEGMENT_MANIFEST = "manifest.json"
+
+# Postings backend used by search: "binary" (memory-mapped) or "sqlite"
+INDEX_BACKEND = "binary"
+INDEX_SHARDS = 1  # Term shards of the binary index; more than 1 lets a query read its terms in parallel
+
+# Search-side caching
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file SQLite may memory-map
+SQLITE_CACHE_KB = 64 * 1024  # SQLite page cache per connection
+POSTINGS_CACHE_BYTES = 256 * 1024 * 1024  # Budget for decoded postings kept between queries
+METADATA_CACHE_SIZE = 10000  # Documents whose URL, title and headings stay cached between queries
+RESULT_CACHE_BYTES = 16 * 1024 * 1024  # Budget for ranked results of repeated queries
+STEM_CACHE_SIZE = 200000  # Distinct words whose Porter stem is memoized, per process
+
 # Indexing limits
-PARTIAL_FLUSH_LIMIT = 5000
+INDEX_MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes of accumulated postings that trigger a partial flush
+PARSE_QUEUE_DEPTH = 8  # Parsed pages queued per worker in a parallel build
+SQLITE_BATCH_SIZE = 1000  # Rows per executemany() while writing the final index
+SQLITE_MAX_PARAMS = 500  # Values per "IN (...)" lookup, below SQLite's bound-parameter limit
 DOC_COUNT = 55393  # Total number of documents
 
+# URL liveness checks made while indexing
+LIVENESS_WORKERS = 32  # Concurrent checks
+LIVENESS_PER_HOST = 4  # Concurrent requests to any one host
+LIVENESS_TIMEOUT = 0.5  # Seconds per request
+LIVENESS_BATCH_SIZE = 500  # Pages whose URLs are checked together, one batch ahead of parsing
+LIVENESS_TTL = 7 * 24 * 3600  # Seconds a cached "live" result is trusted
+LIVENESS_DEAD_TTL = 24 * 3600  # Seconds a cached "dead" result is trusted
+
+# Duplicate detection: MinHash signatures over word n-grams of SHINGLE_SIZE words (1 = the set of words)
+SHINGLE_SIZE = 1
+MINHASH_PERMUTATIONS = 128
+LSH_THRESHOLD = 0.95  # Estimated Jaccard similarity above which a page counts as a near duplicate
+
+# Incremental indexing: segments of similar size are merged once this many accumulate
+SEGMENT_MERGE_FACTOR = 10
+
+# PageRank over the crawled link graph, added to every score as PAGERANK_WEIGHT * log(1 + N * rank),
+# where N * rank is 1 for a page of average rank
+PAGERANK_DAMPING = 0.85
+PAGERANK_MAX_ITER = 100
+PAGERANK_TOL = 1e-9  # L1 change between iterations at which the power iteration stops
+PAGERANK_WEIGHT = 5.0
+
+# Number of results returned per query
+TOP_K = 5
+
+# Most frequent indexed terms a "prefix*" query term expands to, and suggestions returned per prefix
+PREFIX_EXPANSIONS = 10
+SUGGESTION_COUNT = 10
+
+# Threads reading the postings of different query terms from a sharded index at the same time
+QUERY_FANOUT_WORKERS = 8
+
+# Query evaluation: "topk" (MaxScore pruning), "vectorized" (NumPy batch) or "exhaustive" tf-idf,
+# "conjunctive" (tf-idf over the documents holding every term, the union when fewer than k do),
+# or "bm25" over the stored term frequencies and document lengths
+QUERY_MODE = "topk"
+
+# BM25 term-frequency saturation (k1) and document-length normalization (b, 0 = none, 1 = full)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Per-stage timing spans on the query path (also enabled by --metrics); index builds always record them
+METRICS_ENABLED = False
+
+# Field bits for title, heading and URL terms, and the boost each field earns per query term
+FIELD_TITLE = 1
+FIELD_H1 = 2
+FIELD_H2 = 4
+FIELD_H3 = 8
+FIELD_URL = 16
+FIELD_WEIGHTS = {FIELD_TITLE: 100, FIELD_H1: 50, FIELD_H2: 35, FIELD_H3: 20, FIELD_URL: 3}
+
 # Stopword list
 STOPWORDS = {"a", "an", "the", "of", "on", "in", "for", "and", "to", "with"}
 
@@ -0,0 +1,108 @@
+"""
+Exact and near-duplicate detection state shared by full builds and segment updates.
+
+Each page gets an MD5 of its text and a MinHash signature over its word
+n-gram shingles (SHINGLE_SIZE words; 1 means the set of words). Signatures
+are computed with MinHash.update_batch, which permutes the hashes of a
+whole chunk of shingles in one NumPy operation, and are shipped between
+processes as LeanMinHash objects without the permutation tables.
+
+DuplicateIndex keeps the content hashes and the LSH buckets keyed by doc
+ID. build_index saves it to DEDUP_STATE_FILE, and segments.add_documents
+loads it, so pages added later are checked against the whole corpus
+without recomputing a single signature. A page that replaces its own
+older copy is never reported as a duplicate of it.
+"""
+
+import os
+import pickle
+
+from datasketch import MinHash, MinHashLSH, LeanMinHash
+
+from constants import DEDUP_STATE_FILE, LSH_THRESHOLD, MINHASH_PERMUTATIONS, SHINGLE_SIZE
+
+STATE_VERSION = 1
+SHINGLE_BATCH = 2048  # Shingles permuted per update_batch call, bounding its temporary arrays
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Distinct lowercased word n-grams of text."""
+    words = text.lower().split()
+    if size <= 1:
+        return set(words)
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def page_minhash(text, shingle_size=SHINGLE_SIZE, num_perm=MINHASH_PERMUTATIONS):
+    mh = MinHash(num_perm=num_perm)
+    encoded = [shingle.encode("utf8") for shingle in shingles(text, shingle_size)]
+    for i in range(0, len(encoded), SHINGLE_BATCH):
+        mh.update_batch(encoded[i:i + SHINGLE_BATCH])
+    return LeanMinHash(mh)
+
+
+class DuplicateIndex:
+    """Content hashes and MinHash LSH buckets of the indexed documents."""
+
+    def __init__(self, shingle_size=SHINGLE_SIZE, threshold=LSH_THRESHOLD, num_perm=MINHASH_PERMUTATIONS):
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.hash_owner = {}  # content hash -> doc ID
+        self.doc_hash = {}  # doc ID -> content hash
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def __len__(self):
+        return len(self.doc_hash)
+
+    def check(self, doc_id, content_hash, minhash):
+        """"exact" or "near" if the page duplicates another indexed document, else None."""
+        owner = self.hash_owner.get(content_hash)
+        if owner is not None and owner != doc_id:
+            self.exact_duplicates += 1
+            return "exact"
+        key = str(doc_id)
+        if any(match != key for match in self.lsh.query(minhash)):
+            self.near_duplicates += 1
+            return "near"
+        return None
+
+    def add(self, doc_id, content_hash, minhash):
+        self.remove([doc_id])
+        self.hash_owner[content_hash] = doc_id
+        self.doc_hash[doc_id] = content_hash
+        self.lsh.insert(str(doc_id), minhash)
+
+    def remove(self, doc_ids):
+        for doc_id in doc_ids:
+            content_hash = self.doc_hash.pop(doc_id, None)
+            if content_hash is None:
+                continue
+            if self.hash_owner.get(content_hash) == doc_id:
+                del self.hash_owner[content_hash]
+            self.lsh.remove(str(doc_id))
+
+    def save(self, path=DEDUP_STATE_FILE):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((STATE_VERSION, self.shingle_size, self.threshold, self.num_perm,
+                         self.hash_owner, self.doc_hash, self.lsh), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DEDUP_STATE_FILE):
+        """The saved state, or an empty one (current settings) if there is none or it is unreadable."""
+        try:
+            with open(path, "rb") as f:
+                version, shingle_size, threshold, num_perm, hash_owner, doc_hash, lsh = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return cls()
+        if version != STATE_VERSION:
+            return cls()
+        state = cls(shingle_size, threshold, num_perm)
+        state.hash_owner = hash_owner
+        state.doc_hash = doc_hash
+        state.lsh = lsh
+        return state
@@ -2,9 +2,38 @@
 Main entry point for building the index and running the search interface.
 """
 
+import argparse
+
+from constants import SHINGLE_SIZE, INDEX_SHARDS, INDEX_MEMORY_BUDGET
 from index_builder import build_index
+from metrics import metrics, profiling
 from search import search_interface
 
 if __name__ == "__main__":
-    build_index() # Uncomment to build index
-    search_interface()
+    parser = argparse.ArgumentParser(description="Build the index and run the search interface.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to parse documents while building the index")
+    parser.add_argument("--offline", action="store_true",
+                        help="skip network liveness checks and use cached results only")
+    parser.add_argument("--shingle-size", type=int, default=SHINGLE_SIZE,
+                        help="words per shingle for near-duplicate detection (1 compares word sets)")
+    parser.add_argument("--shards", type=int, default=INDEX_SHARDS,
+                        help="split the binary index into this many files by term")
+    parser.add_argument("--memory-budget", type=int, default=INDEX_MEMORY_BUDGET // (1024 * 1024), metavar="MB",
+                        help="flush accumulated postings to a partial file once they take about this much memory")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted build from its last checkpoint instead of starting over")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record per-stage query timings, shown by the 'metrics' command")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="run under cProfile and save the stats to PATH")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="report peak memory and the top allocation sites with tracemalloc")
+    args = parser.parse_args()
+    metrics.enabled = metrics.enabled or args.metrics
+
+    with profiling(args.profile, args.trace_memory):
+        build_index(workers=args.workers, offline=args.offline, shingle_size=args.shingle_size,
+                    shards=args.shards, resume=args.resume,
+                    memory_budget=args.memory_budget * 1024 * 1024) # Uncomment to build index
+        search_interface()
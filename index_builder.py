@@ -1,62 +1,177 @@
 import os
 import json
-from collections import defaultdict
-from math import log
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, closing
+from itertools import groupby
+from operator import itemgetter
 from bs4 import BeautifulSoup
 import hashlib
 import pickle  
+from array import array
+import heapq
 import sqlite3
 import re  
-from urllib.parse import urlparse, urlunparse  
-from datasketch import MinHash, MinHashLSH
+import shutil
+import uuid
+from urllib.parse import urlparse, urlunparse, urljoin, urldefrag
 import time
 import sys
 
-from constants import DATA_DIR, PARTIAL_INDEX_DIR, ANALYTICS_FILE, PARTIAL_FLUSH_LIMIT
+from constants import (
+    DATA_DIR, PARTIAL_INDEX_DIR, SEGMENT_DIR, ANALYTICS_FILE, BUILD_CHECKPOINT_FILE, BUILD_PAGES_FILE,
+    INDEX_MEMORY_BUDGET, PARSE_QUEUE_DEPTH, LIVENESS_BATCH_SIZE, SQLITE_BATCH_SIZE, INDEX_DB, BINARY_INDEX_FILE, INDEX_BACKEND, INDEX_SHARDS,
+    TERM_DICTIONARY_FILE, FIELD_TITLE, FIELD_H1, FIELD_H2, FIELD_H3, FIELD_URL, SHINGLE_SIZE
+)
 from utils import tokenize, stem_tokens, is_valid, is_live_url, stable_hash_url
+from liveness import check_urls
+from postings import ShardedIndexWriter, encode_field_postings, encode_postings, write_doc_features, index_files
+from scoring import MASK_BOOSTS, idf
+from metrics import Metrics, Stopwatch, metrics
+from pagerank import compute_pagerank
+from dedup import DuplicateIndex, page_minhash
+from accumulator import PostingsAccumulator, record_postings, record_field_postings
+from lexicon import TermDictionaryWriter
 
 index_cache = {}
 
-def nested_defaultdict():
-    return defaultdict(list)
-
-def flush_partial_index(index, flush_id):
+def flush_partial_index(records, flush_id, prefix="partial"):
+    # One pickled (term, record) per term, in term order, so partials can be stream-merged
     os.makedirs(PARTIAL_INDEX_DIR, exist_ok=True)
-    filename = os.path.join(PARTIAL_INDEX_DIR, f"partial_{flush_id}.pkl")
+    filename = os.path.join(PARTIAL_INDEX_DIR, f"{prefix}_{flush_id}.pkl")
     with open(filename, 'wb') as f:
-        pickle.dump(index, f)
+        for record in records:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+CHECKPOINT_VERSION = 3  # Version 2 checkpoints pickle all of the document metadata on every flush
+# Manifest entries; everything else is journaled once per flush and replayed by load_checkpoint
+CHECKPOINT_KEYS = ("shingle_size", "cursor", "doc_count", "flush_id", "partials", "journals")
+
+
+def checkpoint_path():
+    return os.path.join(PARTIAL_INDEX_DIR, BUILD_CHECKPOINT_FILE)
+
+
+def save_pages(paths):
+    """Write the build's list of pages once, next to the checkpoint that indexes into it."""
+    with open(os.path.join(PARTIAL_INDEX_DIR, BUILD_PAGES_FILE), "wb") as f:
+        pickle.dump(paths, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def save_checkpoint(state):
+    """Atomically record how far build_index got: the cursor, the counters and the files written so far.
+
+    The document metadata is not in it: each flush writes the entries of its
+    own documents to a journal file, and the manifest only lists those files.
+    """
+    duplicates = state["duplicates"]
+    manifest = {key: state[key] for key in CHECKPOINT_KEYS}
+    manifest["duplicate_counts"] = (duplicates.exact_duplicates, duplicates.near_duplicates)
+    tmp_path = checkpoint_path() + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump((CHECKPOINT_VERSION, manifest), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, checkpoint_path())
+
+
+def load_checkpoint():
+    """The state saved by the last save_checkpoint, its journals replayed, or None if it is missing or unreadable."""
+    try:
+        with open(checkpoint_path(), "rb") as f:
+            version, manifest = pickle.load(f)
+        if version != CHECKPOINT_VERSION:
+            return None
+        with open(os.path.join(PARTIAL_INDEX_DIR, BUILD_PAGES_FILE), "rb") as f:
+            paths = pickle.load(f)
+        state = dict(manifest, paths=paths, doc_map={}, title_map={}, heading_map={}, doc_lengths={}, outlinks={},
+                     duplicates=DuplicateIndex(manifest["shingle_size"]))
+        for name in manifest["journals"]:
+            for doc_id, url, title, headings, length, links, content_hash, minhash in \
+                    iter_partial_index(os.path.join(PARTIAL_INDEX_DIR, name)):
+                state["doc_map"][doc_id] = url
+                state["title_map"][doc_id] = title
+                state["heading_map"][doc_id] = headings
+                state["doc_lengths"][doc_id] = length
+                state["outlinks"][doc_id] = links
+                state["duplicates"].add(doc_id, content_hash, minhash)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, KeyError):
+        return None
+    state["duplicates"].exact_duplicates, state["duplicates"].near_duplicates = state.pop("duplicate_counts")
+    return state
+
+
+def iter_partial_index(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def merge_term_streams(streams):
+    """K-way merge of term-sorted (term, postings) streams; yields (term, [postings from each stream])."""
+    for term, group in groupby(heapq.merge(*streams, key=itemgetter(0)), key=itemgetter(0)):
+        yield term, [postings for _, postings in group]
+
+def iter_merged_partials(partial_dir, prefix):
+    paths = sorted(
+        os.path.join(partial_dir, filename)
+        for filename in os.listdir(partial_dir)
+        if filename.startswith(prefix + "_") and filename.endswith(".pkl")
+    )
+    return merge_term_streams([iter_partial_index(path) for path in paths])
 
 def merge_indices(partial_dir):
-    final_index = defaultdict(dict)
-    for filename in os.listdir(partial_dir):
-        if filename.endswith(".pkl"):  # new line
-            with open(os.path.join(partial_dir, filename), 'rb') as f:  # new line
-                partial = pickle.load(f)  # new line
-                for token, postings in partial.items():
-                    for doc_id, posting in postings.items():
-                        final_index[token][doc_id] = final_index[token].get(doc_id, {"positions": []})
-                        final_index[token][doc_id]["positions"].extend(posting)
-
-    return final_index
-
-
-def write_analytics(index, doc_count):
-    size_kb = os.path.getsize("final_index.db") // 1024
+    """Yield merged body (term, postings) one term at a time, in term order."""
+    for term, parts in iter_merged_partials(partial_dir, "partial"):
+        merged = {}
+        for record in parts:
+            record_postings(record, merged)
+        yield term, merged
+
+def merge_field_indices(partial_dir):
+    """Yield merged field (term, {doc_id: field mask}) one term at a time, in term order."""
+    for term, parts in iter_merged_partials(partial_dir, "fields"):
+        merged = {}
+        for record in parts:
+            record_field_postings(record, merged)
+        yield term, merged
+
+
+def write_analytics(term_count, doc_count, stage_metrics=None):
+    size_kb = os.path.getsize(INDEX_DB) // 1024
+    for path in index_files(BINARY_INDEX_FILE, positions=True):
+        size_kb += os.path.getsize(path) // 1024
     with open(ANALYTICS_FILE, 'w') as f:
         f.write(f"Documents indexed: {doc_count}\n")
-        f.write(f"Unique tokens: {len(index)}\n")
+        f.write(f"Unique tokens: {term_count}\n")
         f.write(f"Index size on disk: {size_kb} KB\n")
-
-def write_index_to_sqlite(index, doc_map, title_map, heading_map, idf_values=None):
-    conn = sqlite3.connect("final_index.db")
-    cursor = conn.cursor()
+        if stage_metrics is not None:
+            # Page stages are summed over parse workers, so they can exceed the wall-clock time
+            f.write("\nBuild stages:\n")
+            for line in stage_metrics.summary_lines():
+                f.write(f"  {line}\n")
+            f.write("\nBuild counts:\n")
+            for name, value in stage_metrics.to_dict()["counters"].items():
+                f.write(f"  {name}: {value}\n")
+
+def create_sqlite_tables(cursor):
     cursor.execute("DROP TABLE IF EXISTS inverted_index")
+    cursor.execute("DROP TABLE IF EXISTS field_index")
     cursor.execute("DROP TABLE IF EXISTS doc_metadata")
     cursor.execute("DROP TABLE IF EXISTS idf")
+    cursor.execute("DROP TABLE IF EXISTS index_info")
     cursor.execute("""
         CREATE TABLE inverted_index (
             term TEXT PRIMARY KEY,
-            postings TEXT
+            postings BLOB,
+            positions BLOB
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE field_index (
+            term TEXT PRIMARY KEY,
+            postings BLOB,
+            max_boost REAL
         )
     """)
     cursor.execute("""
@@ -64,7 +179,9 @@ def write_index_to_sqlite(index, doc_map, title_map, heading_map, idf_values=Non
             doc_id TEXT PRIMARY KEY,
             url TEXT,
             title TEXT,
-            headings TEXT
+            headings TEXT,
+            pagerank REAL,
+            length INTEGER
         )
     """)
     cursor.execute("""
@@ -73,156 +190,420 @@ def write_index_to_sqlite(index, doc_map, title_map, heading_map, idf_values=Non
             idf REAL
         )
     """)
-    cursor.execute("BEGIN TRANSACTION")
-    for term, postings in index.items():
-        cursor.execute(
-            "INSERT OR REPLACE INTO inverted_index (term, postings) VALUES (?, ?)",
-            (term, json.dumps(postings))
+    cursor.execute("""
+        CREATE TABLE index_info (
+            key TEXT PRIMARY KEY,
+            value TEXT
         )
-    for doc_id in doc_map:
-        cursor.execute(
-            "INSERT OR REPLACE INTO doc_metadata (doc_id, url, title, headings) VALUES (?, ?, ?, ?)",
-            (doc_id, doc_map[doc_id], title_map.get(doc_id, ""), heading_map.get(doc_id, ""))
+    """)
+
+def write_index_to_sqlite(merged_terms, merged_fields, doc_map, title_map, heading_map, doc_count,
+                          backend=INDEX_BACKEND, db_path=INDEX_DB, pagerank=None, shards=1, doc_lengths=None,
+                          terms_path=None):
+    """Stream merged (term, postings) pairs into the final store with batched inserts.
+
+    Body postings go to SQLite or to the binary postings file (split into shards
+    files by term) depending on backend; field postings, metadata and IDF values
+    always go to SQLite. Returns the number of body terms written. Documents
+    without a pagerank or doc_lengths entry get NULL. The document count and
+    average length (in tokens) are stored in index_info for BM25. With
+    terms_path, every term and its df also go into a term dictionary file
+    for prefix queries.
+    """
+    pagerank = pagerank or {}
+    doc_lengths = doc_lengths or {}
+    known_lengths = [doc_lengths[doc_id] for doc_id in doc_map if doc_id in doc_lengths]
+    avg_length = sum(known_lengths) / len(known_lengths) if known_lengths else 0.0
+    conn = sqlite3.connect(db_path)
+    # Closed on an error too, so a failed write does not leave the database locked
+    with closing(conn):
+        cursor = conn.cursor()
+        # The old tables are dropped in the same transaction, so until the commit readers still see them
+        cursor.execute("BEGIN TRANSACTION")
+        create_sqlite_tables(cursor)
+        # Changes on every write, so search can tell a rebuilt index from the one it has cached results for
+        cursor.execute("INSERT INTO index_info (key, value) VALUES ('build_id', ?)", (uuid.uuid4().hex,))
+        cursor.execute("INSERT INTO index_info (key, value) VALUES ('shards', ?)", (str(shards if backend == "binary" else 1),))
+        cursor.execute("INSERT INTO index_info (key, value) VALUES ('doc_count', ?)", (str(doc_count),))
+        cursor.execute("INSERT INTO index_info (key, value) VALUES ('avg_doc_length', ?)", (repr(avg_length),))
+        cursor.executemany(
+            "INSERT OR REPLACE INTO doc_metadata (doc_id, url, title, headings, pagerank, length) VALUES (?, ?, ?, ?, ?, ?)",
+            ((doc_id, doc_map[doc_id], title_map.get(doc_id, ""), heading_map.get(doc_id, ""), pagerank.get(doc_id),
+              doc_lengths.get(doc_id)) for doc_id in doc_map)
         )
-    if idf_values:
-        for term, idf in idf_values.items():
-            cursor.execute(
-                "INSERT OR REPLACE INTO idf (term, idf) VALUES (?, ?)",
-                (term, idf)
-            )
-    conn.commit()
-    conn.close()
-
-def build_index():
-    seen_hashes = set()
-    temp_index = defaultdict(nested_defaultdict)
-    doc_count = 0
-    flush_id = 0
-    start_time = time.time()
-    doc_map = {}
-    title_map = {}
-    heading_map = {}
 
-    if os.path.exists(PARTIAL_INDEX_DIR):
-        for f in os.listdir(PARTIAL_INDEX_DIR):
-            os.remove(os.path.join(PARTIAL_INDEX_DIR, f))
-    else:
-        os.makedirs(PARTIAL_INDEX_DIR)
-    
+        postings_batch = []
+        idf_batch = []
+        term_count = 0
 
-    lsh = MinHashLSH(threshold=0.95, num_perm=128)
-    minhashes = {}
+        def flush_batches():
+            cursor.executemany(
+                "INSERT OR REPLACE INTO inverted_index (term, postings, positions) VALUES (?, ?, ?)", postings_batch
+            )
+            cursor.executemany("INSERT OR REPLACE INTO idf (term, idf) VALUES (?, ?)", idf_batch)
+            postings_batch.clear()
+            idf_batch.clear()
+
+        # On an error the writers remove their .tmp files instead of publishing a partial index
+        with ExitStack() as writers:
+            binary_writer = None
+            if backend == "binary":
+                binary_writer = writers.enter_context(ShardedIndexWriter(BINARY_INDEX_FILE, shards))
+            terms_writer = writers.enter_context(TermDictionaryWriter(terms_path)) if terms_path else None
+            for term, postings in merged_terms:
+                idf_batch.append((term, idf(doc_count, len(postings))))
+                if terms_writer:
+                    terms_writer.add(term, len(postings))
+                if binary_writer:
+                    binary_writer.add(term, postings)
+                else:
+                    postings_batch.append((term, *encode_postings(postings)))
+                term_count += 1
+                if len(idf_batch) >= SQLITE_BATCH_SIZE:
+                    flush_batches()
+            flush_batches()
+
+        field_batch = []
+        for term, field_postings in merged_fields:
+            # max_boost is the term's score upper bound used by top-k pruning at query time
+            max_boost = max(MASK_BOOSTS[mask] for mask in field_postings.values())
+            field_batch.append((term, encode_field_postings(field_postings), max_boost))
+            if len(field_batch) >= SQLITE_BATCH_SIZE:
+                cursor.executemany("INSERT OR REPLACE INTO field_index (term, postings, max_boost) VALUES (?, ?, ?)", field_batch)
+                field_batch.clear()
+        cursor.executemany("INSERT OR REPLACE INTO field_index (term, postings, max_boost) VALUES (?, ?, ?)", field_batch)
+
+        conn.commit()
+    return term_count
+
+def page_field_terms(url, title, headings_by_level):
+    """Stemmed title, heading and URL terms of a page, as {term: field mask}."""
+    fields = defaultdict(int)
+    for token in stem_tokens(tokenize(title)):
+        fields[token] |= FIELD_TITLE
+    for bit, headings in headings_by_level:
+        for heading in headings:
+            for token in stem_tokens(tokenize(heading)):
+                fields[token] |= bit
+    parsed = urlparse(url)
+    url_words = " ".join(re.split(r"[^A-Za-z0-9]+", f"{parsed.netloc} {parsed.path}"))
+    for token in stem_tokens(tokenize(url_words)):
+        fields[token] |= FIELD_URL
+    return dict(fields)
+
+def page_outlinks(url, soup):
+    """Hashed targets of the page's links, like doc IDs, so build_index can match them to pages without URLs."""
+    outlinks = set()
+    for a in soup.find_all("a", href=True):
+        try:
+            outlinks.add(stable_hash_url(urldefrag(urljoin(url, a["href"])).url))
+        except ValueError:
+            # A malformed href such as "http://[oops" only loses that link, not the page
+            continue
+    return outlinks
+
+def process_page(path, live=None, shingle_size=SHINGLE_SIZE):
+    """Parse, clean, tokenize and MinHash one crawled page.
+
+    Runs in worker processes, so it only looks at the file itself; build_index
+    owns doc IDs and the order-dependent duplicate checks. live is the page's
+    prefetched liveness; it is checked here only when not given.
+    """
+    watch = Stopwatch()
+    result = {"url": "", "dead": False, "skip": None, "timings": watch.laps}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            page = json.load(f)
+        watch.lap("read")
+        url = page.get("url", "")
+        if not url or not is_valid(url):
+            return result
+        result["url"] = url
+        if live is None:
+            live = is_live_url(url)
+        if not live:
+            result["dead"] = True
+            return result
+
+        content = page.get("content", "")
+        soup = BeautifulSoup(content, "lxml")
+        watch.lap("html_parse")
+        title = soup.title.get_text(strip=True) if soup.title else ""
+        headings_by_level = [
+            (bit, [h.get_text(" ", strip=True) for h in soup.find_all(level)])
+            for level, bit in (("h1", FIELD_H1), ("h2", FIELD_H2), ("h3", FIELD_H3))
+        ]
+        headings = "\n".join(
+            f"{level}: {heading}"
+            for level, (_, level_headings) in zip(("h1", "h2", "h3"), headings_by_level)
+            for heading in level_headings
+        )
+        field_terms = page_field_terms(url, title, headings_by_level)
+        outlinks = page_outlinks(url, soup)
+
+        for tag in soup(["header", "footer", "nav", "aside", "script", "style"]):
+            tag.decompose()
+        main = soup.find("main") or soup.find("div", {"id": "main"}) or soup.body
+        text = main.get_text(separator=" ", strip=True) if main else ""
+        watch.lap("extract")
+
+        if not text:
+            result["skip"] = f"[SKIP] Empty main text in {url}"
+            return result
+
+        word_count = len(text.split())
+        if word_count < 5:
+            result["skip"] = f"[SKIP] Too short: {word_count} words in {url}"
+            return result
+
+        mh = page_minhash(text, shingle_size)
+        watch.lap("minhash")
+        tokens = stem_tokens(tokenize(text))
+        watch.lap("tokenize")
+
+        result.update(
+            title=title.lower(),
+            headings=headings.lower(),
+            preview=text[:100],
+            content_hash=hashlib.md5(text.encode('utf-8')).hexdigest(),
+            minhash=mh,
+            tokens=tokens,
+            field_terms=field_terms,
+            outlinks=outlinks,
+        )
+    except Exception as e:
+        result["error"] = str(e)
+    return result
 
-    for root, _, files in os.walk(DATA_DIR):
+def iter_data_files(data_dir=DATA_DIR):
+    for root, _, files in os.walk(data_dir):
         for file in files:
-            if not file.endswith(".json"):
-                continue
-            with open(os.path.join(root, file), "r", encoding="utf-8") as f:
-                try:
-                    page = json.load(f)
-                    url = page.get("url", "")
-                    if not url:
-                        continue
-                    if not is_valid(url):
-                        continue
-                    if not is_live_url(url):
-                        print(f"[SKIP] Dead URL: {url}")
-                        continue
-                    if doc_count % 1000 == 0 and doc_count > 0:
-                        elapsed = time.time() - start_time
-                        print(f"Processed {doc_count} documents in {elapsed:.2f} seconds")
-                    print(f"Processing document {doc_count + 1}: {url}")
-                    norm_url = url
-                    doc_id = stable_hash_url(norm_url)
-                    if doc_id in doc_map:
-                        continue
-
-                    content = page.get("content", "")
-                    soup = BeautifulSoup(content, "lxml")
-                    title = soup.title.get_text(strip=True) if soup.title else ""
-                    h1 = ' '.join(h.get_text(strip=True) for h in soup.find_all('h1'))
-                    h2 = ' '.join(h.get_text(strip=True) for h in soup.find_all('h2'))
-                    h3 = ' '.join(h.get_text(strip=True) for h in soup.find_all('h3'))
-                    headings = f"{h1} {h2} {h3}"
-
-                    title_map[doc_id] = title.lower()
-                    heading_map[doc_id] = headings.lower()
-
-                    for tag in soup(["header", "footer", "nav", "aside", "script", "style"]):
-                        tag.decompose()
-                    main = soup.find("main") or soup.find("div", {"id": "main"}) or soup.body
-                    text = main.get_text(separator=" ", strip=True) if main else ""
-
-                    if not text:
-                        print(f"[SKIP] Empty main text in {url}")
-                        continue
-
-                    word_count = len(text.split())
-                    if word_count < 5:
-                        print(f"[SKIP] Too short: {word_count} words in {url}")
-                        continue
-
-                    print(f"[CONTENT PREVIEW] {text[:100]}...")  # Optional: show first 100 chars
-
-                    content_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
-                    if content_hash in seen_hashes:
-                        print(f"[SKIP] Exact duplicate: {url}")
-                        continue
-                    seen_hashes.add(content_hash)
-
-                    shingles = set(text.lower().split())
-                    mh = MinHash(num_perm=128)
-                    for shingle in shingles:
-                        mh.update(shingle.encode('utf8'))
-
-                    if lsh.query(mh):
-                        print(f"[SKIP] Near duplicate (MinHash): {url}")
-                        continue
-
-                    lsh.insert(str(doc_count), mh)
-                    minhashes[doc_id] = mh
-
-                    tokens = stem_tokens(tokenize(text))
-                    for i, token in enumerate(tokens):
-                        temp_index[token][doc_id].append(i)
-
-                    doc_map[doc_id] = norm_url
-                    doc_count += 1
-                except Exception as e:
-                    print(f"[ERROR] Failed to process {file}: {e}")
-                    continue
-
-            if doc_count % PARTIAL_FLUSH_LIMIT == 0:
-                flush_partial_index(temp_index, flush_id)
-                print(f"Flushed partial index {flush_id} with {doc_count} documents")
-                temp_index.clear()
-                flush_id += 1
-
-    if temp_index:
-        flush_partial_index(temp_index, flush_id)
-        print(f"Final flush completed with flush ID {flush_id}")
-
-    # Write index to SQLite before merging partial indices
-    write_index_to_sqlite({}, doc_map, title_map, heading_map)
-
-    final_index = merge_indices(PARTIAL_INDEX_DIR)
-    print("Merged partial indices into final index")
-
-    idf_values = {token: log(doc_count / len(postings)) for token, postings in final_index.items()}
-
-    write_index_to_sqlite(final_index, doc_map, title_map, heading_map, idf_values)
-    print("Saved final index to SQLite database")
-    write_analytics(final_index, doc_count)
-    print("Wrote analytics to file")
+            if file.endswith(".json"):
+                yield os.path.join(root, file)
+
+def read_page_url(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("url", "")
+    except Exception:
+        return ""
+
+def iter_liveness(paths, offline=False, batch_size=LIVENESS_BATCH_SIZE, stage_metrics=metrics):
+    """Yield (path, live) in the order of paths.
+
+    The URLs of each batch of pages are checked together, and the next batch
+    is checked in the background while the current one is being parsed.
+    """
+    def check_batch(batch):
+        with stage_metrics.span("build.liveness"):
+            urls = [read_page_url(path) for path in batch]
+            live = check_urls([url for url in urls if url and is_valid(url)], offline=offline)
+            return [(path, live.get(url, False)) for path, url in zip(batch, urls)]
+
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        pending = prefetcher.submit(check_batch, batches[0])
+        for next_batch in batches[1:] + [None]:
+            with stage_metrics.span("build.liveness_wait"):
+                checked = pending.result()
+            if next_batch is not None:
+                pending = prefetcher.submit(check_batch, next_batch)
+            yield from checked
+
+def parse_pages(paths, workers=1, offline=False, stage_metrics=metrics, shingle_size=SHINGLE_SIZE):
+    """Yield (path, process_page result) in the same order as paths, optionally using a process pool."""
+    jobs = iter_liveness(paths, offline, stage_metrics=stage_metrics)
+    if workers <= 1:
+        for path, live in jobs:
+            yield path, process_page(path, live, shingle_size)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path, live in jobs:
+            pending.append((path, pool.submit(process_page, path, live, shingle_size)))
+            # Bound the read-ahead so parsed pages cannot pile up faster than they are indexed
+            if len(pending) >= workers * PARSE_QUEUE_DEPTH:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+def build_index(backend=INDEX_BACKEND, workers=1, offline=False, shingle_size=SHINGLE_SIZE, shards=INDEX_SHARDS,
+                resume=False, memory_budget=INDEX_MEMORY_BUDGET):
+    """Build the index from every page under DATA_DIR.
+
+    Postings accumulate in memory until they take about memory_budget
+    bytes, and are then flushed to a partial file. After each partial flush
+    the build journals the metadata and duplicate-detection entries of the
+    documents in it next to the partial files, and saves a checkpoint of the
+    position in the list of pages and the files written so far. With resume,
+    a build interrupted
+    after a checkpoint carries on from it, over the same list of pages, and
+    writes the same index an uninterrupted build would have.
+    """
+    if shards > 1 and backend != "binary":
+        raise ValueError("term shards are only supported by the binary backend")
+    accumulated = PostingsAccumulator()
+    start_time = time.time()
+    # Always on for builds: one span per stage per page is negligible next to parsing it
+    build_metrics = Metrics(enabled=True)
+
+    checkpoint = load_checkpoint() if resume else None
+    if checkpoint is not None and checkpoint["shingle_size"] != shingle_size:
+        print(f"[RESUME] Checkpoint uses shingle size {checkpoint['shingle_size']}, not {shingle_size}; starting over")
+        checkpoint = None
+    resumed = checkpoint is not None
+    if not resumed:
+        if resume:
+            print("[RESUME] No usable checkpoint; starting over")
+        checkpoint = {
+            "shingle_size": shingle_size,
+            "paths": list(iter_data_files()),
+            "cursor": 0,
+            "doc_count": 0,
+            "flush_id": 0,
+            "partials": [],
+            "journals": [],
+            "doc_map": {},
+            "title_map": {},
+            "heading_map": {},
+            "doc_lengths": {},
+            "outlinks": {},
+            "duplicates": DuplicateIndex(shingle_size),
+        }
+    else:
+        print(f"[RESUME] Continuing after {checkpoint['cursor']} of {len(checkpoint['paths'])} files "
+              f"({checkpoint['doc_count']} documents indexed)")
 
+    os.makedirs(PARTIAL_INDEX_DIR, exist_ok=True)
+    # Partial files written after the checkpoint, or by an earlier build, would be merged twice
+    keep = set(checkpoint["partials"]) | set(checkpoint["journals"])
+    if resumed:
+        keep |= {BUILD_CHECKPOINT_FILE, BUILD_PAGES_FILE}
+    for f in os.listdir(PARTIAL_INDEX_DIR):
+        if f not in keep:
+            os.remove(os.path.join(PARTIAL_INDEX_DIR, f))
+    if not resumed:
+        save_pages(checkpoint["paths"])
+    paths = checkpoint["paths"]
+    doc_count = checkpoint["doc_count"]
+    flush_id = checkpoint["flush_id"]
+    doc_map = checkpoint["doc_map"]
+    title_map = checkpoint["title_map"]
+    heading_map = checkpoint["heading_map"]
+    doc_lengths = checkpoint["doc_lengths"]
+    outlinks = checkpoint["outlinks"]
+    duplicates = checkpoint["duplicates"]
+    journal = []  # Metadata and dedup entries of the documents accumulated since the last flush
+
+    def flush(cursor):
+        """Write the accumulated postings as the next partial files and checkpoint with paths[:cursor] done."""
+        nonlocal flush_id
+        with build_metrics.span("build.flush"):
+            flush_partial_index(accumulated.records(), flush_id)
+            flush_partial_index(accumulated.field_records(), flush_id, prefix="fields")
+            flush_partial_index(journal, flush_id, prefix="journal")
+            checkpoint["partials"] += [f"partial_{flush_id}.pkl", f"fields_{flush_id}.pkl"]
+            checkpoint["journals"].append(f"journal_{flush_id}.pkl")
+            flush_id += 1
+            checkpoint.update(cursor=cursor, doc_count=doc_count, flush_id=flush_id)
+        print(f"Flushed partial index {flush_id - 1} with {accumulated.documents} documents "
+              f"({accumulated.nbytes / 1024 / 1024:.1f} MB), {doc_count} in total")
+        accumulated.clear()
+        journal.clear()
+        with build_metrics.span("build.checkpoint"):
+            save_checkpoint(checkpoint)
+
+    start = checkpoint["cursor"]
+    pages = parse_pages(paths[start:], workers, offline, build_metrics, shingle_size)
+    for cursor, (path, page) in enumerate(pages, start + 1):
+        for stage, seconds in page["timings"].items():
+            build_metrics.observe(f"build.{stage}", seconds)
+        if "error" in page:
+            print(f"[ERROR] Failed to process {os.path.basename(path)}: {page['error']}")
+            continue
+        url = page["url"]
+        if not url:
+            continue
+        if page["dead"]:
+            print(f"[SKIP] Dead URL: {url}")
+            continue
+        if doc_count % 1000 == 0 and doc_count > 0:
+            elapsed = time.time() - start_time
+            print(f"Processed {doc_count} documents in {elapsed:.2f} seconds")
+        print(f"Processing document {doc_count + 1}: {url}")
+        norm_url = url
+        doc_id = stable_hash_url(norm_url)
+        if doc_id in doc_map:
+            continue
+        if page["skip"]:
+            print(page["skip"])
+            continue
+
+        print(f"[CONTENT PREVIEW] {page['preview']}...")  # Optional: show first 100 chars
+
+        with build_metrics.span("build.dedup"):
+            duplicate = duplicates.check(doc_id, page["content_hash"], page["minhash"])
+            if duplicate is None:
+                duplicates.add(doc_id, page["content_hash"], page["minhash"])
+        if duplicate == "exact":
+            print(f"[SKIP] Exact duplicate: {url}")
+            continue
+        if duplicate == "near":
+            print(f"[SKIP] Near duplicate (MinHash): {url}")
+            continue
+
+        with build_metrics.span("build.accumulate"):
+            accumulated.add(doc_id, page["tokens"], page["field_terms"])
+
+        title_map[doc_id] = page["title"]
+        heading_map[doc_id] = page["headings"]
+        doc_map[doc_id] = norm_url
+        doc_lengths[doc_id] = len(page["tokens"])
+        outlinks[doc_id] = array("I", page["outlinks"])
+        journal.append((doc_id, norm_url, page["title"], page["headings"], doc_lengths[doc_id], outlinks[doc_id],
+                        page["content_hash"], page["minhash"]))
+        doc_count += 1
+
+        if accumulated.nbytes >= memory_budget:
+            flush(cursor)
+
+    if accumulated:
+        flush(len(paths))
+
+    with build_metrics.span("build.dedup_save"):
+        duplicates.save()
+    print(f"Skipped {duplicates.exact_duplicates} exact and {duplicates.near_duplicates} near duplicates")
+
+    with build_metrics.span("build.pagerank"):
+        pagerank = compute_pagerank(outlinks)
+    outlinks.clear()
+    print(f"Computed PageRank over {len(pagerank)} documents")
+
+    with build_metrics.span("build.merge_write"):
+        term_count = write_index_to_sqlite(
+            merge_indices(PARTIAL_INDEX_DIR), merge_field_indices(PARTIAL_INDEX_DIR),
+            doc_map, title_map, heading_map, doc_count, backend, pagerank=pagerank, shards=shards,
+            doc_lengths=doc_lengths, terms_path=TERM_DICTIONARY_FILE
+        )
+    # The new base re-read every page, so segments from earlier incremental updates are obsolete. They
+    # go only once it is committed: until then search serves the old base, and it still needs them.
+    shutil.rmtree(SEGMENT_DIR, ignore_errors=True)
+    print(f"Merged partial indices and saved {term_count} terms to the final index ({backend})")
+    with build_metrics.span("build.doc_features"):
+        write_doc_features(doc_map, pagerank=pagerank, doc_lengths=doc_lengths)
+    build_metrics.count("build.documents", doc_count)
+    build_metrics.count("build.exact_duplicates", duplicates.exact_duplicates)
+    build_metrics.count("build.near_duplicates", duplicates.near_duplicates)
+    write_analytics(term_count, doc_count, build_metrics)
+    for line in build_metrics.summary_lines():
+        print(f"[STAGE] {line}")
+    print("Wrote analytics to file")
+    # The index is complete, so there is nothing left to resume
+    if os.path.exists(checkpoint_path()):
+        os.remove(checkpoint_path())
 
-def load_postings_for_term(term, db_path="final_index.db"):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT postings FROM inverted_index WHERE term=?", (term,))
-    row = cursor.fetchone()
-    conn.close()
-    if row:
-        postings = json.loads(row[0])
-        return postings, len(postings)
-    return {}, 0
\ No newline at end of file
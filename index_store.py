@@ -0,0 +1,820 @@
+"""
+Read side of the index: long-lived SQLite connections, memory-mapped binary
+readers, an LRU cache of decoded postings shared by every query, and the
+query-time view over incremental segments (see segments.py).
+"""
+
+import json
+import mmap
+import os
+import sqlite3
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from math import exp
+
+import numpy as np
+
+from constants import (
+    INDEX_DB, BINARY_INDEX_FILE, DOC_FEATURES_FILE, TERM_DICTIONARY_FILE, INDEX_BACKEND, SEGMENT_DIR, SEGMENT_MANIFEST,
+    SQLITE_MMAP_SIZE, SQLITE_CACHE_KB, POSTINGS_CACHE_BYTES, METADATA_CACHE_SIZE, RESULT_CACHE_BYTES,
+    QUERY_FANOUT_WORKERS, SQLITE_MAX_PARAMS, DOC_COUNT
+)
+from postings import (
+    BinaryIndexReader, LazyPostings, PostingsBlock, decode_field_postings, term_shard, shard_path,
+    FEATURES_MAGIC, FEATURES_HEADER
+)
+from lexicon import TermDictionary
+from pagerank import static_priors, AVERAGE_PRIOR
+from scoring import idf, bm25_idf, MASK_BOOSTS
+
+# Rough in-memory cost of a decoded posting: the doc ID string, the
+# {"positions": [...]} dict and list, plus one int object and slot per position.
+POSTING_OVERHEAD_BYTES = 300
+POSITION_BYTES = 36
+FIELD_POSTING_BYTES = 120
+# Per document of LazyPostings: the int64 doc ID, the float64 term frequency and
+# the doc ID -> row entry built on the first lookup. Positions stay encoded.
+LAZY_POSTING_BYTES = 130
+# Rough cost of a cached query result: its key, dict and lists, plus each (doc_id, score) pair
+RESULT_OVERHEAD_BYTES = 600
+RESULT_ROW_BYTES = 150
+
+_local = threading.local()
+_binary_readers = {}
+_term_dictionaries = {}
+_readers_lock = threading.Lock()
+
+
+def get_connection(db_path=INDEX_DB):
+    """Return this thread's read-only connection to db_path, opening it on first use."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KB}")
+        connections[db_path] = conn
+    return conn
+
+
+def close_connections():
+    for conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+def get_binary_reader(path=BINARY_INDEX_FILE):
+    with _readers_lock:
+        if path not in _binary_readers:
+            _binary_readers[path] = BinaryIndexReader(path)
+        return _binary_readers[path]
+
+
+def get_term_dictionary(path=TERM_DICTIONARY_FILE):
+    """The mapped term dictionary at path, or None for an index built without one."""
+    with _readers_lock:
+        if path not in _term_dictionaries:
+            _term_dictionaries[path] = TermDictionary(path) if os.path.exists(path) else None
+        return _term_dictionaries[path]
+
+
+def estimate_postings_size(postings):
+    if isinstance(postings, LazyPostings):
+        return LAZY_POSTING_BYTES * len(postings) + postings.held_bytes
+    return sum(POSTING_OVERHEAD_BYTES + POSITION_BYTES * len(p["positions"]) for p in postings.values())
+
+
+class PostingsCache:
+    """LRU cache of decoded postings, evicting least recently used terms to stay under a byte budget."""
+
+    def __init__(self, max_bytes=POSTINGS_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, term):
+        with self._lock:
+            entry = self._entries.get(term)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(term)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, term, postings, df, size=None):
+        if size is None:
+            size = estimate_postings_size(postings)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(term, None)
+            if old is not None:
+                self.current_bytes -= old[2]
+            self._entries[term] = (postings, df, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+postings_cache = PostingsCache()
+
+
+class ResultCache:
+    """LRU cache of ranked query results under a byte budget, tied to one index version.
+
+    Keys are built by the caller from the normalized query terms and ranking
+    options. Storing or looking up a result for a different index version
+    empties the cache, so results from before a rebuild or segment update are
+    never served.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _switch_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.version = version
+
+    def get(self, version, key):
+        with self._lock:
+            self._switch_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, version, key, result):
+        size = RESULT_OVERHEAD_BYTES + RESULT_ROW_BYTES * len(result["results"])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._switch_version(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (result, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+result_cache = ResultCache()
+
+
+def load_field_postings(term, db_path=INDEX_DB):
+    """Title/heading/URL postings {doc_id: field mask} for term and the term's largest field boost."""
+    key = ("fields", db_path, term)
+    cached = postings_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        row = get_connection(db_path).execute(
+            "SELECT postings, max_boost FROM field_index WHERE term=?", (term,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # Index built before field postings existed
+        return {}, 0
+    if row is None:
+        return {}, 0
+    field_postings = decode_field_postings(row[0])
+    postings_cache.put(key, field_postings, row[1], size=FIELD_POSTING_BYTES * len(field_postings))
+    return field_postings, row[1]
+
+
+def load_idf(terms, db_path=INDEX_DB):
+    """{term: idf} for just the given terms, instead of loading the whole idf table."""
+    terms = list(dict.fromkeys(terms))
+    if not terms:
+        return {}
+    placeholders = ",".join("?" * len(terms))
+    rows = get_connection(db_path).execute(f"SELECT term, idf FROM idf WHERE term IN ({placeholders})", terms)
+    return {term: float(idf) for term, idf in rows}
+
+
+def read_postings(term, db_path=INDEX_DB, backend=INDEX_BACKEND, shards=1):
+    """(LazyPostings, df) for term, or ({}, 0); only the doc IDs and frequencies are decoded."""
+    path = shard_path(BINARY_INDEX_FILE, term_shard(term, shards), shards)
+    if backend == "binary" and os.path.exists(path):
+        return get_binary_reader(path).load_postings(term)
+
+    conn = get_connection(db_path)
+    try:
+        row = conn.execute("SELECT postings, positions FROM inverted_index WHERE term=?", (term,)).fetchone()
+    except sqlite3.OperationalError:
+        # Index built before the positions got their own column: the postings are JSON
+        row = conn.execute("SELECT postings FROM inverted_index WHERE term=?", (term,)).fetchone()
+        if row is None:
+            return {}, 0
+        postings = json.loads(row[0])
+        return LazyPostings.from_dict(postings, estimate_postings_size(postings)), len(postings)
+    if row is None:
+        return {}, 0
+    block, positions = row
+    postings = PostingsBlock(block, positions).postings(held_bytes=len(block) + len(positions))
+    return postings, len(postings)
+
+
+def complete_from_idf(prefix, limit, doc_count, db_path=INDEX_DB):
+    """Up to limit (term, df) of the terms starting with prefix in db_path's idf table, most frequent first.
+
+    For segments and for indexes built without a term dictionary. The lookup
+    is a range scan of the table's primary key, and idf = log(doc_count / df)
+    gives back each term's df.
+    """
+    if not prefix or limit <= 0:
+        return []
+    successor = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    rows = get_connection(db_path).execute(
+        "SELECT term, idf FROM idf WHERE term >= ? AND term < ? ORDER BY idf, term LIMIT ?", (prefix, successor, limit)
+    )
+    return [(term, round(doc_count * exp(-idf_value))) for term, idf_value in rows]
+
+
+def load_postings_for_term(term, db_path=INDEX_DB, backend=INDEX_BACKEND, shards=1):
+    """Postings for term from the cache, reading them from the index on a miss.
+
+    Cached postings are shared between queries and must be treated as read-only.
+    """
+    cached = postings_cache.get((backend, db_path, term))
+    if cached is not None:
+        return cached
+    postings, df = read_postings(term, db_path, backend, shards)
+    if df:
+        postings_cache.put((backend, db_path, term), postings, df)
+    return postings, df
+
+
+BASE_SEGMENT = "base"  # Tombstone key for documents in the fully built index
+
+
+def segment_path(name):
+    return os.path.join(SEGMENT_DIR, f"{name}.db")
+
+
+def manifest_path():
+    return os.path.join(SEGMENT_DIR, SEGMENT_MANIFEST)
+
+
+def load_manifest():
+    """The segment manifest, or an empty one when no incremental update has been made."""
+    try:
+        with open(manifest_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"generation": 0, "next_segment": 0, "doc_count": None, "segments": [], "tombstones": {}}
+
+
+def load_index_info(db_path=INDEX_DB):
+    """The index_info entries of db_path (build_id, shards), empty for an index built without them."""
+    try:
+        return dict(get_connection(db_path).execute("SELECT key, value FROM index_info"))
+    except sqlite3.Error:
+        return {}
+
+
+_fanout = {"pid": None, "pool": None}
+
+
+def fanout_pool():
+    """Thread pool for reading several terms' postings at once, recreated in a forked worker."""
+    if _fanout["pid"] != os.getpid():
+        _fanout["pool"] = ThreadPoolExecutor(max_workers=QUERY_FANOUT_WORKERS, thread_name_prefix="fanout")
+        _fanout["pid"] = os.getpid()
+    return _fanout["pool"]
+
+
+class SegmentedIndex:
+    """The base index plus the segments and tombstones of one manifest generation.
+
+    A document is live in at most one source: replacing a page tombstones its
+    older copy, so merging sources never has to pick between two versions.
+    Segment files are immutable, so their postings are cached like the base index.
+    """
+
+    def __init__(self, manifest, db_path=INDEX_DB, backend=INDEX_BACKEND, terms_path=TERM_DICTIONARY_FILE):
+        self.db_path = db_path
+        self.backend = backend
+        self.terms_path = terms_path
+        self.generation = manifest["generation"]
+        self.doc_count = manifest["doc_count"]
+        self.tombstones = {name: set(ids) for name, ids in manifest["tombstones"].items() if ids}
+        self.sources = []
+        if os.path.exists(db_path):
+            self.sources.append((BASE_SEGMENT, db_path, backend))
+        for segment in manifest["segments"]:
+            self.sources.append((segment["name"], segment_path(segment["name"]), "sqlite"))
+        self.base_only = not manifest["segments"] and not self.tombstones
+        info = load_index_info(db_path) if os.path.exists(db_path) else {}
+        self.build_id = info.get("build_id")
+        self.shards = int(info.get("shards", 1))
+        self._dead_ids = {
+            name: np.array(sorted(int(doc_id) for doc_id in ids), dtype=np.int64)
+            for name, ids in self.tombstones.items()
+        }
+        # Corpus statistics for BM25. Each source stores its own document count and average
+        # length; tombstoned copies still count towards the average until their segment is merged.
+        total_docs = 0
+        total_length = 0.0
+        self.source_doc_counts = {}
+        for name, source_path, _ in self.sources:
+            source_info = info if name == BASE_SEGMENT else load_index_info(source_path)
+            count = int(source_info.get("doc_count", 0))
+            self.source_doc_counts[name] = count
+            total_docs += count
+            total_length += count * float(source_info.get("avg_doc_length", 0.0))
+        self.avg_doc_length = total_length / total_docs if total_length else 1.0
+        if self.doc_count is not None:
+            self.live_doc_count = self.doc_count
+        else:
+            # Indexes built before index_info held the document count fall back to the crawl size
+            self.live_doc_count = total_docs or DOC_COUNT
+        # Changes whenever search could rank differently: after a full build or a segment update
+        self.version = (self.build_id, self.generation)
+
+    def _live(self, name, postings):
+        dead = self.tombstones.get(name)
+        if not dead:
+            return postings
+        return {doc_id: p for doc_id, p in postings.items() if doc_id not in dead}
+
+    def _live_postings(self, name, postings):
+        dead = self._dead_ids.get(name)
+        if dead is None:
+            return postings
+        return postings.select(~np.isin(postings.doc_ids, dead))
+
+    def load_postings(self, term):
+        """Live postings for term across every source, and their document frequency."""
+        if self.base_only:
+            return load_postings_for_term(term, self.db_path, self.backend, self.shards)
+        parts = []
+        for name, db_path, backend in self.sources:
+            postings, df = load_postings_for_term(term, db_path, backend, self.shards if name == BASE_SEGMENT else 1)
+            if df:
+                parts.append(self._live_postings(name, postings))
+        if not parts:
+            return {}, 0
+        merged = LazyPostings.concat(parts)
+        return merged, len(merged)
+
+    def load_frequencies(self, term):
+        """Live ((doc IDs sorted ascending, term frequencies), df) for term across every source."""
+        postings, df = self.load_postings(term)
+        if not df:
+            return None, 0
+        return (postings.doc_ids, postings.tfs), df
+
+    def load_frequencies_many(self, terms):
+        """{term: (frequencies, df)} for each distinct term, read in parallel like load_postings_many."""
+        terms = list(dict.fromkeys(terms))
+        if self.shards > 1 and len(terms) > 1:
+            return dict(zip(terms, fanout_pool().map(self.load_frequencies, terms)))
+        return {term: self.load_frequencies(term) for term in terms}
+
+    def load_intersection(self, terms):
+        """Intersection of the documents holding every term with df > 0, taken rarest term first.
+
+        With a version 2 binary base index and no segments, the longer lists
+        are probed through their skip tables, so only the runs holding
+        candidates are decoded. Otherwise the frequency arrays of the
+        cached postings are intersected.
+        """
+        terms = list(dict.fromkeys(terms))
+        if self.base_only and self.backend == "binary":
+            blocks = {}
+            for term in terms:
+                path = shard_path(BINARY_INDEX_FILE, term_shard(term, self.shards), self.shards)
+                if not os.path.exists(path) or get_binary_reader(path).version < 2:
+                    break
+                blocks[term] = get_binary_reader(path).postings_block(term)
+            else:
+                return _intersect_blocks(blocks)
+
+        loaded = self.load_postings_many(terms)
+        dfs = {term: df for term, (_, df) in loaded.items()}
+        present = sorted((term for term in terms if dfs[term]), key=dfs.get)
+        if not present:
+            return Intersection(np.zeros(0, dtype=np.int64), {}, dfs, None)
+        postings = {term: loaded[term][0] for term in present}
+        doc_ids = postings[present[0]].doc_ids
+        frequencies = {present[0]: postings[present[0]].tfs}
+        for term in present[1:]:
+            doc_ids, kept, found = np.intersect1d(doc_ids, postings[term].doc_ids, assume_unique=True, return_indices=True)
+            frequencies = {t: f[kept] for t, f in frequencies.items()}
+            frequencies[term] = postings[term].tfs[found]
+
+        def positions(term, indices):
+            return postings[term].positions(doc_ids[indices])
+
+        return Intersection(doc_ids, frequencies, dfs, positions)
+
+    def load_postings_many(self, terms):
+        """{term: (postings, df)} for each distinct term; a sharded index reads them in parallel.
+
+        Each term lives in one shard file, so a long postings list only delays
+        its own term instead of every term after it.
+        """
+        terms = list(dict.fromkeys(terms))
+        if self.shards > 1 and len(terms) > 1:
+            return dict(zip(terms, fanout_pool().map(self.load_postings, terms)))
+        return {term: self.load_postings(term) for term in terms}
+
+    def load_field_postings(self, term):
+        """Live field postings for term across every source, and the largest field boost among them."""
+        if self.base_only:
+            return load_field_postings(term, self.db_path)
+        parts = []
+        max_boost = 0
+        for name, db_path, _ in self.sources:
+            field_postings, boost = load_field_postings(term, db_path)
+            if field_postings:
+                parts.append(self._live(name, field_postings))
+                max_boost = max(max_boost, boost)
+        if len(parts) == 1:
+            return parts[0], max_boost
+        merged = {}
+        for field_postings in parts:
+            merged.update(field_postings)
+        return merged, max_boost
+
+    def query_idf(self, idf_values, dfs):
+        """IDF of the query terms in {term: live df}: the precomputed values, or live values once segments exist.
+
+        idf_values may be None, in which case only the query terms are read from the idf table.
+        """
+        if self.base_only or not self.doc_count:
+            return load_idf(dfs, self.db_path) if idf_values is None else idf_values
+        return {term: idf(self.doc_count, df) for term, df in dfs.items() if df}
+
+    def query_bm25_idf(self, dfs):
+        """BM25 IDF of each term in {term: live df}, over the live document count."""
+        return {term: bm25_idf(self.live_doc_count, df) for term, df in dfs.items() if df}
+
+    def complete(self, prefix, limit):
+        """Up to limit (term, df) of the indexed terms starting with prefix, most frequent first.
+
+        The base index answers from its term dictionary, segments (and bases
+        built without one) from their idf tables; a term's df is summed over
+        the sources that list it, and still counts tombstoned documents until
+        their segment is merged.
+        """
+        dfs = defaultdict(int)
+        for name, db_path, _ in self.sources:
+            terms = get_term_dictionary(self.terms_path) if name == BASE_SEGMENT else None
+            if terms is not None:
+                matches = terms.complete(prefix, limit)
+            else:
+                doc_count = self.source_doc_counts[name] or DOC_COUNT
+                matches = complete_from_idf(prefix, limit, doc_count, db_path)
+            for term, df in matches:
+                dfs[term] += df
+        return sorted(dfs.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
+
+
+class ExpandedIndex:
+    """index as seen by one query whose prefix slots stand for the terms they were expanded to.
+
+    slots maps a query term such as "comput*" to its expansions. A slot reads
+    as a single term: its postings are the union of theirs, with positions
+    merged, its field masks are ORed, and its df counts the documents holding
+    any of them. So a document matches the slot through any expansion, a
+    phrase or window may use any of them, and its tf-idf weighs all of them
+    together instead of counting each one as a query term of its own.
+    """
+
+    def __init__(self, index, slots):
+        self.index = index
+        self.slots = slots
+        self.version = index.version
+        self.avg_doc_length = index.avg_doc_length
+
+    def _split(self, terms):
+        terms = list(dict.fromkeys(terms))
+        return [term for term in terms if term not in self.slots], [term for term in terms if term in self.slots]
+
+    def load_postings_many(self, terms):
+        plain, slots = self._split(terms)
+        loaded = self.index.load_postings_many(plain + [t for slot in slots for t in self.slots[slot]])
+        for slot in slots:
+            parts = [loaded[term][0] for term in self.slots[slot] if loaded[term][1]]
+            postings = LazyPostings.union(parts) if parts else {}
+            loaded[slot] = postings, len(postings)
+        return {term: loaded[term] for term in plain + slots}
+
+    def load_frequencies_many(self, terms):
+        return {
+            term: ((postings.doc_ids, postings.tfs), df) if df else (None, 0)
+            for term, (postings, df) in self.load_postings_many(terms).items()
+        }
+
+    def load_field_postings(self, term):
+        if term not in self.slots:
+            return self.index.load_field_postings(term)
+        merged = defaultdict(int)
+        for expansion in self.slots[term]:
+            for doc_id, mask in self.index.load_field_postings(expansion)[0].items():
+                merged[doc_id] |= mask
+        return dict(merged), max((MASK_BOOSTS[mask] for mask in merged.values()), default=0)
+
+    def query_idf(self, idf_values, dfs):
+        plain, slots = self._split(dfs)
+        values = dict(self.index.query_idf(idf_values, {term: dfs[term] for term in plain}))
+        values.update({slot: idf(self.index.live_doc_count, dfs[slot]) for slot in slots if dfs[slot]})
+        return values
+
+    def query_bm25_idf(self, dfs):
+        return self.index.query_bm25_idf(dfs)
+
+
+class Intersection:
+    """Documents holding every present query term, with their term frequencies; positions are decoded on request."""
+
+    def __init__(self, doc_ids, frequencies, dfs, positions):
+        self.doc_ids = doc_ids  # Sorted int64 array
+        self.frequencies = frequencies  # term -> float array aligned with doc_ids
+        self.dfs = dfs  # df of every query term, 0 for missing ones
+        self._positions = positions  # (term, indices into doc_ids) -> position lists
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def postings(self, indices):
+        """{term: {doc_id: {"positions": [...]}}} for the documents at the given indices of doc_ids."""
+        keys = [str(doc_id) for doc_id in self.doc_ids[indices].tolist()]
+        return {
+            term: {doc_id: {"positions": positions} for doc_id, positions in zip(keys, self._positions(term, indices))}
+            for term in self.frequencies
+        }
+
+
+def _intersect_blocks(blocks):
+    dfs = {term: block.df if block is not None else 0 for term, block in blocks.items()}
+    present = sorted((term for term in blocks if dfs[term]), key=dfs.get)
+    if not present:
+        return Intersection(np.zeros(0, dtype=np.int64), {}, dfs, None)
+    doc_ids = blocks[present[0]].doc_ids()
+    rows = {present[0]: np.arange(len(doc_ids))}
+    for term in present[1:]:
+        found = blocks[term].find(doc_ids)
+        keep = found >= 0
+        doc_ids = doc_ids[keep]
+        rows = {t: r[keep] for t, r in rows.items()}
+        rows[term] = found[keep]
+    frequencies = {term: blocks[term].frequencies(rows[term]) for term in present}
+    return Intersection(doc_ids, frequencies, dfs, lambda term, indices: blocks[term].positions(rows[term][indices]))
+
+
+_current_index = {"mtime": None, "index": None}
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def current_index():
+    """SegmentedIndex for the index on disk, reloaded when a build or an update rewrites it."""
+    mtime = (_mtime(manifest_path()), _mtime(INDEX_DB))
+    if _current_index["index"] is None or _current_index["mtime"] != mtime:
+        previous = _current_index["index"]
+        index = SegmentedIndex(load_manifest())
+        if previous is not None and previous.build_id != index.build_id:
+            # A full build replaced the base files, so postings decoded or mapped from them are stale
+            postings_cache.clear()
+            with _readers_lock:
+                _binary_readers.clear()
+                _term_dictionaries.clear()
+        _current_index["index"] = index
+        _current_index["mtime"] = mtime
+    return _current_index["index"]
+
+
+class DocStore:
+    """On-demand view of doc_metadata that search uses in place of a fully loaded doc_map.
+
+    URL slash counts, PageRank priors and document lengths, which scoring
+    needs for every candidate, come from doc_features.bin: sorted doc IDs
+    searched in place in the mmap, with one slash byte, one rank and one
+    length per document. URLs, titles
+    and headings are fetched only for the documents a query shows, and the
+    most recent ones stay in an LRU cache.
+    """
+
+    def __init__(self, db_path=INDEX_DB, features_path=DOC_FEATURES_FILE, cache_size=METADATA_CACHE_SIZE):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        if os.path.exists(features_path):
+            with open(features_path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = FEATURES_HEADER.unpack_from(self._mm, 0)
+            if magic != FEATURES_MAGIC:
+                raise ValueError(f"{features_path} is not a document features file")
+            offset = FEATURES_HEADER.size
+            self.doc_ids = np.frombuffer(self._mm, dtype="<u4", count=count, offset=offset)
+            offset += 4 * count
+            if version >= 2:
+                ranks = np.frombuffer(self._mm, dtype="<f4", count=count, offset=offset)
+                offset += 4 * count
+            else:
+                ranks = np.zeros(count)
+            if version >= 3:
+                self.lengths = np.frombuffer(self._mm, dtype="<u4", count=count, offset=offset)
+                offset += 4 * count
+            else:
+                self.lengths = None
+            self.slashes = np.frombuffer(self._mm, dtype=np.uint8, count=count, offset=offset)
+        else:
+            # Index built before doc_features.bin existed: derive the same arrays from doc_metadata
+            cursor = get_connection(db_path).execute("SELECT * FROM doc_metadata")
+            columns = [c[0] for c in cursor.description]
+            url_col = columns.index("url")
+            rank_col = columns.index("pagerank") if "pagerank" in columns else None
+            length_col = columns.index("length") if "length" in columns else None
+            rows = sorted(cursor.fetchall(), key=lambda row: int(row[0]))
+            self.doc_ids = np.array([int(row[0]) for row in rows], dtype=np.uint32)
+            self.slashes = np.array([min(row[url_col].count("/"), 255) for row in rows], dtype=np.uint8)
+            ranks = np.array([(row[rank_col] or 0.0) if rank_col is not None else 0.0 for row in rows])
+            self.lengths = np.array([row[length_col] or 0 for row in rows]) if length_col is not None else None
+        self._ids = memoryview(self.doc_ids).cast("B").cast("I")
+        self.priors = static_priors(ranks)
+        # An index built without PageRank gives every document the same zero prior
+        self.default_prior = AVERAGE_PRIOR if ranks.any() else 0.0
+        self.max_prior = max(float(self.priors.max(initial=0.0)), self.default_prior)
+
+    def metadata(self, doc_id):
+        """(url, title, headings) of doc_id, or None if no live source holds it."""
+        doc_id = str(doc_id)
+        with self._lock:
+            row = self._cache.get(doc_id)
+            if row is not None:
+                self._cache.move_to_end(doc_id)
+                return row
+        # Newer segments hold the current copy of a replaced page
+        for _, db_path, _ in reversed(current_index().sources):
+            row = get_connection(db_path).execute(
+                "SELECT url, title, headings FROM doc_metadata WHERE doc_id=?", (doc_id,)
+            ).fetchone()
+            if row is not None:
+                break
+        if row is None:
+            return None
+        with self._lock:
+            self._cache[doc_id] = row
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return row
+
+    def get(self, doc_id, default=""):
+        row = self.metadata(doc_id)
+        return row[0] if row is not None else default
+
+    def __getitem__(self, doc_id):
+        row = self.metadata(doc_id)
+        if row is None:
+            raise KeyError(doc_id)
+        return row[0]
+
+    def __contains__(self, doc_id):
+        return self.metadata(doc_id) is not None
+
+    def slash_counts(self, doc_ids):
+        """URL slash count of every doc ID in the int array doc_ids, as floats."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        counts = np.zeros(len(doc_ids))
+        found = np.zeros(len(doc_ids), dtype=bool)
+        if len(self.doc_ids):
+            rows = np.minimum(np.searchsorted(self.doc_ids, doc_ids), len(self.doc_ids) - 1)
+            found = self.doc_ids[rows] == doc_ids
+            counts[found] = self.slashes[rows[found]]
+        # Documents added by segments after the build are not in doc_features.bin
+        for i in np.flatnonzero(~found):
+            counts[i] = self.get(int(doc_ids[i])).count("/")
+        return counts
+
+    def slash_count(self, doc_id):
+        """Scalar slash_counts for the per-document scoring loop, searching a plain memoryview."""
+        doc_id = int(doc_id)
+        i = bisect_left(self._ids, doc_id)
+        if i < len(self._ids) and self._ids[i] == doc_id:
+            return int(self.slashes[i])
+        return self.get(doc_id).count("/")
+
+    def static_priors(self, doc_ids):
+        """PageRank prior of every doc ID in the int array doc_ids."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        # Documents added by segments after the build were not ranked and get the average prior
+        priors = np.full(len(doc_ids), self.default_prior)
+        if len(self.doc_ids):
+            rows = np.minimum(np.searchsorted(self.doc_ids, doc_ids), len(self.doc_ids) - 1)
+            found = self.doc_ids[rows] == doc_ids
+            priors[found] = self.priors[rows[found]]
+        return priors
+
+    def static_prior(self, doc_id):
+        """Scalar static_priors for the per-document scoring loop."""
+        doc_id = int(doc_id)
+        i = bisect_left(self._ids, doc_id)
+        if i < len(self._ids) and self._ids[i] == doc_id:
+            return float(self.priors[i])
+        return self.default_prior
+
+    def doc_lengths(self, doc_ids, default):
+        """Length in tokens of every doc ID in the int array doc_ids; default where it is not stored."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        lengths = np.full(len(doc_ids), float(default))
+        if self.lengths is None:
+            # Index built before document lengths were stored
+            return lengths
+        found = np.zeros(len(doc_ids), dtype=bool)
+        if len(self.doc_ids):
+            rows = np.minimum(np.searchsorted(self.doc_ids, doc_ids), len(self.doc_ids) - 1)
+            found = self.doc_ids[rows] == doc_ids
+            lengths[found] = self.lengths[rows[found]]
+        # Documents added by segments after the build are not in doc_features.bin
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            segment_lengths = self._segment_lengths(str(doc_id) for doc_id in doc_ids[missing].tolist())
+            for i in missing:
+                length = segment_lengths.get(str(int(doc_ids[i])))
+                if length is not None:
+                    lengths[i] = length
+        return lengths
+
+    def _segment_lengths(self, doc_ids):
+        """{doc_id: length} of the given doc IDs (strings) held by segments, with one IN query per chunk."""
+        remaining = list(dict.fromkeys(doc_ids))
+        lengths = {}
+        # Newer segments hold the current copy of a replaced page
+        for name, db_path, _ in reversed(current_index().sources):
+            if name == BASE_SEGMENT or not remaining:
+                continue
+            conn = get_connection(db_path)
+            for i in range(0, len(remaining), SQLITE_MAX_PARAMS):
+                chunk = remaining[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT doc_id, length FROM doc_metadata WHERE doc_id IN ({placeholders})", chunk)
+                lengths.update((str(doc_id), length) for doc_id, length in rows)
+            remaining = [doc_id for doc_id in remaining if doc_id not in lengths]
+        return lengths
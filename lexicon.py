@@ -0,0 +1,223 @@
+"""
+Sorted term dictionary for prefix queries and type-ahead suggestions.
+
+build_index writes every term of the final index, in sorted order, with its
+document frequency into term_dict.bin:
+
+    header      magic, version, term count, terms per block, offset of the
+                block offsets, offset of the dfs
+    blocks      TERMS_PER_BLOCK terms each, front coded: the first term in
+                full (varint length, bytes), every other term as the length
+                of the prefix it shares with the term before it, then the
+                length and bytes of the rest (varints)
+    offsets     start of every block, plus the end of the last one (u32)
+    dfs         document frequency of every term, by its rank in sort order (u32)
+
+Terms that share a prefix are neighbours, so a prefix covers one contiguous
+range of ranks. prefix_range() finds its ends by binary searching the first
+terms of the blocks in the mmap and decoding at most one block per end, and
+complete() picks the most frequent terms of the range from the dfs array,
+decoding only their blocks. Nothing is loaded when the file is opened.
+"""
+
+import mmap
+import os
+import struct
+from itertools import islice
+
+import numpy as np
+
+MAGIC = b"CSIXTERM"
+VERSION = 1
+TERMS_PER_BLOCK = 16  # Terms per front-coded block; a lookup decodes at most one block per range end
+
+_HEADER = struct.Struct("<8sIIIIQ")  # magic, version, term count, terms per block, offsets offset, dfs offset
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(buf, offset):
+    byte = buf[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _shared_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _successor(key):
+    """The smallest byte string above every string that starts with key, or None if there is none."""
+    key = key.rstrip(b"\xff")
+    if not key:
+        return None
+    return key[:-1] + bytes([key[-1] + 1])
+
+
+class TermDictionaryWriter:
+    """Writes (term, df) pairs, added in sorted term order, as a front-coded term dictionary."""
+
+    def __init__(self, path, terms_per_block=TERMS_PER_BLOCK):
+        self.path = path
+        self.terms_per_block = terms_per_block
+        self._tmp_path = path + ".tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(b"\0" * _HEADER.size)
+        self._block = bytearray()
+        self._block_offsets = []
+        self._dfs = []
+        self._previous = None
+
+    def add(self, term, df):
+        key = term.encode("utf-8")
+        if self._previous is not None and key <= self._previous:
+            raise ValueError(f"terms must be added in sorted order, got {term!r} after {self._previous!r}")
+        if len(self._dfs) % self.terms_per_block == 0:
+            self._flush_block()
+            self._block_offsets.append(self._file.tell())
+            _write_varint(self._block, len(key))
+            self._block += key
+        else:
+            shared = _shared_prefix(self._previous, key)
+            _write_varint(self._block, shared)
+            _write_varint(self._block, len(key) - shared)
+            self._block += key[shared:]
+        self._dfs.append(df)
+        self._previous = key
+
+    def _flush_block(self):
+        self._file.write(self._block)
+        self._block.clear()
+
+    def close(self):
+        self._flush_block()
+        self._block_offsets.append(self._file.tell())
+        # Pad so the u32 arrays start 4-byte aligned
+        self._file.write(b"\0" * (-self._file.tell() % 4))
+        offsets_offset = self._file.tell()
+        self._file.write(np.array(self._block_offsets, dtype="<u4").tobytes())
+        dfs_offset = self._file.tell()
+        self._file.write(np.array(self._dfs, dtype="<u4").tobytes())
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(self._dfs), self.terms_per_block, offsets_offset, dfs_offset))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._tmp_path)
+
+
+class TermDictionary:
+    """Read-only, memory-mapped view of a term dictionary file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.term_count, self.terms_per_block, offsets_offset, dfs_offset = \
+            _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} term dictionary")
+        self._block_count = -(-self.term_count // self.terms_per_block)
+        self._offsets = np.frombuffer(self._mm, dtype="<u4", count=self._block_count + 1, offset=offsets_offset)
+        self.dfs = np.frombuffer(self._mm, dtype="<u4", count=self.term_count, offset=dfs_offset)
+
+    def __len__(self):
+        return self.term_count
+
+    def _first(self, block):
+        """First term of block, which is stored in full."""
+        length, offset = _read_varint(self._mm, int(self._offsets[block]))
+        return self._mm[offset:offset + length]
+
+    def _iter_block(self, block):
+        """The terms of block in order, as bytes, decoded as they are consumed."""
+        data = self._mm[int(self._offsets[block]):int(self._offsets[block + 1])]
+        length, offset = _read_varint(data, 0)
+        term = data[offset:offset + length]
+        offset += length
+        yield term
+        while offset < len(data):
+            shared, offset = _read_varint(data, offset)
+            length, offset = _read_varint(data, offset)
+            term = term[:shared] + data[offset:offset + length]
+            offset += length
+            yield term
+
+    def lower_bound(self, key):
+        """Rank of the first term >= key (bytes), or the term count if there is none."""
+        lo, hi = 0, self._block_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._first(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        # Block lo - 1 is the last one starting at or below key, so the bound is in it or starts block lo
+        if lo == 0:
+            return 0
+        block = lo - 1
+        for i, term in enumerate(self._iter_block(block)):
+            if term >= key:
+                return block * self.terms_per_block + i
+        return min(lo * self.terms_per_block, self.term_count)
+
+    def prefix_range(self, prefix):
+        """(first, end) ranks of the terms that start with prefix; first == end if there are none."""
+        key = prefix.encode("utf-8")
+        first = self.lower_bound(key)
+        successor = _successor(key)
+        end = self.term_count if successor is None else self.lower_bound(successor)
+        return first, end
+
+    def term(self, rank):
+        block, i = divmod(rank, self.terms_per_block)
+        return next(islice(self._iter_block(block), i, None)).decode("utf-8")
+
+    def terms(self, first, end):
+        """(term, df) of the terms with ranks first to end - 1, in sorted order."""
+        for block in range(first // self.terms_per_block, -(-end // self.terms_per_block)):
+            start = block * self.terms_per_block
+            for rank, term in enumerate(self._iter_block(block), start):
+                if first <= rank < end:
+                    yield term.decode("utf-8"), int(self.dfs[rank])
+
+    def complete(self, prefix, limit):
+        """Up to limit (term, df) of the terms starting with prefix, most frequent first, ties in term order."""
+        if limit <= 0:
+            return []
+        first, end = self.prefix_range(prefix)
+        if end - first <= limit:
+            return sorted(self.terms(first, end), key=lambda pair: -pair[1])
+        dfs = self.dfs[first:end]
+        # The limit-th largest df: every term above it is kept, and the first ones equal to it fill up the rest
+        kth = np.partition(dfs, len(dfs) - limit)[len(dfs) - limit]
+        above = np.flatnonzero(dfs > kth)
+        top = np.concatenate([above, np.flatnonzero(dfs == kth)[:limit - len(above)]])
+        top = top[np.lexsort((top, -dfs[top].astype(np.int64)))]
+        return [(self.term(first + int(i)), int(dfs[i])) for i in top]
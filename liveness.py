@@ -0,0 +1,137 @@
+"""
+Concurrent URL liveness checks with a persistent cache.
+
+check_urls() resolves each host once. It then sends HEAD requests, falling
+back to GET as utils.is_live_url does, from a thread pool. Each worker
+thread keeps its own pooled requests.Session, and a per-host semaphore caps
+how many requests hit one server at a time. Results are stored in
+liveness.db with the time they were checked, so a rebuild only rechecks
+URLs whose entry has expired.
+
+With offline=True nothing touches the network. Cached results are served,
+and URLs without a fresh entry count as live, since they were reachable
+when crawled.
+"""
+
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from constants import (
+    LIVENESS_DB, LIVENESS_WORKERS, LIVENESS_PER_HOST, LIVENESS_TIMEOUT,
+    LIVENESS_TTL, LIVENESS_DEAD_TTL, SQLITE_MAX_PARAMS
+)
+
+_local = threading.local()
+
+
+class LivenessCache:
+    """url -> (live, checked_at) table in SQLite, with separate expiry for live and dead results."""
+
+    def __init__(self, path=LIVENESS_DB):
+        self.path = path
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE IF NOT EXISTS url_status (url TEXT PRIMARY KEY, live INTEGER, checked_at REAL)")
+        conn.commit()
+        conn.close()
+
+    def get_many(self, urls):
+        """{url: live} for the urls whose cached result has not expired."""
+        urls = list(urls)
+        now = time.time()
+        results = {}
+        conn = sqlite3.connect(self.path)
+        for i in range(0, len(urls), SQLITE_MAX_PARAMS):
+            chunk = urls[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT url, live, checked_at FROM url_status WHERE url IN ({placeholders})", chunk
+            )
+            for url, live, checked_at in rows:
+                if now - checked_at < (LIVENESS_TTL if live else LIVENESS_DEAD_TTL):
+                    results[url] = bool(live)
+        conn.close()
+        return results
+
+    def put_many(self, results):
+        now = time.time()
+        conn = sqlite3.connect(self.path)
+        conn.executemany(
+            "INSERT OR REPLACE INTO url_status (url, live, checked_at) VALUES (?, ?, ?)",
+            ((url, int(live), now) for url, live in results.items())
+        )
+        conn.commit()
+        conn.close()
+
+
+def _session():
+    """This thread's Session; its adapter keeps a pool of open connections per host."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=LIVENESS_WORKERS, pool_maxsize=LIVENESS_PER_HOST)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+
+def _resolves(hostname):
+    if not hostname:
+        return False
+    try:
+        socket.gethostbyname(hostname)
+        return True
+    except socket.error:
+        return False
+
+
+def check_url(url, timeout=LIVENESS_TIMEOUT):
+    """True if url answers a HEAD, or a GET when HEAD is refused, with status < 400."""
+    session = _session()
+    try:
+        res = session.head(url, timeout=timeout, allow_redirects=True)
+        if res.status_code >= 400:
+            with session.get(url, stream=True, timeout=timeout) as res:
+                return res.status_code < 400
+        return res.status_code < 400
+    except Exception:
+        return False
+
+
+def check_urls(urls, offline=False, timeout=LIVENESS_TIMEOUT, cache=None):
+    """{url: live} for every url, from the cache when fresh and from concurrent checks otherwise."""
+    cache = cache or LivenessCache()
+    urls = list(dict.fromkeys(urls))
+    results = cache.get_many(urls)
+    missing = [url for url in urls if url not in results]
+    if not missing:
+        return results
+    if offline:
+        results.update((url, True) for url in missing)
+        return results
+
+    hosts = list({urlparse(url).hostname for url in missing})
+    host_limits = {host: threading.Semaphore(LIVENESS_PER_HOST) for host in hosts}
+
+    with ThreadPoolExecutor(max_workers=LIVENESS_WORKERS) as pool:
+        resolved = dict(zip(hosts, pool.map(_resolves, hosts)))
+
+        def check(url):
+            host = urlparse(url).hostname
+            if not resolved[host]:
+                return False
+            with host_limits[host]:
+                return check_url(url, timeout)
+
+        checked = dict(zip(missing, pool.map(check, missing)))
+
+    cache.put_many(checked)
+    results.update(checked)
+    return results
@@ -0,0 +1,188 @@
+"""
+Timing spans, counters and profiling hooks for the indexing and search hot paths.
+
+    with metrics.span("query.load_postings"):
+        ...
+    metrics.count("query.scored", scored)
+
+The global registry is disabled unless METRICS_ENABLED is set or the
+service/CLI is started with --metrics. While disabled, span() hands back one
+shared no-op context manager, so the instrumentation costs a function call.
+Every span name gets a histogram of durations, exported as JSON or in the
+Prometheus text format.
+"""
+
+import cProfile
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from constants import METRICS_ENABLED
+
+# Histogram bucket upper bounds in seconds; observations above the last one land in +Inf
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_SPAN = nullcontext()
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Stopwatch:
+    """Lap timer for code that cannot report to a registry directly, such as parse worker processes."""
+
+    def __init__(self):
+        self.laps = {}
+        self._mark = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.laps[stage] = self.laps.get(stage, 0.0) + now - self._mark
+        self._mark = now
+
+
+class Metrics:
+    """Per-stage duration histograms and counters, safe to update from several threads."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += n
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def to_dict(self):
+        with self._lock:
+            stages = {}
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                buckets = {}
+                for bound, n in zip([*map(str, BUCKETS), "+Inf"], h.counts):
+                    cumulative += n
+                    buckets[bound] = cumulative
+                stages[name] = {
+                    "count": h.count,
+                    "total_seconds": h.total,
+                    "mean_ms": h.total / h.count * 1000 if h.count else 0.0,
+                    "max_ms": h.max * 1000,
+                    "buckets": buckets,
+                }
+            return {"stages": stages, "counters": dict(sorted(self.counters.items()))}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix="search"):
+        data = self.to_dict()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent per instrumented stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for name, stage in data["stages"].items():
+            for bound, cumulative in stage["buckets"].items():
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["total_seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        if data["counters"]:
+            lines.append(f"# HELP {prefix}_events_total Instrumented event counts.")
+            lines.append(f"# TYPE {prefix}_events_total counter")
+            for name, value in data["counters"].items():
+                lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """One line per stage, largest total first, for plain-text reports."""
+        stages = self.to_dict()["stages"]
+        ordered = sorted(stages.items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+        return [
+            f"{name}: {s['total_seconds']:.2f} s over {s['count']} calls "
+            f"({s['mean_ms']:.3f} ms mean, {s['count'] / s['total_seconds'] if s['total_seconds'] else 0:.0f}/s)"
+            for name, s in ordered
+        ]
+
+
+metrics = Metrics(enabled=METRICS_ENABLED)
+
+
+@contextmanager
+def profiling(profile_path=None, trace_memory=False, top=15):
+    """Optionally run the block under cProfile (stats saved to profile_path) and/or tracemalloc."""
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f"Saved cProfile stats to {profile_path}")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"Peak traced memory: {peak / 1024 / 1024:.1f} MB")
+            for stat in snapshot.statistics("lineno")[:top]:
+                print(stat)
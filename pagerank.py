@@ -1,30 +1,78 @@
-from collections import defaultdict
+"""
+PageRank over the crawled link graph, used as a static ranking prior.
 
-def compute_pagerank(outlinks_map, damping=0.85, max_iter=50, tol=1e-6):
-    N = len(outlinks_map)
-    if N == 0:
-        return {}
+build_index collects each page's outlinks as doc IDs while it parses. The
+graph between indexed pages is turned into a CSR adjacency (row = source
+page, sorted column indices = target pages), and the power iteration runs
+on whole NumPy arrays. Each step scatters rank along every edge with one
+bincount, and spreads the rank of dangling pages (no outlinks) evenly over
+all pages, so the scores always sum to 1. Search adds static_priors() of
+the stored ranks to every document's score.
+"""
 
-    pagerank = {doc: 1 / N for doc in outlinks_map}
-    inlinks_map = defaultdict(set)
+import numpy as np
 
-    for src, outlinks in outlinks_map.items():
-        for dst in outlinks:
-            inlinks_map[dst].add(src)
+from constants import PAGERANK_DAMPING, PAGERANK_MAX_ITER, PAGERANK_TOL, PAGERANK_WEIGHT
 
+# Prior of a page with the average rank 1/N, given to pages indexed after the link graph was ranked
+AVERAGE_PRIOR = float(PAGERANK_WEIGHT * np.log1p(1.0))
+
+
+def link_matrix(doc_ids, outlinks):
+    """CSR (indptr, indices) of the links between doc_ids, rows and columns in doc_ids order.
+
+    outlinks maps a doc ID to the doc IDs it links to. Links to pages outside
+    doc_ids, self-links and repeated links are dropped.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    order = np.argsort(doc_ids, kind="stable")
+    sorted_ids = doc_ids[order]
+    indptr = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+    rows = []
+    for row, doc_id in enumerate(doc_ids.tolist()):
+        targets = np.fromiter(outlinks.get(doc_id, ()), dtype=np.int64)
+        if len(sorted_ids) and len(targets):
+            pos = np.minimum(np.searchsorted(sorted_ids, targets), len(sorted_ids) - 1)
+            cols = np.unique(order[pos[sorted_ids[pos] == targets]])
+            cols = cols[cols != row]
+        else:
+            cols = np.zeros(0, dtype=np.int64)
+        rows.append(cols)
+        indptr[row + 1] = indptr[row] + len(cols)
+    indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    return indptr, indices
+
+
+def pagerank_vector(indptr, indices, damping=PAGERANK_DAMPING, max_iter=PAGERANK_MAX_ITER, tol=PAGERANK_TOL):
+    """PageRank of every row of a CSR link matrix by power iteration; stops once the L1 change is below tol."""
+    n = len(indptr) - 1
+    if n == 0:
+        return np.zeros(0)
+    out_degree = np.diff(indptr)
+    dangling = out_degree == 0
+    sources = np.repeat(np.arange(n), out_degree)
+    inv_degree = np.divide(1.0, out_degree, out=np.zeros(n), where=~dangling)
+
+    rank = np.full(n, 1.0 / n)
     for _ in range(max_iter):
-        new_rank = {}
-        for doc in pagerank:
-            rank_sum = sum(
-                pagerank[src] / len(outlinks_map[src])
-                for src in inlinks_map[doc]
-                if len(outlinks_map[src]) > 0
-            )
-            new_rank[doc] = (1 - damping) / N + damping * rank_sum
-
-        # Check for convergence
-        if max(abs(new_rank[doc] - pagerank[doc]) for doc in pagerank) < tol:
+        spread = np.bincount(indices, weights=(rank * inv_degree)[sources], minlength=n)
+        new_rank = damping * (spread + rank[dangling].sum() / n) + (1 - damping) / n
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tol:
             break
-        pagerank = new_rank
+    return rank
+
+
+def compute_pagerank(outlinks_map, damping=PAGERANK_DAMPING, max_iter=PAGERANK_MAX_ITER, tol=PAGERANK_TOL):
+    """{doc: PageRank} for every key of outlinks_map ({doc: iterable of linked docs}, docs being ints)."""
+    doc_ids = sorted(outlinks_map)
+    indptr, indices = link_matrix(doc_ids, outlinks_map)
+    rank = pagerank_vector(indptr, indices, damping, max_iter, tol)
+    return dict(zip(doc_ids, rank.tolist()))
+
 
-    return pagerank
\ No newline at end of file
+def static_priors(ranks):
+    """Score prior of each PageRank in ranks: PAGERANK_WEIGHT * log(1 + N * rank), 0 for rank 0."""
+    ranks = np.asarray(ranks, dtype=np.float64)
+    return PAGERANK_WEIGHT * np.log1p(len(ranks) * ranks)
@@ -0,0 +1,682 @@
+"""
+Binary postings format and memory-mapped index reader.
+
+Each term's postings are stored as two streams. The block holds what every
+query needs:
+
+    header      n_docs (u32), doc width, count width, position width (u8 each)
+    doc ids     n_docs delta-encoded doc ids (sorted ascending)
+    counts      n_docs position counts
+    skips       for every SKIP_INTERVAL documents: the first one's doc id and
+                the index of its first position (u32 each)
+
+and the positions, delta-encoded and restarting at every document, are kept
+apart: in a sibling .pos file (final_index.pos next to final_index.bin) or,
+in SQLite, in their own column next to the block. Every array is packed with
+the narrowest fixed width (1, 2 or 4 bytes) that fits its largest value.
+
+The counts are the term frequencies, so reading a term's postings decodes
+only the doc ids and counts. LazyPostings presents them as the usual
+{doc_id: {"positions": [...]}} mapping and decodes a document's positions
+when they are looked up, so only phrase and proximity checks, which run for
+the documents holding every query term, ever touch the positions stream.
+The skip table lets PostingsBlock find a few documents of a long list, and
+decode just their positions, without decoding the rest of the block.
+Version 2 files keep the positions inside the block, between the counts and
+the skips, and version 1 files have no skip table.
+
+The file starts with a fixed header and ends with a term dictionary: a table
+of fixed-size entries (term string offset, block offset/length, df,
+positions offset/length) sorted by term, followed by the term strings.
+Lookups binary search the table directly in the mmap, so opening the index
+does not load the dictionary.
+
+An index can be split into N term shards (final_index.0-of-N.bin, ...),
+each a complete binary index file for the terms term_shard() assigns to it,
+so the postings of different query terms can be read independently.
+
+doc_features.bin holds the per-document data scoring needs for every
+candidate (PageRank, length in tokens, URL slash count) as arrays aligned
+with the sorted doc IDs, so search can map it instead of loading every URL
+at startup.
+"""
+
+import argparse
+import glob
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Mapping
+from itertools import accumulate, chain
+
+import numpy as np
+
+from constants import INDEX_DB, BINARY_INDEX_FILE, DOC_FEATURES_FILE, TERM_DICTIONARY_FILE
+from lexicon import TermDictionaryWriter
+
+MAGIC = b"CSIXPOST"
+VERSION = 3
+READABLE_VERSIONS = (1, 2, 3)
+SKIP_INTERVAL = 128  # Documents per skip entry; part of the format since version 2
+POSITIONS_EXT = ".pos"  # Positions stream of a version 3 file, e.g. final_index.pos
+
+_FILE_HEADER = struct.Struct("<8sIIQQ")   # magic, version, term count, table offset, strings offset
+_ENTRY = struct.Struct("<IHQIIQI")        # string offset, string length, block offset, block length, df,
+                                          # positions offset, positions length
+_ENTRY_V2 = struct.Struct("<IHQII")       # version 1 and 2 entries: positions are inside the block
+_BLOCK_HEADER = struct.Struct("<IBBB")    # n_docs, doc width, count width, position width
+_SKIP = struct.Struct("<II")              # first doc id, first position index
+
+FEATURES_HEADER = struct.Struct("<8sII")  # magic, version, document count
+FEATURES_MAGIC = b"CSIXDOCF"
+FEATURES_VERSION = 3  # Version 1 files have no PageRank array, version 2 files no document lengths
+
+_TYPECODES = {1: "B", 2: "H", 4: "I"}
+_DTYPES = {1: "<u1", 2: "<u2", 4: "<u4"}
+assert array("I").itemsize == 4
+
+
+def _pack_uints(values):
+    top = max(values, default=0)
+    if top < 1 << 8:
+        arr = array("B", values)
+    elif top < 1 << 16:
+        arr = array("H", values)
+    else:
+        arr = array("I", values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.itemsize, arr.tobytes()
+
+
+def _unpack_uints(buf, offset, count, width):
+    arr = array(_TYPECODES[width], buf[offset:offset + count * width])
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def _delta(values):
+    prev = 0
+    gaps = []
+    for v in values:
+        gaps.append(v - prev)
+        prev = v
+    return gaps
+
+
+def encode_postings(postings):
+    """Encode {doc_id: {"positions": [...]}} into (postings block, positions stream) bytes."""
+    doc_ids = sorted(postings, key=int)
+    counts = []
+    gaps = []
+    for doc_id in doc_ids:
+        positions = sorted(postings[doc_id]["positions"])
+        counts.append(len(positions))
+        gaps.extend(_delta(positions))
+
+    doc_w, doc_bytes = _pack_uints(_delta([int(d) for d in doc_ids]))
+    cnt_w, cnt_bytes = _pack_uints(counts)
+    pos_w, pos_bytes = _pack_uints(gaps)
+    header = _BLOCK_HEADER.pack(len(doc_ids), doc_w, cnt_w, pos_w)
+    first_positions = [0, *accumulate(counts)]
+    skips = b"".join(
+        _SKIP.pack(int(doc_ids[i]), first_positions[i]) for i in range(0, len(doc_ids), SKIP_INTERVAL)
+    )
+    return header + doc_bytes + cnt_bytes + skips, pos_bytes
+
+
+def decode_postings(buf, positions=None):
+    """Decode a postings block into the {doc_id: {"positions": [...]}} layout used by scoring.
+
+    positions is the block's positions stream; without it they are read from
+    inside the block, as version 1 and 2 files store them.
+    """
+    n_docs, doc_w, cnt_w, pos_w = _BLOCK_HEADER.unpack_from(buf, 0)
+    offset = _BLOCK_HEADER.size
+    doc_gaps = _unpack_uints(buf, offset, n_docs, doc_w)
+    offset += n_docs * doc_w
+    counts = _unpack_uints(buf, offset, n_docs, cnt_w)
+    offset += n_docs * cnt_w
+    if positions is None:
+        positions = buf[offset:]
+    pos_gaps = _unpack_uints(positions, 0, sum(counts), pos_w)
+
+    postings = {}
+    start = 0
+    for doc_id, count in zip(accumulate(doc_gaps), counts):
+        end = start + count
+        postings[str(doc_id)] = {"positions": list(accumulate(pos_gaps[start:end]))}
+        start = end
+    return postings
+
+
+class PostingsBlock:
+    """Random access into one postings block through its skip table.
+
+    positions is the block's positions stream, or None for a version 2 block
+    that holds them itself. The arrays are views of the buffers, so creating
+    one decodes nothing; find() decodes only the SKIP_INTERVAL-document runs
+    that could hold the requested doc IDs, and positions() only the
+    positions of the requested rows.
+    """
+
+    def __init__(self, buf, positions=None):
+        n_docs, doc_w, cnt_w, pos_w = _BLOCK_HEADER.unpack_from(buf, 0)
+        offset = _BLOCK_HEADER.size
+        self.df = n_docs
+        self._gaps = np.frombuffer(buf, dtype=_DTYPES[doc_w], count=n_docs, offset=offset)
+        offset += n_docs * doc_w
+        self._counts = np.frombuffer(buf, dtype=_DTYPES[cnt_w], count=n_docs, offset=offset)
+        offset += n_docs * cnt_w
+        if positions is None:
+            n_positions = int(self._counts.sum(dtype=np.int64))
+            self._pos_gaps = np.frombuffer(buf, dtype=_DTYPES[pos_w], count=n_positions, offset=offset)
+            offset += n_positions * pos_w
+        else:
+            self._pos_gaps = np.frombuffer(positions, dtype=_DTYPES[pos_w]) if len(positions) else np.zeros(0, np.uint8)
+        n_skips = -(-n_docs // SKIP_INTERVAL)
+        skips = np.frombuffer(buf, dtype="<u4", count=2 * n_skips, offset=offset).reshape(n_skips, 2)
+        self._skip_docs = skips[:, 0].astype(np.int64)
+        self._skip_positions = skips[:, 1]
+        self._starts = None
+
+    def doc_ids(self):
+        """Every doc ID of the block, sorted."""
+        return np.cumsum(self._gaps, dtype=np.int64)
+
+    def _runs(self, runs):
+        """Block rows of the given skip runs laid back to back, and where each run starts among them."""
+        starts = runs * SKIP_INTERVAL
+        lengths = np.minimum(SKIP_INTERVAL, self.df - starts)
+        run_offsets = np.cumsum(lengths) - lengths
+        block_rows = np.repeat(starts - run_offsets, lengths) + np.arange(int(lengths.sum()))
+        return block_rows, run_offsets, lengths
+
+    def find(self, doc_ids):
+        """Row of each doc ID of the sorted int array doc_ids in this block, or -1 where it is absent."""
+        rows = np.full(len(doc_ids), -1, dtype=np.int64)
+        runs = np.searchsorted(self._skip_docs, doc_ids, side="right") - 1
+        wanted = np.unique(runs[runs >= 0])
+        if not len(wanted):
+            return rows
+        # Each run's deltas restart from its skip entry's doc ID
+        block_rows, run_offsets, lengths = self._runs(wanted)
+        gaps = self._gaps[block_rows].astype(np.int64)
+        gaps[run_offsets] = self._skip_docs[wanted]
+        totals = np.cumsum(gaps)
+        ids = totals - np.repeat(totals[run_offsets] - gaps[run_offsets], lengths)
+
+        at = np.minimum(np.searchsorted(ids, doc_ids), len(ids) - 1)
+        found = ids[at] == doc_ids
+        rows[found] = block_rows[at[found]]
+        return rows
+
+    def frequencies(self, rows=None):
+        """Term frequency at each of the given rows, or at every row."""
+        counts = self._counts if rows is None else self._counts[rows]
+        return counts.astype(np.float64)
+
+    def positions(self, rows):
+        """Sorted position list of the document at each of the ascending rows."""
+        if not len(rows):
+            return []
+        wanted = np.unique(rows // SKIP_INTERVAL)
+        block_rows, run_offsets, lengths = self._runs(wanted)
+        # Index of every run row's first position: its skip entry plus the counts before it in the run
+        counts = self._counts[block_rows].astype(np.int64)
+        before = np.cumsum(counts) - counts
+        firsts = np.repeat(self._skip_positions[wanted].astype(np.int64) - before[run_offsets], lengths) + before
+        at = np.searchsorted(block_rows, rows)
+        firsts, counts = firsts[at], counts[at]
+
+        # Gather the position deltas of every document, then restart the running sum at each one
+        doc_offsets = np.cumsum(counts) - counts
+        gaps = self._pos_gaps[np.repeat(firsts - doc_offsets, counts) + np.arange(int(counts.sum()))].astype(np.int64)
+        totals = np.cumsum(gaps)
+        values = (totals - np.repeat(totals[doc_offsets] - gaps[doc_offsets], counts)).tolist()
+        return [values[start:start + count] for start, count in zip(doc_offsets.tolist(), counts.tolist())]
+
+    def positions_at(self, row):
+        """Sorted position list of the document at row, for lookups one document at a time.
+
+        The first call builds the index of every row's first position, so
+        later calls slice the positions directly instead of going through
+        the skip table.
+        """
+        if self._starts is None:
+            self._starts = np.concatenate(([0], np.cumsum(self._counts, dtype=np.int64))).tolist()
+        return list(accumulate(self._pos_gaps[self._starts[row]:self._starts[row + 1]].tolist()))
+
+    def postings(self, held_bytes=0):
+        """The whole block as LazyPostings, decoding its doc IDs and frequencies but no positions."""
+        return LazyPostings(self.doc_ids(), self.frequencies(), self.positions, held_bytes, self.positions_at)
+
+
+class LazyPostings(Mapping):
+    """One term's {doc_id: {"positions": [...]}} postings, with positions decoded only when looked up.
+
+    doc_ids (sorted int64) and tfs (float64) are plain arrays; decode maps
+    an ascending int array of rows to their position lists, and fetch, if
+    given, one row to its list. Scoring code that only needs term
+    frequencies reads tfs or frequency() and never decodes a position.
+    held_bytes is what the postings keep alive beyond the two arrays, for
+    cache accounting.
+    """
+
+    def __init__(self, doc_ids, tfs, decode, held_bytes=0, fetch=None):
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.held_bytes = held_bytes
+        self._decode = decode
+        self._fetch = fetch or (lambda row: decode(np.array([row]))[0])
+        self._row_of = None
+
+    @classmethod
+    def from_dict(cls, postings, held_bytes=0):
+        """LazyPostings over already decoded postings, such as the JSON ones of an old SQLite index."""
+        doc_ids = np.array(sorted(int(doc_id) for doc_id in postings), dtype=np.int64)
+        lists = [postings[str(doc_id)]["positions"] for doc_id in doc_ids.tolist()]
+        tfs = np.array([len(positions) for positions in lists], dtype=np.float64)
+        return cls(doc_ids, tfs, lambda rows: [lists[row] for row in rows.tolist()], held_bytes, lists.__getitem__)
+
+    @staticmethod
+    def concat(parts):
+        """The union of LazyPostings whose doc IDs do not overlap."""
+        if len(parts) == 1:
+            return parts[0]
+        owners = np.concatenate([np.full(len(part), i) for i, part in enumerate(parts)])
+        rows = np.concatenate([np.arange(len(part)) for part in parts])
+        doc_ids = np.concatenate([part.doc_ids for part in parts])
+        order = np.argsort(doc_ids, kind="stable")
+        owners, rows = owners[order], rows[order]
+
+        def decode(wanted):
+            result = [None] * len(wanted)
+            for i, part in enumerate(parts):
+                at = np.flatnonzero(owners[wanted] == i)
+                if len(at):
+                    for j, positions in zip(at.tolist(), part._decode(rows[wanted[at]])):
+                        result[j] = positions
+            return result
+
+        def fetch(row):
+            return parts[owners[row]]._fetch(rows[row])
+
+        tfs = np.concatenate([part.tfs for part in parts])[order]
+        return LazyPostings(doc_ids[order], tfs, decode, sum(part.held_bytes for part in parts), fetch)
+
+    @staticmethod
+    def union(parts):
+        """Postings of the documents in any of parts, with their frequencies summed and positions merged.
+
+        For alternatives to one query term, such as the expansions of a prefix:
+        a position holds a single term, so no position is in two parts.
+        """
+        if len(parts) == 1:
+            return parts[0]
+        doc_ids = np.unique(np.concatenate([part.doc_ids for part in parts]))
+        tfs = np.zeros(len(doc_ids))
+        part_rows = []  # Row of every document in each part, or -1 where the part lacks it
+        for part in parts:
+            at = np.searchsorted(doc_ids, part.doc_ids)
+            tfs[at] += part.tfs
+            rows = np.full(len(doc_ids), -1, dtype=np.int64)
+            rows[at] = np.arange(len(part))
+            part_rows.append(rows)
+
+        def decode(wanted):
+            lists = [[] for _ in range(len(wanted))]
+            for part, rows in zip(parts, part_rows):
+                at = np.flatnonzero(rows[wanted] >= 0)
+                if len(at):
+                    for j, positions in zip(at.tolist(), part._decode(rows[wanted[at]])):
+                        lists[j].append(positions)
+            return [found[0] if len(found) == 1 else sorted(chain.from_iterable(found)) for found in lists]
+
+        return LazyPostings(doc_ids, tfs, decode, sum(part.held_bytes for part in parts))
+
+    def _rows(self):
+        # Built on the first lookup by doc ID; queries that only read the arrays never pay for it
+        if self._row_of is None:
+            self._row_of = {str(doc_id): row for row, doc_id in enumerate(self.doc_ids.tolist())}
+        return self._row_of
+
+    def __getitem__(self, doc_id):
+        return {"positions": self._fetch(self._rows()[doc_id])}
+
+    def __contains__(self, doc_id):
+        return doc_id in self._rows()
+
+    def __iter__(self):
+        return iter(self._rows())
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def frequency(self, doc_id):
+        """Term frequency in doc_id, without decoding its positions."""
+        return int(self.tfs[self._rows()[doc_id]])
+
+    def positions(self, doc_ids):
+        """Position lists of the given int doc IDs, all of which must be in the postings."""
+        rows = np.searchsorted(self.doc_ids, doc_ids)
+        order = np.argsort(rows, kind="stable")
+        result = [None] * len(rows)
+        for i, positions in zip(order.tolist(), self._decode(rows[order])):
+            result[i] = positions
+        return result
+
+    def select(self, keep):
+        """LazyPostings of the documents where the boolean array keep is set."""
+        kept = np.flatnonzero(keep)
+        return LazyPostings(self.doc_ids[kept], self.tfs[kept], lambda rows: self._decode(kept[rows]),
+                            self.held_bytes, lambda row: self._fetch(int(kept[row])))
+
+
+def encode_field_postings(field_postings):
+    """Encode {doc_id: field mask} (title/heading/URL bits) into a binary block."""
+    doc_ids = sorted(field_postings, key=int)
+    doc_w, doc_bytes = _pack_uints(_delta([int(d) for d in doc_ids]))
+    _, mask_bytes = _pack_uints([field_postings[d] for d in doc_ids])
+    return _BLOCK_HEADER.pack(len(doc_ids), doc_w, 1, 0) + doc_bytes + mask_bytes
+
+
+def decode_field_postings(buf):
+    n_docs, doc_w, mask_w, _ = _BLOCK_HEADER.unpack_from(buf, 0)
+    offset = _BLOCK_HEADER.size
+    doc_gaps = _unpack_uints(buf, offset, n_docs, doc_w)
+    masks = _unpack_uints(buf, offset + n_docs * doc_w, n_docs, mask_w)
+    return {str(doc_id): mask for doc_id, mask in zip(accumulate(doc_gaps), masks)}
+
+
+def write_doc_features(doc_map, path=DOC_FEATURES_FILE, pagerank=None, doc_lengths=None):
+    """Write the per-document features search maps instead of loading doc_map.
+
+    Sorted doc IDs (u32), then their PageRank (f32, 0 where pagerank has no
+    entry), their lengths in tokens (u32, 0 where doc_lengths has no entry),
+    then their URL slash counts (u8).
+    """
+    pagerank = {int(doc_id): rank for doc_id, rank in (pagerank or {}).items() if rank is not None}
+    doc_lengths = {int(doc_id): length for doc_id, length in (doc_lengths or {}).items() if length is not None}
+    urls = {int(doc_id): url for doc_id, url in doc_map.items()}
+    doc_ids = array("I", sorted(urls))
+    ranks = array("f", (pagerank.get(doc_id, 0.0) for doc_id in doc_ids))
+    lengths = array("I", (doc_lengths.get(doc_id, 0) for doc_id in doc_ids))
+    slashes = array("B", (min(urls[doc_id].count("/"), 255) for doc_id in doc_ids))
+    if sys.byteorder == "big":
+        doc_ids.byteswap()
+        ranks.byteswap()
+        lengths.byteswap()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(FEATURES_HEADER.pack(FEATURES_MAGIC, FEATURES_VERSION, len(doc_ids)))
+        f.write(doc_ids.tobytes())
+        f.write(ranks.tobytes())
+        f.write(lengths.tobytes())
+        f.write(slashes.tobytes())
+    os.replace(tmp_path, path)
+
+
+class BinaryIndexWriter:
+    """Writes postings blocks followed by the sorted term dictionary, and their positions to a .pos file."""
+
+    def __init__(self, path=BINARY_INDEX_FILE):
+        self.path = path
+        self.positions_path = positions_path(path)
+        self._tmp_path = path + ".tmp"
+        self._positions_tmp_path = self.positions_path + ".tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._positions_file = open(self._positions_tmp_path, "wb")
+        self._file.write(b"\0" * _FILE_HEADER.size)
+        self._entries = []
+
+    def add(self, term, postings):
+        block, positions = encode_postings(postings)
+        offset = self._file.tell()
+        self._file.write(block)
+        positions_offset = self._positions_file.tell()
+        self._positions_file.write(positions)
+        self._entries.append(
+            (term.encode("utf-8"), offset, len(block), len(postings), positions_offset, len(positions))
+        )
+
+    def close(self):
+        self._entries.sort(key=lambda e: e[0])
+        strings_offset = self._file.tell()
+        string_offsets = []
+        for entry in self._entries:
+            string_offsets.append(self._file.tell() - strings_offset)
+            self._file.write(entry[0])
+
+        table_offset = self._file.tell()
+        for (term_bytes, offset, length, df, positions_offset, positions_length), str_off in zip(
+            self._entries, string_offsets
+        ):
+            self._file.write(_ENTRY.pack(str_off, len(term_bytes), offset, length, df, positions_offset, positions_length))
+
+        self._file.seek(0)
+        self._file.write(_FILE_HEADER.pack(MAGIC, VERSION, len(self._entries), table_offset, strings_offset))
+        self._file.close()
+        self._positions_file.close()
+        # The positions go first: a reader opening the new index file then finds its positions
+        os.replace(self._positions_tmp_path, self.positions_path)
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self._positions_file.close()
+            os.remove(self._tmp_path)
+            os.remove(self._positions_tmp_path)
+
+
+def term_shard(term, shards):
+    """Shard holding term: a hash that, unlike hash(), is the same in every process, modulo shards."""
+    if shards <= 1:
+        return 0
+    return zlib.crc32(term.encode("utf-8")) % shards
+
+
+def shard_path(path, shard, shards):
+    """path itself for an unsharded index, else e.g. final_index.2-of-4.bin for shard 2 of 4."""
+    if shards <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{shard}-of-{shards}{ext}"
+
+
+def positions_path(path):
+    """The positions file of the binary index file path, e.g. final_index.2-of-4.pos."""
+    return os.path.splitext(path)[0] + POSITIONS_EXT
+
+
+def index_files(path=BINARY_INDEX_FILE, positions=False):
+    """Every existing binary index file for path: the unsharded file and any shard files (plus their .pos files)."""
+    root, ext = os.path.splitext(path)
+    files = [p for p in [path] + glob.glob(f"{root}.*-of-*{ext}") if os.path.exists(p)]
+    if positions:
+        files += [positions_path(p) for p in files if os.path.exists(positions_path(p))]
+    return sorted(files)
+
+
+class ShardedIndexWriter:
+    """One BinaryIndexWriter per shard, each receiving the terms term_shard() assigns to it."""
+
+    def __init__(self, path=BINARY_INDEX_FILE, shards=1):
+        self.path = path
+        self.writers = [BinaryIndexWriter(shard_path(path, i, shards)) for i in range(shards)]
+
+    def add(self, term, postings):
+        self.writers[term_shard(term, len(self.writers))].add(term, postings)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        # Files of an earlier build with a different shard count would only waste disk space
+        current = {writer.path for writer in self.writers}
+        for stale in index_files(self.path):
+            if stale not in current:
+                os.remove(stale)
+                if os.path.exists(positions_path(stale)):
+                    os.remove(positions_path(stale))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for writer in self.writers:
+                writer.__exit__(exc_type, exc, tb)
+
+
+def _map(path):
+    """Read-only mmap of path, or empty bytes for an empty file, which cannot be mapped."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class BinaryIndexReader:
+    """Read-only, memory-mapped view of a binary index file and its positions file."""
+
+    def __init__(self, path=BINARY_INDEX_FILE):
+        self.path = path
+        self._mm = _map(path)
+        magic, version, self.term_count, self._table_offset, self._strings_offset = \
+            _FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version not in READABLE_VERSIONS:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} binary index")
+        self.version = version
+        self._entry_struct = _ENTRY if version >= 3 else _ENTRY_V2
+        self._positions = _map(positions_path(path)) if version >= 3 else None
+
+    def _entry(self, i):
+        return self._entry_struct.unpack_from(self._mm, self._table_offset + i * self._entry_struct.size)
+
+    def _term_bytes(self, entry):
+        start = self._strings_offset + entry[0]
+        return self._mm[start:start + entry[1]]
+
+    def _find(self, term):
+        key = term.encode("utf-8")
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            current = self._term_bytes(entry)
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def _buffers(self, entry):
+        """(block, positions stream or None if the block holds them) of a dictionary entry, as mmap views."""
+        offset, length = entry[2], entry[3]
+        block = memoryview(self._mm)[offset:offset + length]
+        if self.version < 3:
+            return block, None
+        positions_offset, positions_length = entry[5], entry[6]
+        return block, memoryview(self._positions)[positions_offset:positions_offset + positions_length]
+
+    def __contains__(self, term):
+        return self._find(term) is not None
+
+    def df(self, term):
+        entry = self._find(term)
+        return entry[4] if entry else 0
+
+    def load_postings(self, term):
+        """(LazyPostings, df) for term: its doc IDs and frequencies, with positions left in the mmap."""
+        entry = self._find(term)
+        if entry is None:
+            return {}, 0
+        if self.version < 2:
+            offset, length = entry[2], entry[3]
+            return LazyPostings.from_dict(decode_postings(self._mm[offset:offset + length])), entry[4]
+        return PostingsBlock(*self._buffers(entry)).postings(), entry[4]
+
+    def postings_block(self, term):
+        """PostingsBlock over term's postings in the mmap, or None if the term is absent or the file has no skips."""
+        entry = self._find(term)
+        if entry is None or self.version < 2:
+            return None
+        return PostingsBlock(*self._buffers(entry))
+
+    def terms(self):
+        for i in range(self.term_count):
+            yield self._term_bytes(self._entry(i)).decode("utf-8")
+
+    def close(self):
+        # Views handed out by load_postings keep a map open until they are released
+        for mm in (self._mm, self._positions):
+            if isinstance(mm, mmap.mmap):
+                try:
+                    mm.close()
+                except BufferError:
+                    pass
+
+
+def read_sqlite_postings(conn):
+    """Term-sorted (term, {doc_id: {"positions": [...]}}) of the inverted_index table of conn.
+
+    Also reads indexes built before the positions got their own column, which
+    stored the postings as JSON.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(inverted_index)")}
+    if "positions" in columns:
+        rows = conn.execute("SELECT term, postings, positions FROM inverted_index ORDER BY term")
+        for term, block, positions in rows:
+            yield term, decode_postings(block, positions)
+    else:
+        for term, postings in conn.execute("SELECT term, postings FROM inverted_index ORDER BY term"):
+            yield term, json.loads(postings)
+
+
+def convert_sqlite_index(db_path=INDEX_DB):
+    """Convert the postings in an existing final_index.db into the binary index, term dictionary and doc features.
+
+    They are written to the default paths, which are the ones search reads.
+    """
+    conn = sqlite3.connect(db_path)
+    count = 0
+    with BinaryIndexWriter(BINARY_INDEX_FILE) as writer, TermDictionaryWriter(TERM_DICTIONARY_FILE) as terms:
+        for term, postings in read_sqlite_postings(conn):
+            writer.add(term, postings)
+            terms.add(term, len(postings))
+            count += 1
+    cursor = conn.cursor()
+    rows = cursor.execute("SELECT * FROM doc_metadata").fetchall()
+    columns = [c[0] for c in cursor.description]
+    doc_map = {row[0]: row[columns.index("url")] for row in rows}
+    # Indexes built before PageRank or document lengths were stored have no such columns
+    pagerank = {row[0]: row[columns.index("pagerank")] for row in rows} if "pagerank" in columns else None
+    doc_lengths = {row[0]: row[columns.index("length")] for row in rows} if "length" in columns else None
+    write_doc_features(doc_map, pagerank=pagerank, doc_lengths=doc_lengths)
+    conn.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a SQLite index into the binary postings format.")
+    parser.add_argument("db_path", nargs="?", default=INDEX_DB)
+    args = parser.parse_args()
+    converted = convert_sqlite_index(args.db_path)
+    print(f"Converted {converted} terms from {args.db_path} into {BINARY_INDEX_FILE}")
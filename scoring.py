@@ -1,84 +1,201 @@
 from math import log
-from collections import defaultdict
+from bisect import bisect_left
+from collections import defaultdict, deque
+import heapq
+from itertools import repeat
 
-idf_cache = {}
+from constants import FIELD_WEIGHTS
+from postings import LazyPostings
 
-def get_idf(term, total_docs, index):
-    if term in idf_cache:
-        return idf_cache[term]
-    df = len(index.get(term, {}))
-    idf = log((total_docs + 1) / (df + 1))
-    idf_cache[term] = idf
-    return idf
+PHRASE_BOOST = 50
+PROXIMITY_BOOST = 25
+PROXIMITY_WINDOW = 8
 
+# Boost earned by one query term for every combination of field bits (title, h1-h3, URL)
+MASK_BOOSTS = [
+    sum(weight for bit, weight in FIELD_WEIGHTS.items() if mask & bit)
+    for mask in range(2 * max(FIELD_WEIGHTS))
+]
 
-def score_document(doc_id, terms, postings_dict, idf_values, title_map=None, doc_map=None, heading_map=None, phrase_boost=1000, require_all_terms=True):
+def idf(doc_count, df):
+    """tf-idf weight of a term in df of doc_count documents, as stored by build_index and used by search."""
+    return log(doc_count / df)
+
+
+def bm25_idf(doc_count, df):
+    """BM25 (Robertson-Sparck Jones) weight of a term in df of doc_count documents, never negative."""
+    return log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+
+def term_frequency(postings, doc_id):
+    """Occurrences of a term in doc_id, read from LazyPostings without decoding any positions."""
+    if isinstance(postings, LazyPostings):
+        return postings.frequency(doc_id)
+    return len(postings[doc_id]["positions"])
+
+
+def score_document(doc_id, terms, postings_dict, idf_values, field_postings=None, doc_map=None, phrase_boost=1000, require_all_terms=True, proximity_boost=0):
     # Ensure the document contains all query terms in the body
     if require_all_terms and any(doc_id not in postings_dict.get(term, {}) for term in terms):
         return 0.0
 
     score = 0.0
     doc_len = sum(
-        len(postings_dict[t][doc_id]["positions"])
-        for t in terms if doc_id in postings_dict[t]
+        term_frequency(postings_dict[t], doc_id)
+        for t in terms if doc_id in postings_dict.get(t, {})
     )
 
     for term in terms:
-        if doc_id in postings_dict[term]:
-            freq = len(postings_dict[term][doc_id]["positions"])
+        if doc_id in postings_dict.get(term, {}):
+            freq = term_frequency(postings_dict[term], doc_id)
             tfidf = (freq / doc_len) * idf_values.get(term, 0) if doc_len > 0 else 0
             score += tfidf
 
-    # Only apply URL and title boosts *after* ensuring main content has all terms
+    # Only apply URL and field boosts *after* scoring the main content
     if doc_map:
-        url = doc_map.get(str(doc_id), "")
-        url_lower = url.lower()
-        for term in terms:
-            if term in url_lower:
-                score += 2
-            if term in url:
-                score += 1
-        score -= url.count('/')
-
-    if title_map:
-        title = title_map.get(str(doc_id), "").lower()
-        for term in terms:
-            if term in title:
-                score += 100  # increased boost for title
-
-    if heading_map:
-        headings = heading_map.get(str(doc_id), "")
-        headings = headings.split("\n") if isinstance(headings, str) else []
-        for term in terms:
-            for heading in headings:
-                heading_lower = heading.lower()
-                if heading_lower.startswith("h1:") and term in heading_lower:
-                    score += 50
-                elif heading_lower.startswith("h2:") and term in heading_lower:
-                    score += 35
-                elif heading_lower.startswith("h3:") and term in heading_lower:
-                    score += 20
+        score -= url_slashes(doc_map, doc_id)
+        score += static_prior(doc_map, doc_id)
+
+    if field_postings:
+        score += field_boost(doc_id, terms, field_postings)
 
     # Phrase boost is only applied if explicitly passed in (e.g., 1000 for phrase matches, 0 otherwise)
     score += phrase_boost
+    score += proximity_boost
 
     return score
 
 
+def url_slashes(doc_map, doc_id):
+    """Slash count of doc_id's URL; doc_map is a {doc_id: url} dict or an index_store.DocStore."""
+    if isinstance(doc_map, dict):
+        return doc_map.get(str(doc_id), "").count('/')
+    return doc_map.slash_count(doc_id)
+
+
+def static_prior(doc_map, doc_id):
+    """PageRank prior of doc_id from a DocStore; a plain {doc_id: url} dict carries no ranks."""
+    if isinstance(doc_map, dict):
+        return 0.0
+    return doc_map.static_prior(doc_id)
+
+
+def max_static_prior(doc_map):
+    """Largest static_prior of any document, for score upper bounds."""
+    return 0.0 if isinstance(doc_map, dict) else doc_map.max_prior
+
+
+def field_boost(doc_id, terms, field_postings):
+    """Title, heading and URL boosts for doc_id: one lookup of the stored field mask per query term."""
+    doc_id = str(doc_id)
+    return sum(MASK_BOOSTS[field_postings.get(term, {}).get(doc_id, 0)] for term in terms)
+
+
+def score_candidate(doc_id, terms, postings_dict, idf_values, field_postings, doc_map,
+                    proximity_weight=PROXIMITY_BOOST):
+    """Score one candidate the way run_query ranks it; returns (score, is_phrase_match)."""
+    matched_terms = [term for term in terms if doc_id in postings_dict.get(term, {})]
+    coverage = len(matched_terms) / len(terms)
+
+    is_phrase_match = full_phrase_in_doc(terms, doc_id, postings_dict) if coverage == 1.0 else False
+    proximity = proximity_score(terms, doc_id, postings_dict, proximity_weight) if coverage == 1.0 else 0
+
+    base_score = score_document(
+        doc_id, terms, postings_dict, idf_values, field_postings, doc_map,
+        phrase_boost=(PHRASE_BOOST if is_phrase_match else 0), require_all_terms=False,
+        proximity_boost=proximity
+    )
+    return base_score * coverage, is_phrase_match
+
+
+def _gallop(values, target, lo=0):
+    """Smallest index >= lo with values[index] >= target, via exponential then binary search."""
+    n = len(values)
+    if lo >= n or values[lo] >= target:
+        return lo
+    prev, step = lo, 1
+    hi = lo + 1
+    while hi < n and values[hi] < target:
+        prev = hi
+        step *= 2
+        hi = prev + step
+    return bisect_left(values, target, prev + 1, min(hi, n))
+
+
+def phrase_starts(positions_lists):
+    """Positions p of the first list such that every later list i has a position within 1 of p + i.
+
+    Intersects the sorted lists shortest-first, galloping through each one, so
+    the cost is close to linear in the shorter lists rather than O(n*m).
+    """
+    starts = positions_lists[0]
+    for i in sorted(range(1, len(positions_lists)), key=lambda i: len(positions_lists[i])):
+        plist = positions_lists[i]
+        kept = []
+        j = 0
+        for pos in starts:
+            j = _gallop(plist, pos + i - 1, j)
+            if j == len(plist):
+                break
+            if plist[j] <= pos + i + 1:
+                kept.append(pos)
+        starts = kept
+        if not starts:
+            break
+    return starts
+
+
+def min_span(positions_lists):
+    """Smallest last - first over windows holding a position from every list, or None if one is empty.
+
+    One sliding-window pass over the merged sorted lists.
+    """
+    k = len(positions_lists)
+    if k == 0 or not all(positions_lists):
+        return None
+    merged = heapq.merge(*(zip(plist, repeat(i)) for i, plist in enumerate(positions_lists)))
+    counts = [0] * k
+    covered = 0
+    window = deque()
+    best = None
+    for pos, i in merged:
+        window.append((pos, i))
+        if counts[i] == 0:
+            covered += 1
+        counts[i] += 1
+        while counts[window[0][1]] > 1:
+            counts[window[0][1]] -= 1
+            window.popleft()
+        if covered == k:
+            span = pos - window[0][0]
+            if best is None or span < best:
+                best = span
+    return best
+
+
 def proximity_match_in_doc(terms, doc_id, index, window_size=4):
     try:
-        positions_lists = [index[term][str(doc_id)]["positions"] for term in terms]
+        positions_lists = [index[term][str(doc_id)]["positions"] for term in dict.fromkeys(terms)]
     except KeyError:
         return False
-    if any(len(plist) > 2000 for plist in positions_lists):
-        return False
+    span = min_span(positions_lists)
+    return span is not None and span <= window_size
 
-    all_positions = sorted(pos for plist in positions_lists for pos in plist)
-    for i in range(len(all_positions) - len(terms) + 1):
-        window = all_positions[i + len(terms) - 1] - all_positions[i]
-        if window <= window_size:
-            return True
-    return False
+
+def proximity_score(terms, doc_id, postings_dict, weight=PROXIMITY_BOOST, window_size=PROXIMITY_WINDOW):
+    """Up to weight for documents whose distinct query terms all fall within window_size positions."""
+    distinct = list(dict.fromkeys(terms))
+    if weight == 0 or len(distinct) < 2:
+        return 0
+    try:
+        positions_lists = [postings_dict[term][str(doc_id)]["positions"] for term in distinct]
+    except KeyError:
+        return 0
+    span = min_span(positions_lists)
+    if span is None or span > window_size:
+        return 0
+    # A span of len(distinct) - 1 means the terms are adjacent, which earns the full weight
+    return weight * (len(distinct) - 1) / max(span, len(distinct) - 1)
 
 
 def full_phrase_in_doc(terms, doc_id, postings_dict):
@@ -88,8 +205,4 @@ def full_phrase_in_doc(terms, doc_id, postings_dict):
     except KeyError:
         return False
 
-    first_positions = positions_lists[0]
-    for pos in first_positions:
-        if all(any(abs(pos + i - p2) <= 1 for p2 in positions_lists[i]) for i in range(1, len(terms))):
-            return True
-    return False
+    return bool(phrase_starts(positions_lists))
@@ -1,129 +1,242 @@
-import json
 import time
 from collections import defaultdict
-from scoring import full_phrase_in_doc, score_document
-from utils import process_query_terms, is_live_url
-from constants import DOC_COUNT
-from index_builder import load_postings_for_term
+from scoring import score_candidate, PROXIMITY_BOOST
+from topk import top_k_documents
+from batch_scoring import score_documents_batch, top_k_scores
+from bm25 import score_documents_bm25
+from conjunctive import top_k_conjunctive
+from utils import process_query_terms, is_prefix_term, stem, is_live_url
+from constants import (
+    DOC_COUNT, TOP_K, QUERY_MODE, BM25_K1, BM25_B, PREFIX_EXPANSIONS, SUGGESTION_COUNT
+)
+from index_store import current_index, postings_cache, result_cache, DocStore, ExpandedIndex
+from metrics import metrics
 from requests import head
-import sqlite3
-
-def get_db_connection():
-    return sqlite3.connect("final_index.db")
-
-def get_doc_map():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT doc_id, url FROM doc_metadata")
-    doc_map = {str(doc_id): url for doc_id, url in cur.fetchall()}
-    conn.close()
-    return doc_map
-
-def get_title_map():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT doc_id, title FROM doc_metadata")
-    title_map = {str(doc_id): title for doc_id, title in cur.fetchall()}
-    conn.close()
-    return title_map
-
-def get_heading_map():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT doc_id, headings FROM doc_metadata")
-    heading_map = {str(doc_id): headings for doc_id, headings in cur.fetchall()}
-    conn.close()
-    return heading_map
-
-def get_idf_values():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT term, idf FROM idf")
-    idf_values = {term: float(idf) for term, idf in cur.fetchall()}
-    conn.close()
-    return idf_values
-
-def run_query(query, doc_map, idf_values, title_map, heading_map, test_mode=False):
-    terms = process_query_terms(query)
-    candidate_docs = []
+
+def execute_query(query, doc_map, idf_values=None, mode=QUERY_MODE, proximity_weight=PROXIMITY_BOOST,
+                  k=TOP_K, skip_missing=False, use_cache=True, k1=BM25_K1, b=BM25_B):
+    """Rank documents for query and return the outcome instead of printing it.
+
+    A "prefix*" term stands for the PREFIX_EXPANSIONS most frequent indexed
+    terms starting with prefix, as alternatives: it is ranked as one term
+    matched by any of them (see index_store.ExpandedIndex). The conjunctive
+    mode ranks the union for such queries.
+
+    Returns a dict with the stemmed "terms", the "missing" terms that are not
+    in the index, the "results" as [(doc_id, score), ...] best first, the
+    number of documents "scored", the ranking time in "elapsed_ms" and whether
+    the result came from the result cache ("cached"). A missing term means
+    nothing is ranked unless skip_missing is set. k1 and b only apply to the
+    "bm25" mode. Only read-only shared state is touched, so queries can run
+    concurrently. Results ranked with a caller's own idf_values are not cached.
+    """
+    start_time = time.time()
+    use_cache = use_cache and idf_values is None
+    with metrics.span("query.total"):
+        terms = process_query_terms(query)
+        index = current_index()
+        if any(is_prefix_term(term) for term in terms):
+            with metrics.span("query.expand"):
+                index = ExpandedIndex(index, prefix_expansions(terms, index))
+            if mode == "conjunctive":
+                mode = "vectorized"
+        # Queries that normalize to the same terms share one entry; a plain dict doc_map ranks without PageRank
+        key = (tuple(terms), mode, k, skip_missing, proximity_weight, isinstance(doc_map, dict), k1, b)
+        cached = result_cache.get(index.version, key) if use_cache else None
+        if cached is not None:
+            result = _copy_result(cached, query=query, cached=True, elapsed_ms=(time.time() - start_time) * 1000)
+        else:
+            result = _execute_query(
+                query, terms, index, doc_map, idf_values, mode, proximity_weight, k, skip_missing, k1, b
+            )
+            if use_cache:
+                result_cache.put(index.version, key, _copy_result(result))
+            result = dict(result, cached=False)
+    metrics.count("query.count")
+    if result["cached"]:
+        metrics.count("query.cache_hits")
+    else:
+        metrics.count("query.scored", result["scored"])
+    return result
+
+def _copy_result(result, **changes):
+    """result with its own lists, so a caller changing them cannot change the cached entry."""
+    return dict(
+        result, terms=list(result["terms"]), missing=list(result["missing"]), results=list(result["results"]), **changes
+    )
+
+def complete_prefix(prefix, index, limit):
+    """Up to limit (term, df) of the indexed terms starting with prefix as typed or as stemmed, most frequent first.
+
+    The index holds stems, so "learning" is also completed as "learn".
+    """
+    completions = {}
+    for candidate in dict.fromkeys([prefix, stem(prefix)]):
+        completions.update(index.complete(candidate, limit))
+    return sorted(completions.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
+
+def prefix_expansions(terms, index, limit=PREFIX_EXPANSIONS):
+    """{"prefix*": [completions]} for the prefix terms of a query; one without any is left out, so it is reported missing."""
+    expansions = {}
+    for term in dict.fromkeys(terms):
+        completions = complete_prefix(term[:-1], index, limit) if is_prefix_term(term) else []
+        if completions:
+            expansions[term] = [completion for completion, _ in completions]
+    return expansions
+
+def suggest(text, limit=SUGGESTION_COUNT):
+    """Type-ahead suggestions for the last word of text: [(indexed term, df)], most frequent first."""
+    words = text.lower().split()
+    prefix = words[-1].rstrip("*") if words else ""
+    if not prefix:
+        return []
+    with metrics.span("query.suggest"):
+        return complete_prefix(prefix, current_index(), limit)
+
+def warm_result_cache(doc_map, queries, mode=QUERY_MODE, k=TOP_K):
+    """Run queries (e.g. the most frequent ones from a query log) so their results are cached up front."""
+    for query in queries:
+        execute_query(query, doc_map, mode=mode, k=k, skip_missing=True)
+    return result_cache.stats()
+
+def _execute_query(query, terms, index, doc_map, idf_values, mode, proximity_weight, k, skip_missing, k1, b):
+    if mode == "conjunctive":
+        result = _rank_conjunctive(query, terms, index, doc_map, idf_values, proximity_weight, k, skip_missing)
+        if result is not None:
+            return result
+        # Fewer than k documents hold every term, so the union is ranked as usual
+        mode = "vectorized"
+
+    result = {"query": query, "terms": terms, "missing": [], "results": [], "scored": 0, "elapsed_ms": 0.0}
     postings_dict = {}
+    dfs = {}
+    field_postings = {}
+    term_bounds = {}
 
-    for term in terms:
-        postings, df = load_postings_for_term(term)
-        if df == 0:
-            if test_mode:
+    with metrics.span("query.load_postings"):
+        # BM25 reads only the doc ID and frequency arrays of the postings
+        loaded = index.load_frequencies_many(terms) if mode == "bm25" else index.load_postings_many(terms)
+        for term in terms:
+            postings, df = loaded[term]
+            if df == 0:
+                result["missing"].append(term)
+                if not skip_missing:
+                    return result
                 continue
-            else:
-                print(f"Missing term: {term} in index --- abort")
-                return
-        postings_dict[term] = postings
-        candidate_docs.append(set(postings.keys()))
+            postings_dict[term] = postings
+            dfs[term] = df
 
-    if not candidate_docs:
-        if test_mode:
-            print("No documents matched this query.")
-        else:
-            print("No documents matched.")
-        return
+    if not postings_dict:
+        return result
 
-    common_docs = set.union(*candidate_docs)
-    if not common_docs:
-        if test_mode:
-            print("No common documents with any query terms.")
+    with metrics.span("query.load_fields"):
+        for term in set(terms):
+            field_postings[term], term_bounds[term] = index.load_field_postings(term)
+    with metrics.span("query.idf"):
+        if mode == "bm25":
+            idf_values = index.query_bm25_idf(dfs)
         else:
-            print("No common documents with all query terms.")
-        return
-
-    docs_to_score = list(common_docs)
+            idf_values = index.query_idf(idf_values, dfs)
 
     scores = defaultdict(float)
     start_time = time.time()
-    phrase_match_count = 0
+    with metrics.span(f"query.rank.{mode}"):
+        if mode == "topk":
+            top_docs, scored = top_k_documents(
+                terms, postings_dict, idf_values, field_postings, term_bounds, doc_map, k=k,
+                proximity_weight=proximity_weight
+            )
+            scores.update(top_docs)
+        elif mode == "vectorized":
+            doc_ids, batch_scores, phrase_match_count = score_documents_batch(
+                terms, postings_dict, idf_values, field_postings, doc_map, proximity_weight
+            )
+            scored = len(doc_ids)
+            phrase_ratio = phrase_match_count / len(doc_ids) if len(doc_ids) else 0
+            if 0.1 < phrase_ratio < 0.9:
+                batch_scores *= 0.85
+            scores.update(top_k_scores(doc_ids, batch_scores, k))
+        elif mode == "bm25":
+            doc_ids, bm25_scores = score_documents_bm25(
+                terms, postings_dict, idf_values, field_postings, doc_map, index.avg_doc_length, k1, b
+            )
+            scored = len(doc_ids)
+            scores.update(top_k_scores(doc_ids, bm25_scores, k))
+        else:
+            docs_to_score = list(set.union(*(set(postings) for postings in postings_dict.values())))
+            scored = len(docs_to_score)
+            phrase_match_count = 0
 
-    for doc_id in docs_to_score:
-        url = doc_map.get(str(doc_id), "")
+            for doc_id in docs_to_score:
+                scores[doc_id], is_phrase_match = score_candidate(
+                    doc_id, terms, postings_dict, idf_values, field_postings, doc_map, proximity_weight
+                )
+                if is_phrase_match:
+                    phrase_match_count += 1
 
-        matched_terms = [term for term in terms if doc_id in postings_dict.get(term, {})]
-        if not matched_terms:
-            matched_terms = []
+            phrase_ratio = phrase_match_count / len(docs_to_score) if docs_to_score else 0
 
-        coverage = len(matched_terms) / len(terms)
+            if 0.1 < phrase_ratio < 0.9:
+                for doc_id in scores:
+                    scores[doc_id] *= 0.85
 
-        is_phrase_match = full_phrase_in_doc(terms, doc_id, postings_dict) if coverage == 1.0 else False
+    with metrics.span("query.sort"):
+        result["results"] = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+    result["scored"] = scored
+    result["elapsed_ms"] = (time.time() - start_time) * 1000
+    return result
 
-        if is_phrase_match:
-            phrase_match_count += 1
+def _rank_conjunctive(query, terms, index, doc_map, idf_values, proximity_weight, k, skip_missing):
+    """Rank only the documents that hold every query term, or return None when fewer than k do."""
+    result = {"query": query, "terms": terms, "missing": [], "results": [], "scored": 0, "elapsed_ms": 0.0}
+    with metrics.span("query.intersect"):
+        intersection = index.load_intersection(terms)
+    result["missing"] = [term for term in terms if not intersection.dfs.get(term)]
+    if result["missing"] and not skip_missing:
+        result["missing"] = result["missing"][:1]
+        return result
+    if len(intersection) < k:
+        return None
 
-        base_score = score_document(
-            doc_id, terms, postings_dict, idf_values, title_map, doc_map, heading_map,
-            phrase_boost=(50 if is_phrase_match else 0), require_all_terms=False
-        )
+    field_postings = {}
+    with metrics.span("query.load_fields"):
+        for term in set(terms):
+            field_postings[term] = index.load_field_postings(term)[0]
+    with metrics.span("query.idf"):
+        idf_values = index.query_idf(idf_values, {term: df for term, df in intersection.dfs.items() if df})
 
-        scores[doc_id] = base_score * coverage
+    start_time = time.time()
+    with metrics.span("query.rank.conjunctive"):
+        result["results"], result["scored"] = top_k_conjunctive(
+            terms, intersection, idf_values, field_postings, doc_map, k, proximity_weight
+        )
+    result["elapsed_ms"] = (time.time() - start_time) * 1000
+    return result
 
-    elapsed = time.time() - start_time
-    phrase_ratio = phrase_match_count / len(docs_to_score) if docs_to_score else 0
+def run_query(query, doc_map, idf_values=None, test_mode=False, mode=QUERY_MODE, proximity_weight=PROXIMITY_BOOST):
+    result = execute_query(query, doc_map, idf_values, mode, proximity_weight, skip_missing=test_mode)
 
-    if 0.1 < phrase_ratio < 0.9:
-        for doc_id in scores:
-            scores[doc_id] *= 0.85
+    if result["missing"] and not test_mode:
+        print(f"Missing term: {result['missing'][0]} in index --- abort")
+        return
+    if len(result["missing"]) == len(result["terms"]):
+        if test_mode:
+            print("No documents matched this query.")
+        else:
+            print("No documents matched.")
+        return
 
     if test_mode:
+        if mode == "topk":
+            print(f"Scored {result['scored']} candidate documents")
         print(f"Query: {query}")
-        print(f"Query processed in {elapsed * 1000:.2f} ms")
-    else:
-        print(f"Query processed in {elapsed * 1000:.2f} ms")
+    print(f"Query processed in {result['elapsed_ms']:.2f} ms")
 
-    if scores:
-        top_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:5]
-        shown = 0
-        for doc_id, score in top_docs:
+    if result["results"]:
+        for rank, (doc_id, score) in enumerate(result["results"], 1):
             url = doc_map.get(str(doc_id), "")
             print(f"[DEBUG] Doc {doc_id} score: {score:.2f}")
-            print(f"{shown + 1}. {url}")
-            shown += 1
-            if shown == 5:
-                break
+            print(f"{rank}. {url}")
     else:
         if test_mode:
             print("No documents matched after scoring.")
@@ -132,59 +245,58 @@ def run_query(query, doc_map, idf_values, title_map, heading_map, test_mode=Fals
 
     print("-" * 50)
 
+M2_QUERIES = [
+    "cristina lopes",
+    "machine learning",
+    "ACM",
+    "master of software engineering"
+]
+
+M3_QUERIES = [
+    "cristina lopes",
+    "master of software engineering",
+    "machine learning",
+    "computer science degree",
+    "informatics uc irvine",
+    "software engineering curriculum",
+    "how to apply for mswe",
+    "school of information and computer sciences",
+    "ics faculty list",
+    "acm icpc competition",
+    "data science tracks",
+    "academic integrity policy",
+    "website accessibility standards",
+    "cs course prerequisites",
+    "uci parking pass",
+    "cafeteria menu",
+    "uc irvine housing info",
+    "undergraduate vs graduate",
+    "student research paper format",
+    "staff office hours",
+]
+
 def run_predefined_queries(doc_map, total_docs, test):
     test_queries = []
     if test == 0:
-        test_queries = [
-            "cristina lopes",
-            "machine learning",
-            "ACM",
-            "master of software engineering"
-        ]
+        test_queries = M2_QUERIES
     elif test == 1:
-        test_queries = [
-            "cristina lopes",
-            "master of software engineering",
-            "machine learning",
-            "computer science degree",
-            "informatics uc irvine",
-            "software engineering curriculum",
-            "how to apply for mswe",
-            "school of information and computer sciences",
-            "ics faculty list",
-            "acm icpc competition",
-            "data science tracks",
-            "academic integrity policy",
-            "website accessibility standards",
-            "cs course prerequisites",
-            "uci parking pass",
-            "cafeteria menu",
-            "uc irvine housing info",
-            "undergraduate vs graduate",
-            "student research paper format",
-            "staff office hours",
-        ]
-
-    doc_map = get_doc_map()
-    title_map = get_title_map()
-    heading_map = get_heading_map()
-    idf_values = get_idf_values()
+        test_queries = M3_QUERIES
 
     for idx, q in enumerate(test_queries, 1):
         print(f"\n{idx}. Query: {q} ")
-        run_query(q, doc_map, idf_values, title_map, heading_map, test_mode=True)
+        run_query(q, doc_map, test_mode=True)
 
 def search_interface():
-    doc_map = get_doc_map()
-    title_map = get_title_map()
-    idf_values = get_idf_values()
-    heading_map = get_heading_map()
+    # URLs and IDF values are looked up per query instead of loading whole tables up front
+    doc_map = DocStore()
 
     print("\nSearch Engine Project")      
     print("What do you want to look for today?\n")
 
     print("Type 'm2' to run A3:M2 predefined queries.")
     print("Type 'm3' to run A3:M3 predefined queries.\n")
+    print("Type 'stats' to show postings and result cache statistics.")
+    print("Type 'metrics' to show per-stage query timings (run with --metrics).")
     print("Type 'exit' or 'q' to quit.")
 
     while True:
@@ -197,5 +309,11 @@ def search_interface():
         if query.lower() == "m3":
             run_predefined_queries(doc_map, DOC_COUNT, 1)
             continue
+        if query.lower() == "stats":
+            print({"postings_cache": postings_cache.stats(), "result_cache": result_cache.stats()})
+            continue
+        if query.lower() == "metrics":
+            print(metrics.to_json())
+            continue
 
-        run_query(query, doc_map, idf_values, title_map, heading_map)
+        run_query(query, doc_map)
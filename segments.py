@@ -0,0 +1,367 @@
+"""
+Incremental indexing with small immutable segments.
+
+    python segments.py add data/www_ics_uci_edu/ data/changed_page.json
+    python segments.py delete https://www.ics.uci.edu/old-page
+    python segments.py merge
+
+build_index writes the base index from every page. After that, new or
+changed pages are parsed into a new segment instead of rebuilding. A segment
+is a SQLite file with the same tables as final_index.db. Removing or
+replacing a page records a tombstone for its doc ID in whichever source
+held the live copy.
+
+The manifest lists the segments, the tombstones and the live document
+count. Search reads it through index_store.current_index() and computes
+IDF from live document frequencies, so an update never rewrites
+corpus-wide statistics.
+
+Segments are merged with a tiered policy. Once SEGMENT_MERGE_FACTOR
+segments of similar live size accumulate, they are compacted into one
+segment and their tombstoned documents are dropped. A full build_index()
+clears every segment.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+
+from constants import INDEX_DB, SEGMENT_DIR, SEGMENT_MERGE_FACTOR, SQLITE_MAX_PARAMS
+from index_builder import parse_pages, iter_data_files, merge_term_streams, write_index_to_sqlite
+from accumulator import PostingsAccumulator
+from dedup import DuplicateIndex
+from index_store import BASE_SEGMENT, segment_path, manifest_path, load_manifest
+from postings import decode_field_postings, read_sqlite_postings
+from utils import stable_hash_url
+
+_manifest_lock = threading.Lock()
+_merging = set()  # Segments claimed by a merge that is still running
+_dedup_lock = threading.Lock()  # Serializes updates of the saved duplicate-detection state
+
+
+def save_manifest(manifest):
+    os.makedirs(SEGMENT_DIR, exist_ok=True)
+    manifest["generation"] += 1
+    tmp_path = manifest_path() + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path())
+
+
+def _count_docs(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM doc_metadata").fetchone()[0]
+    conn.close()
+    return count
+
+
+def open_manifest():
+    """The current manifest, with the live document count seeded from the base index on first use."""
+    manifest = load_manifest()
+    if manifest["doc_count"] is None:
+        manifest["doc_count"] = _count_docs(INDEX_DB) if os.path.exists(INDEX_DB) else 0
+    return manifest
+
+
+def _sources(manifest):
+    sources = [(BASE_SEGMENT, INDEX_DB)] if os.path.exists(INDEX_DB) else []
+    return sources + [(segment["name"], segment_path(segment["name"])) for segment in manifest["segments"]]
+
+
+def _docs_in(db_path, doc_ids):
+    """The subset of doc_ids stored in db_path."""
+    doc_ids = list(doc_ids)
+    found = set()
+    conn = sqlite3.connect(db_path)
+    for i in range(0, len(doc_ids), SQLITE_MAX_PARAMS):
+        chunk = doc_ids[i:i + SQLITE_MAX_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT doc_id FROM doc_metadata WHERE doc_id IN ({placeholders})", chunk)
+        found.update(str(doc_id) for doc_id, in rows)
+    conn.close()
+    return found
+
+
+def tombstone_documents(manifest, doc_ids):
+    """Tombstone the live copy of each doc ID in manifest; returns how many live documents were removed."""
+    remaining = {str(doc_id) for doc_id in doc_ids}
+    removed = 0
+    for name, db_path in _sources(manifest):
+        if not remaining:
+            break
+        dead = set(manifest["tombstones"].get(name, []))
+        found = _docs_in(db_path, remaining - dead)
+        if found:
+            manifest["tombstones"][name] = sorted(dead | found)
+            remaining -= found
+            removed += len(found)
+    return removed
+
+
+def write_segment(name, accumulated, doc_map, title_map, heading_map, doc_lengths):
+    os.makedirs(SEGMENT_DIR, exist_ok=True)
+    tmp_path = segment_path(name) + ".tmp"
+    write_index_to_sqlite(
+        accumulated.postings(), accumulated.field_postings(), doc_map, title_map, heading_map, len(doc_map),
+        backend="sqlite", db_path=tmp_path, doc_lengths=doc_lengths
+    )
+    os.replace(tmp_path, segment_path(name))
+
+
+def add_documents(paths, workers=1, merge=True, offline=False):
+    """Index the pages at paths into a new segment, replacing older copies of the same URLs.
+
+    Pages that are now dead or skipped are removed from the index. Returns the
+    new segment's name, or None if no page was indexed.
+    """
+    # Pages are checked against the duplicate state of the whole index, so concurrent adds take turns
+    with _dedup_lock:
+        name = _write_update(paths, workers, offline)
+    if merge:
+        merge_in_background()
+    return name
+
+
+def _write_update(paths, workers, offline):
+    accumulated = PostingsAccumulator()
+    doc_map = {}
+    title_map = {}
+    heading_map = {}
+    doc_lengths = {}
+    removed_ids = []
+    duplicates = DuplicateIndex.load()
+
+    for path, page in parse_pages(paths, workers, offline, shingle_size=duplicates.shingle_size):
+        if "error" in page:
+            print(f"[ERROR] Failed to process {os.path.basename(path)}: {page['error']}")
+            continue
+        url = page["url"]
+        if not url:
+            continue
+        doc_id = stable_hash_url(url)
+        if page["dead"] or page["skip"]:
+            print(f"[SKIP] Dead URL: {url}" if page["dead"] else page["skip"])
+            removed_ids.append(doc_id)
+            continue
+        if doc_id in doc_map:
+            continue
+        duplicate = duplicates.check(doc_id, page["content_hash"], page["minhash"])
+        if duplicate is not None:
+            print(f"[SKIP] {'Exact duplicate' if duplicate == 'exact' else 'Near duplicate (MinHash)'}: {url}")
+            # The page no longer has content of its own, so an older copy of it is removed too
+            removed_ids.append(doc_id)
+            continue
+        duplicates.add(doc_id, page["content_hash"], page["minhash"])
+
+        accumulated.add(doc_id, page["tokens"], page["field_terms"])
+        title_map[doc_id] = page["title"]
+        heading_map[doc_id] = page["headings"]
+        doc_map[doc_id] = url
+        doc_lengths[doc_id] = len(page["tokens"])
+
+    with _manifest_lock:
+        manifest = open_manifest()
+        name = None
+        if doc_map:
+            name = f"seg_{manifest['next_segment']:06d}"
+            manifest["next_segment"] += 1
+            write_segment(name, accumulated, doc_map, title_map, heading_map, doc_lengths)
+        # Tombstone older copies before the new segment joins the manifest
+        removed = tombstone_documents(manifest, list(doc_map) + removed_ids)
+        if name:
+            manifest["segments"].append({"name": name, "docs": len(doc_map)})
+        manifest["doc_count"] += len(doc_map) - removed
+        save_manifest(manifest)
+    duplicates.remove(removed_ids)
+    duplicates.save()
+
+    print(f"Indexed {len(doc_map)} documents into {name or 'no segment'}, removed {removed} older copies")
+    print(f"Skipped {duplicates.exact_duplicates} exact and {duplicates.near_duplicates} near duplicates")
+    return name
+
+
+def delete_documents(urls, merge=True):
+    """Tombstone the pages with the given URLs; returns how many live documents were removed."""
+    doc_ids = [stable_hash_url(url) for url in urls]
+    with _manifest_lock:
+        manifest = open_manifest()
+        removed = tombstone_documents(manifest, doc_ids)
+        manifest["doc_count"] -= removed
+        save_manifest(manifest)
+    with _dedup_lock:
+        duplicates = DuplicateIndex.load()
+        duplicates.remove(doc_ids)
+        duplicates.save()
+    if merge:
+        merge_in_background()
+    return removed
+
+
+def _tier(live_docs):
+    tier = 0
+    while live_docs >= SEGMENT_MERGE_FACTOR ** (tier + 1):
+        tier += 1
+    return tier
+
+
+def select_merge(manifest):
+    """Segments to merge next: every fully deleted segment, or the smallest tier holding SEGMENT_MERGE_FACTOR segments."""
+    tiers = defaultdict(list)
+    empty = []
+    for segment in manifest["segments"]:
+        if segment["name"] in _merging:
+            continue
+        live = segment["docs"] - len(manifest["tombstones"].get(segment["name"], []))
+        if live == 0:
+            empty.append(segment["name"])
+        else:
+            tiers[_tier(live)].append(segment["name"])
+    if empty:
+        return empty
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= SEGMENT_MERGE_FACTOR:
+            return tiers[tier][:SEGMENT_MERGE_FACTOR]
+    return []
+
+
+def _field_terms(conn):
+    for term, data in conn.execute("SELECT term, postings FROM field_index ORDER BY term"):
+        yield term, decode_field_postings(data)
+
+
+def _live_terms(db_path, read, dead):
+    """Term-sorted (term, postings) that read(conn) yields for one segment, without tombstoned documents."""
+    conn = sqlite3.connect(db_path)
+    try:
+        for term, postings in read(conn):
+            postings = {doc_id: p for doc_id, p in postings.items() if doc_id not in dead}
+            if postings:
+                yield term, postings
+    finally:
+        conn.close()
+
+
+def _merged_postings(merged_streams):
+    # A doc ID is live in only one segment, so the per-segment postings never overlap
+    for term, parts in merged_streams:
+        merged = {}
+        for postings in parts:
+            merged.update(postings)
+        yield term, merged
+
+
+def write_merged_segment(name, sources):
+    """Write the live documents of sources [(segment name, tombstoned IDs)] as segment name; returns its doc count."""
+    doc_map = {}
+    title_map = {}
+    heading_map = {}
+    doc_lengths = {}
+    for source, dead in sources:
+        conn = sqlite3.connect(segment_path(source))
+        rows = conn.execute("SELECT doc_id, url, title, headings, length FROM doc_metadata")
+        for doc_id, url, title, headings, length in rows:
+            if str(doc_id) not in dead:
+                doc_map[str(doc_id)] = url
+                title_map[str(doc_id)] = title
+                heading_map[str(doc_id)] = headings
+                doc_lengths[str(doc_id)] = length
+        conn.close()
+    if not doc_map:
+        return 0
+
+    body = merge_term_streams([_live_terms(segment_path(s), read_sqlite_postings, dead) for s, dead in sources])
+    fields = merge_term_streams([_live_terms(segment_path(s), _field_terms, dead) for s, dead in sources])
+    tmp_path = segment_path(name) + ".tmp"
+    write_index_to_sqlite(
+        _merged_postings(body), _merged_postings(fields), doc_map, title_map, heading_map, len(doc_map),
+        backend="sqlite", db_path=tmp_path, doc_lengths=doc_lengths
+    )
+    os.replace(tmp_path, segment_path(name))
+    return len(doc_map)
+
+
+def merge_segments(names=None):
+    """Merge segments (by default the ones chosen by select_merge) into one, dropping tombstoned documents.
+
+    Returns True if the manifest changed.
+    """
+    with _manifest_lock:
+        manifest = open_manifest()
+        current = [segment["name"] for segment in manifest["segments"]]
+        names = select_merge(manifest) if names is None else [n for n in names if n in current and n not in _merging]
+        if not names:
+            return False
+        name = f"seg_{manifest['next_segment']:06d}"
+        manifest["next_segment"] += 1
+        save_manifest(manifest)
+        dropped = {n: set(manifest["tombstones"].get(n, [])) for n in names}
+        _merging.update(names)
+
+    try:
+        # The sources are immutable, so the merge itself runs without holding the lock
+        docs = write_merged_segment(name, [(n, dropped[n]) for n in names])
+
+        with _manifest_lock:
+            manifest = open_manifest()
+            # Tombstones added while merging now apply to the merged copies of those documents
+            late = set()
+            for n in names:
+                late |= set(manifest["tombstones"].pop(n, [])) - dropped[n]
+            position = next(i for i, s in enumerate(manifest["segments"]) if s["name"] in names)
+            manifest["segments"] = [s for s in manifest["segments"] if s["name"] not in names]
+            if docs:
+                manifest["segments"].insert(position, {"name": name, "docs": docs})
+                if late:
+                    manifest["tombstones"][name] = sorted(late)
+            save_manifest(manifest)
+    finally:
+        with _manifest_lock:
+            _merging.difference_update(names)
+
+    for n in names:
+        os.remove(segment_path(n))
+    print(f"Merged {len(names)} segments into {name if docs else 'nothing'} ({docs} documents)")
+    return True
+
+
+def merge_until_stable():
+    while merge_segments():
+        pass
+
+
+def merge_in_background():
+    """Apply the merge policy on a background thread so updates return as soon as their segment is written."""
+    thread = threading.Thread(target=merge_until_stable, name="segment-merge")
+    thread.start()
+    return thread
+
+
+def expand_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_data_files(path)
+        else:
+            yield path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the index without a full rebuild.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add_parser = sub.add_parser("add", help="index new or changed pages (files or directories) into a segment")
+    add_parser.add_argument("paths", nargs="+")
+    add_parser.add_argument("--workers", type=int, default=1)
+    add_parser.add_argument("--offline", action="store_true", help="use cached URL liveness results only")
+    delete_parser = sub.add_parser("delete", help="remove pages from the index by URL")
+    delete_parser.add_argument("urls", nargs="+")
+    sub.add_parser("merge", help="compact every segment into one")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        add_documents(list(expand_paths(args.paths)), workers=args.workers, offline=args.offline)
+    elif args.command == "delete":
+        print(f"Removed {delete_documents(args.urls)} documents")
+    else:
+        merge_segments([segment["name"] for segment in open_manifest()["segments"]])
@@ -0,0 +1,190 @@
+"""
+Long-running HTTP/JSON query service.
+
+    python service.py --port 8080 --processes 4
+    curl 'http://localhost:8080/search?q=machine+learning&k=10'
+
+Each worker process serves requests on a thread per connection. Every
+thread calls search.execute_query against the same read-only state: the
+DocStore, the postings cache and the memory-mapped index files. With
+--processes N, the listening socket is bound once and N forked workers
+accept on it, so queries use several cores. The mmap'd index pages are
+shared between workers through the OS page cache.
+
+Endpoints:
+    GET /search?q=...&k=5&mode=topk   ranked results with scores and timing
+    GET /search?q=...&mode=bm25&k1=1.2&b=0.75   BM25 ranking with its parameters
+    GET /suggest?q=mach&k=10          most frequent indexed terms completing the last word of q
+    GET /stats                        postings and result cache statistics for this worker
+    GET /metrics                      per-stage query timings for this worker (Prometheus text)
+    GET /health
+
+Stage timings are only recorded when the service is started with --metrics.
+With --warm FILE, the queries in FILE (one per line) are run once before
+the workers fork, so every worker starts with their results cached.
+"""
+
+import argparse
+import json
+import os
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from constants import TOP_K, QUERY_MODE, BM25_K1, BM25_B, SUGGESTION_COUNT
+from index_store import DocStore, postings_cache, result_cache
+from metrics import metrics
+from search import execute_query, suggest, warm_result_cache
+
+QUERY_MODES = {"topk", "vectorized", "exhaustive", "conjunctive", "bm25"}
+MAX_RESULTS = 100
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    doc_store = None  # Set once per process by serve()
+
+    def send_text(self, status, text):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/search":
+            self.handle_search(params)
+        elif url.path == "/suggest":
+            self.handle_suggest(params)
+        elif url.path == "/stats":
+            self.send_json(200, {
+                "pid": os.getpid(),
+                "postings_cache": postings_cache.stats(),
+                "result_cache": result_cache.stats(),
+            })
+        elif url.path == "/metrics":
+            self.send_text(200, metrics.to_prometheus())
+        elif url.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"unknown path {url.path}"})
+
+    def handle_search(self, params):
+        query = params.get("q", [""])[0].strip()
+        mode = params.get("mode", [QUERY_MODE])[0]
+        try:
+            k = int(params.get("k", [TOP_K])[0])
+        except ValueError:
+            k = 0
+        try:
+            k1 = float(params.get("k1", [BM25_K1])[0])
+            b = float(params.get("b", [BM25_B])[0])
+        except ValueError:
+            k1 = b = -1.0
+        if not query:
+            return self.send_json(400, {"error": "missing query parameter q"})
+        if mode not in QUERY_MODES:
+            return self.send_json(400, {"error": f"mode must be one of {sorted(QUERY_MODES)}"})
+        if not 1 <= k <= MAX_RESULTS:
+            return self.send_json(400, {"error": f"k must be between 1 and {MAX_RESULTS}"})
+        if not (k1 >= 0 and 0 <= b <= 1):
+            return self.send_json(400, {"error": "k1 must be a number >= 0 and b a number between 0 and 1"})
+
+        start_time = time.time()
+        result = execute_query(query, self.doc_store, mode=mode, k=k, skip_missing=True, k1=k1, b=b)
+        results = []
+        for rank, (doc_id, score) in enumerate(result["results"], 1):
+            url, title, _ = self.doc_store.metadata(doc_id) or ("", "", "")
+            results.append({"rank": rank, "doc_id": str(doc_id), "url": url, "title": title, "score": score})
+        self.send_json(200, {
+            "query": query,
+            "terms": result["terms"],
+            "missing_terms": result["missing"],
+            "results": results,
+            "scored": result["scored"],
+            "cached": result["cached"],
+            "ranking_ms": result["elapsed_ms"],
+            "took_ms": (time.time() - start_time) * 1000,
+        })
+
+    def handle_suggest(self, params):
+        text = params.get("q", [""])[0]
+        try:
+            k = int(params.get("k", [SUGGESTION_COUNT])[0])
+        except ValueError:
+            k = 0
+        if not text.strip():
+            return self.send_json(400, {"error": "missing query parameter q"})
+        if not 1 <= k <= MAX_RESULTS:
+            return self.send_json(400, {"error": f"k must be between 1 and {MAX_RESULTS}"})
+
+        start_time = time.time()
+        suggestions = [{"term": term, "df": df} for term, df in suggest(text, k)]
+        self.send_json(200, {"query": text, "suggestions": suggestions, "took_ms": (time.time() - start_time) * 1000})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=8080, processes=1, warm_queries=()):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    # Opened before forking so workers share the mapped pages instead of each loading them
+    SearchHandler.doc_store = DocStore()
+    if warm_queries:
+        stats = warm_result_cache(SearchHandler.doc_store, warm_queries)
+        print(f"Warmed the result cache with {stats['entries']} queries")
+
+    children = []
+    for _ in range(processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = None
+            break
+        children.append(pid)
+
+    server = ThreadingHTTPServer((host, port), SearchHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.daemon_threads = True
+    if children is not None:
+        print(f"Serving search on http://{host}:{port} with {processes} process(es)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for pid in children or []:
+            os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve search queries over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes sharing the listening socket (Unix only when > 1)")
+    parser.add_argument("--metrics", action="store_true", help="record per-stage query timings for /metrics")
+    parser.add_argument("--warm", metavar="FILE", help="queries to cache before serving, one per line")
+    args = parser.parse_args()
+    metrics.enabled = metrics.enabled or args.metrics
+    warm_queries = []
+    if args.warm:
+        with open(args.warm, "r", encoding="utf-8") as f:
+            warm_queries = [line.strip() for line in f if line.strip()]
+    serve(args.host, args.port, args.processes, warm_queries)
@@ -0,0 +1,105 @@
+"""
+Top-k query evaluation with MaxScore pruning.
+
+Documents are visited in doc ID order (document-at-a-time). Each query term
+carries an upper bound built from its IDF and the largest field boost it
+earns in any document (stored in field_index at build time). A term's list
+covers both its body and its field postings, so a document never reached
+through a term cannot get anything from that term. Terms whose combined
+bound cannot beat the current k-th best score become non-essential: their
+postings are only probed for documents found through the essential terms,
+so the bulk of a common term's postings is never visited, and candidates
+whose bound falls below the threshold are never scored.
+"""
+
+import heapq
+
+from scoring import score_candidate, field_boost, static_prior, max_static_prior, PHRASE_BOOST, PROXIMITY_BOOST
+
+
+class _Cursor:
+    __slots__ = ("term", "doc_ids", "pos")
+
+    def __init__(self, term, doc_ids):
+        self.term = term
+        self.doc_ids = doc_ids
+        self.pos = 0
+
+    def current(self):
+        return self.doc_ids[self.pos] if self.pos < len(self.doc_ids) else None
+
+
+def top_k_documents(terms, postings_dict, idf_values, field_postings, term_bounds, doc_map, k=5,
+                    proximity_weight=PROXIMITY_BOOST):
+    """Return ([(doc_id, score), ...] best first, number of documents fully scored).
+
+    Produces the same ranking as scoring every document in the union of the
+    query terms' body postings with score_candidate.
+    """
+    n_terms = len(terms)
+    counts = {t: terms.count(t) for t in dict.fromkeys(terms)}
+    # Phrase and proximity boosts only go to documents containing every query term
+    full_match_boost = PHRASE_BOOST + (proximity_weight if len(counts) > 1 else 0)
+    # Terms missing from the body index can still add field boosts to any candidate
+    fixed_boost = sum(counts[t] * term_bounds.get(t, 0) for t in counts if t not in postings_dict)
+    # Every document also earns its PageRank prior, bounded by the largest one in the index
+    fixed_boost += max_static_prior(doc_map)
+
+    def set_bound(subset):
+        """Largest score of a document whose body and field matches all come from subset."""
+        m = sum(counts[t] for t in subset)
+        best = max(idf_values.get(t, 0) for t in subset)
+        best += sum(counts[t] * term_bounds.get(t, 0) for t in subset) + fixed_boost
+        if m == n_terms:
+            best += full_match_boost
+        return (m / n_terms) * best
+
+    ordered = sorted(postings_dict, key=lambda t: set_bound([t]))
+    cursors = [
+        _Cursor(t, sorted({int(d) for d in postings_dict[t]} | {int(d) for d in field_postings.get(t, {})}))
+        for t in ordered
+    ]
+    prefix_bounds = [set_bound(ordered[:i + 1]) for i in range(len(ordered))]
+
+    heap = []  # (score, doc_id) min-heap holding the best k so far
+    threshold = float("-inf")
+    first_essential = 0
+    scored = 0
+
+    while first_essential < len(cursors):
+        essential = cursors[first_essential:]
+        live = [d for d in (c.current() for c in essential) if d is not None]
+        if not live:
+            break
+        doc = min(live)
+        doc_id = str(doc)
+
+        matched = [t for t in postings_dict if doc_id in postings_dict[t]]
+        if matched:
+            m = sum(counts[t] for t in matched)
+            bound = max(idf_values.get(t, 0) for t in matched) + field_boost(doc_id, terms, field_postings)
+            bound += static_prior(doc_map, doc_id)
+            if m == n_terms:
+                bound += full_match_boost
+            bound *= m / n_terms
+
+            if len(heap) < k or bound > threshold:
+                score, _ = score_candidate(
+                    doc_id, terms, postings_dict, idf_values, field_postings, doc_map, proximity_weight
+                )
+                scored += 1
+                if len(heap) < k:
+                    heapq.heappush(heap, (score, doc_id))
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, doc_id))
+                if len(heap) == k and heap[0][0] > threshold:
+                    threshold = heap[0][0]
+                    while first_essential < len(cursors) and prefix_bounds[first_essential] <= threshold:
+                        first_essential += 1
+
+        for c in essential:
+            if c.current() == doc:
+                c.pos += 1
+
+    ranked = sorted(heap, key=lambda x: x[0], reverse=True)
+    return [(doc_id, score) for score, doc_id in ranked], scored
@@ -3,32 +3,46 @@ import hashlib
 from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 from nltk.stem import PorterStemmer
-import nltk
 import requests
 from functools import lru_cache
 
-from constants import STOPWORDS
+from constants import STOPWORDS, STEM_CACHE_SIZE
 
-nltk.download('punkt')
 stemmer = PorterStemmer()
+# Word frequencies are Zipfian, so a bounded memo answers almost every stem after the first few pages
+stem = lru_cache(maxsize=STEM_CACHE_SIZE)(stemmer.stem)
 
-def tokenize(text):
-    try:
-        soup = BeautifulSoup(text, "html.parser")
-        clean_text = soup.get_text(separator=" ", strip=True)
-    except Exception:
-        clean_text = text
-    tokens = re.findall(r'\b[a-zA-Z0-9]+\b', clean_text.lower())
+TOKEN_RE = re.compile(r'\b[a-zA-Z0-9]+\b')
+# A tag or character reference that html.parser would turn into something else
+MARKUP_RE = re.compile(r'<[a-zA-Z/!?]|&[a-zA-Z#]')
+
+def tokenize_text(text):
+    """Tokens of plain text, such as get_text() output, using only the token regex."""
+    tokens = TOKEN_RE.findall(text.lower())
     return [token for token in tokens if not token.isdigit() and len(token) > 1 and token not in STOPWORDS]
 
+def tokenize(text):
+    # Only text that could contain markup goes through an HTML parse, which leaves anything else unchanged
+    if MARKUP_RE.search(text):
+        try:
+            soup = BeautifulSoup(text, "html.parser")
+            text = soup.get_text(separator=" ", strip=True)
+        except Exception:
+            pass
+    return tokenize_text(text)
+
 def stem_tokens(tokens):
-    return [stemmer.stem(token) for token in tokens]
+    return [stem(token) for token in tokens]
 
 def process_query_terms(query, remove_stopwords=True):
     tokens = query.lower().split()
     if remove_stopwords:
         tokens = [t for t in tokens if t not in STOPWORDS]
-    return [stemmer.stem(t) for t in tokens]
+    # "prefix*" is kept unstemmed for search to expand into indexed terms
+    return [t.rstrip("*") + "*" if is_prefix_term(t) else stem(t) for t in tokens]
+
+def is_prefix_term(term):
+    return term.endswith("*") and len(term.rstrip("*")) > 0
 
 def stable_hash_url(url):
     return int(hashlib.md5(url.encode()).hexdigest()[:8], 16)
@@ -84,7 +98,8 @@ def is_valid(url):
             r"|rm|smil|wmv|swf|wma|zip|rar|gz|img|ppsx|xml)$",
             parsed.path.lower()
         )
-    except TypeError:
+    except (TypeError, ValueError):
+        # ValueError: malformed URLs such as "http://[bad/page" (an unclosed IPv6 host)
         return False
 
 
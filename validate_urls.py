@@ -1,25 +1,21 @@
 # validate_urls.py
 import json
-import requests
+from liveness import check_urls
 from utils import normalize_url
 
 INPUT = "doc_map.json"
 OUTPUT = "doc_map_cleaned.json"
 
-def is_url_alive(url):
-    try:
-        res = requests.head(url, timeout=3, allow_redirects=True)
-        return res.status_code < 400
-    except:
-        return False
-
 with open(INPUT, "r", encoding="utf-8") as f:
     doc_map = json.load(f)
 
+# Checked concurrently, and cached in liveness.db for the next run or index build
+live = check_urls((normalize_url(url) for url in doc_map.values()), timeout=3)
+
 cleaned_map = {}
 for doc_id, url in doc_map.items():
     normalized = normalize_url(url)
-    if is_url_alive(normalized):
+    if live[normalized]:
         cleaned_map[doc_id] = normalized
     else:
         print(f"[✗] {normalized} is dead or unreachable.")